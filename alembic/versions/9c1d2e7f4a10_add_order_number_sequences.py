@@ -0,0 +1,40 @@
+"""add_order_number_sequences
+
+Revision ID: 9c1d2e7f4a10
+Revises: 61fbc8887b89
+Create Date: 2026-10-17 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c1d2e7f4a10'
+down_revision = '61fbc8887b89'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('order_number_sequences',
+    sa.Column('restaurant_id', sa.String(), nullable=False),
+    sa.Column('last_value', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('restaurant_id')
+    )
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('bill_number', sa.String(), nullable=True))
+
+    # Start each restaurant's counter after the highest order number already in use
+    op.execute(
+        "INSERT INTO order_number_sequences (restaurant_id, last_value, updated_at) "
+        "SELECT restaurant_id, MAX(order_number), CURRENT_TIMESTAMP FROM orders "
+        "WHERE restaurant_id IS NOT NULL AND order_number IS NOT NULL GROUP BY restaurant_id"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('bill_number')
+    op.drop_table('order_number_sequences')
@@ -0,0 +1,45 @@
+"""add_menu_import_jobs
+
+Revision ID: a3d7f1c9e5b2
+Revises: f2c6a8e0b4d3
+Create Date: 2026-10-17 23:41:12.518094
+
+Menu sheets imported in the background, with their progress and row errors (see crud_menu_import).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d7f1c9e5b2'
+down_revision = 'f2c6a8e0b4d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('menu_import_jobs',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('restaurant_id', sa.String(), nullable=False),
+    sa.Column('created_by', sa.String(), nullable=False),
+    sa.Column('filename', sa.String(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('total_rows', sa.Integer(), nullable=True),
+    sa.Column('processed_rows', sa.Integer(), nullable=False),
+    sa.Column('created_items', sa.Integer(), nullable=False),
+    sa.Column('error_count', sa.Integer(), nullable=False),
+    sa.Column('errors', sa.JSON(), nullable=True),
+    sa.Column('message', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['restaurant_id'], ['restaurants.restaurant_id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_menu_import_jobs_restaurant_id'), 'menu_import_jobs', ['restaurant_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_menu_import_jobs_restaurant_id'), table_name='menu_import_jobs')
+    op.drop_table('menu_import_jobs')
@@ -0,0 +1,54 @@
+"""add_open_table_orders
+
+Revision ID: a8d3e6b1f5c9
+Revises: f2a7c4d9e813
+Create Date: 2026-10-17 15:06:12.814530
+
+Backfills open_table_orders from the currently open orders and adds a partial unique index so a
+table can only have one open order. Fails, listing the tables, if some table already has several
+open orders; settle or cancel the extra orders and rerun.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d3e6b1f5c9'
+down_revision = 'f2a7c4d9e813'
+branch_labels = None
+depends_on = None
+
+# Keep in sync with models.OPEN_ORDER_PREDICATE
+OPEN_ORDER_PREDICATE = "payment_status = 'Pending' AND status <> 'Cancelled' AND table_number <> ''"
+
+
+def upgrade():
+    conn = op.get_bind()
+    duplicates = conn.execute(sa.text(
+        f"SELECT restaurant_id, table_number, COUNT(*) FROM orders WHERE {OPEN_ORDER_PREDICATE} "
+        "GROUP BY restaurant_id, table_number HAVING COUNT(*) > 1"
+    )).fetchall()
+    if duplicates:
+        listed = ", ".join(f"{row[0]}/table {row[1]} ({row[2]} orders)" for row in duplicates[:20])
+        raise RuntimeError(f"Tables with more than one open order: {listed}. Settle or cancel the extra orders first.")
+
+    op.create_table('open_table_orders',
+    sa.Column('restaurant_id', sa.String(), nullable=False),
+    sa.Column('table_number', sa.String(), nullable=False),
+    sa.Column('order_id', sa.String(), nullable=False),
+    sa.Column('opened_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ),
+    sa.PrimaryKeyConstraint('restaurant_id', 'table_number'),
+    sa.UniqueConstraint('order_id')
+    )
+    op.execute(
+        "INSERT INTO open_table_orders (restaurant_id, table_number, order_id, opened_at) "
+        f"SELECT restaurant_id, table_number, id, created_at FROM orders WHERE {OPEN_ORDER_PREDICATE} AND restaurant_id IS NOT NULL"
+    )
+    op.create_index('uq_orders_open_table', 'orders', ['restaurant_id', 'table_number'], unique=True,
+                    postgresql_where=sa.text(OPEN_ORDER_PREDICATE), sqlite_where=sa.text(OPEN_ORDER_PREDICATE))
+
+
+def downgrade():
+    op.drop_index('uq_orders_open_table', table_name='orders')
+    op.drop_table('open_table_orders')
@@ -0,0 +1,114 @@
+"""add_order_archive_tables
+
+Revision ID: b6e2f8d4c1a7
+Revises: a8d3e6b1f5c9
+Create Date: 2026-10-17 17:52:40.318206
+
+Creates the archived_* tables that crud_archive.archive_closed_orders moves closed orders into,
+indexes orders.updated_at for picking them, and drops the audit_logs.order_id foreign key so an
+order's audit trail stays in place when the order is archived. SQLite never enforced that key and
+cannot drop it without rebuilding the table, so it is left there.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2f8d4c1a7'
+down_revision = 'a8d3e6b1f5c9'
+branch_labels = None
+depends_on = None
+
+
+def _audit_order_fk():
+    for fk in sa.inspect(op.get_bind()).get_foreign_keys('audit_logs'):
+        if fk['constrained_columns'] == ['order_id'] and fk['referred_table'] == 'orders':
+            return fk['name']
+    return None
+
+
+def upgrade():
+    op.create_table('archived_orders',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('user_uid', sa.String(), nullable=False),
+    sa.Column('customer_uid', sa.String(), nullable=True),
+    sa.Column('user_role', sa.String(), nullable=True),
+    sa.Column('table_number', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('total_cost', sa.Float(), nullable=False),
+    sa.Column('payment_status', sa.String(), nullable=True),
+    sa.Column('restaurant_id', sa.String(), nullable=True),
+    sa.Column('restaurant_name', sa.String(), nullable=True),
+    sa.Column('order_number', sa.Integer(), nullable=True),
+    sa.Column('bill_number', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['customer_uid'], ['users.uid'], ),
+    sa.ForeignKeyConstraint(['user_uid'], ['users.uid'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_archived_orders_customer_uid', 'archived_orders', ['customer_uid'], unique=False)
+    op.create_index('ix_archived_orders_restaurant_created_at_id', 'archived_orders', ['restaurant_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_archived_orders_created_at_id', 'archived_orders', ['created_at', 'id'], unique=False)
+
+    op.create_table('archived_order_status_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), nullable=True),
+    sa.Column('changed_by', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['archived_orders.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_archived_order_status_history_order_id', 'archived_order_status_history', ['order_id'], unique=False)
+
+    op.create_table('archived_order_items',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.String(), nullable=True),
+    sa.Column('item_id', sa.Integer(), nullable=True),
+    sa.Column('quantity', sa.Integer(), nullable=True),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('options', sa.JSON(), nullable=True),
+    sa.ForeignKeyConstraint(['item_id'], ['menu_items.id'], ),
+    sa.ForeignKeyConstraint(['order_id'], ['archived_orders.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_archived_order_items_order_id', 'archived_order_items', ['order_id'], unique=False)
+
+    op.create_table('archived_payments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.String(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('method', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.Column('paid_at', sa.DateTime(), nullable=True),
+    sa.Column('transaction_id', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['order_id'], ['archived_orders.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_archived_payments_order_id', 'archived_payments', ['order_id'], unique=False)
+
+    op.create_index('ix_orders_updated_at', 'orders', ['updated_at'], unique=False)
+
+    if op.get_bind().dialect.name != 'sqlite':
+        name = _audit_order_fk()
+        if name:
+            op.drop_constraint(name, 'audit_logs', type_='foreignkey')
+
+
+def downgrade():
+    # Archived orders are not moved back; restore them into the hot tables first if they are needed
+    if op.get_bind().dialect.name != 'sqlite' and _audit_order_fk() is None:
+        op.create_foreign_key('audit_logs_order_id_fkey', 'audit_logs', 'orders', ['order_id'], ['id'])
+    op.drop_index('ix_orders_updated_at', table_name='orders')
+    op.drop_index('ix_archived_payments_order_id', table_name='archived_payments')
+    op.drop_table('archived_payments')
+    op.drop_index('ix_archived_order_items_order_id', table_name='archived_order_items')
+    op.drop_table('archived_order_items')
+    op.drop_index('ix_archived_order_status_history_order_id', table_name='archived_order_status_history')
+    op.drop_table('archived_order_status_history')
+    op.drop_index('ix_archived_orders_created_at_id', table_name='archived_orders')
+    op.drop_index('ix_archived_orders_restaurant_created_at_id', table_name='archived_orders')
+    op.drop_index('ix_archived_orders_customer_uid', table_name='archived_orders')
+    op.drop_table('archived_orders')
@@ -0,0 +1,42 @@
+"""add_combo_expansions
+
+Revision ID: b8e4c2a6d0f9
+Revises: a3d7f1c9e5b2
+Create Date: 2026-10-18 00:36:27.140583
+
+Each combo's components flattened through nested combos (see crud_menu.rebuild_combo_expansions).
+Combos could not contain combos before this revision, so the backfill is one level deep.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e4c2a6d0f9'
+down_revision = 'a3d7f1c9e5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('combo_expansions',
+    sa.Column('combo_menu_item_id', sa.Integer(), nullable=False),
+    sa.Column('component_menu_item_id', sa.Integer(), nullable=False),
+    sa.Column('restaurant_id', sa.String(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['combo_menu_item_id'], ['menu_items.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['component_menu_item_id'], ['menu_items.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('combo_menu_item_id', 'component_menu_item_id')
+    )
+    op.create_index(op.f('ix_combo_expansions_restaurant_id'), 'combo_expansions', ['restaurant_id'], unique=False)
+    op.execute(
+        "INSERT INTO combo_expansions (combo_menu_item_id, component_menu_item_id, restaurant_id, quantity) "
+        "SELECT c.combo_menu_item_id, c.component_menu_item_id, m.restaurant_id, SUM(c.quantity) "
+        "FROM combo_item_components c JOIN menu_items m ON m.id = c.combo_menu_item_id "
+        "GROUP BY c.combo_menu_item_id, c.component_menu_item_id, m.restaurant_id"
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_combo_expansions_restaurant_id'), table_name='combo_expansions')
+    op.drop_table('combo_expansions')
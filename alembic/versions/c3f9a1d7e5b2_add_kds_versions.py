@@ -0,0 +1,31 @@
+"""add_kds_versions
+
+Revision ID: c3f9a1d7e5b2
+Revises: b6e2f8d4c1a7
+Create Date: 2026-10-17 19:24:08.561937
+
+Per-restaurant version counter bumped by every order lifecycle change (see crud_kds). Rows are
+created on a restaurant's first change, so there is nothing to backfill.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f9a1d7e5b2'
+down_revision = 'b6e2f8d4c1a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('kds_versions',
+    sa.Column('restaurant_id', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('restaurant_id')
+    )
+
+
+def downgrade():
+    op.drop_table('kds_versions')
@@ -0,0 +1,26 @@
+"""add_sales_rollup_placed_count
+
+Revision ID: c7d2f4a8b1e3
+Revises: b8e4c2a6d0f9
+Create Date: 2026-10-18 09:14:52.602371
+
+Orders created per bucket, whatever their status. Fill it for existing orders afterwards with
+`python -m app.utils.rollup_backfill`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2f4a8b1e3'
+down_revision = 'b8e4c2a6d0f9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('sales_rollups', sa.Column('placed_count', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('sales_rollups', 'placed_count')
@@ -0,0 +1,48 @@
+"""add_order_hot_path_indexes
+
+Revision ID: d3b8a61c5e27
+Revises: 9c1d2e7f4a10
+Create Date: 2026-10-17 11:40:03.552871
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3b8a61c5e27'
+down_revision = '9c1d2e7f4a10'
+branch_labels = None
+depends_on = None
+
+# (index name, table, columns) - names match the Index/index=True declarations in app/models.py
+INDEXES = [
+    ('ix_orders_restaurant_table_payment_status', 'orders', ['restaurant_id', 'table_number', 'payment_status']),
+    ('ix_orders_restaurant_created_at_id', 'orders', ['restaurant_id', 'created_at', 'id']),
+    ('ix_order_items_order_id', 'order_items', ['order_id']),
+    ('ix_payments_order_id', 'payments', ['order_id']),
+    ('ix_order_status_history_order_id', 'order_status_history', ['order_id']),
+    ('ix_audit_logs_order_id', 'audit_logs', ['order_id']),
+    ('ix_claimed_rewards_uid_restaurant_redeemed_at', 'claimed_rewards', ['uid', 'restaurant_id', 'redeemed_at']),
+]
+
+
+def upgrade():
+    # IF NOT EXISTS: some databases already carry ix_audit_logs_order_id from earlier manual changes
+    if op.get_bind().dialect.name == 'postgresql':
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+    else:
+        for name, table, columns in INDEXES:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, _, _ in reversed(INDEXES):
+                op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    else:
+        for name, _, _ in reversed(INDEXES):
+            op.execute(f"DROP INDEX IF EXISTS {name}")
@@ -0,0 +1,38 @@
+"""add_order_client_order_id
+
+Revision ID: d5a8c2e4f7b1
+Revises: c3f9a1d7e5b2
+Create Date: 2026-10-17 20:41:53.207614
+
+Adds orders.client_order_id, the UUID a POS assigns to an order it took offline, unique per
+restaurant so uploading the same order again is detected (see crud_ingest), and the same column
+on archived_orders so archiving keeps it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a8c2e4f7b1'
+down_revision = 'c3f9a1d7e5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('client_order_id', sa.String(), nullable=True))
+    op.create_index('uq_orders_restaurant_client_order_id', 'orders', ['restaurant_id', 'client_order_id'], unique=True)
+
+    with op.batch_alter_table('archived_orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('client_order_id', sa.String(), nullable=True))
+    op.create_index('ix_archived_orders_restaurant_client_order_id', 'archived_orders', ['restaurant_id', 'client_order_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_archived_orders_restaurant_client_order_id', table_name='archived_orders')
+    with op.batch_alter_table('archived_orders', schema=None) as batch_op:
+        batch_op.drop_column('client_order_id')
+    op.drop_index('uq_orders_restaurant_client_order_id', table_name='orders')
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('client_order_id')
@@ -0,0 +1,47 @@
+"""add_sales_rollups
+
+Revision ID: e5f1a9c2b7d4
+Revises: d3b8a61c5e27
+Create Date: 2026-10-17 11:02:17.530961
+
+Populate the new tables afterwards with `python -m app.utils.rollup_backfill`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f1a9c2b7d4'
+down_revision = 'd3b8a61c5e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sales_rollups',
+    sa.Column('restaurant_id', sa.String(), nullable=False),
+    sa.Column('granularity', sa.String(), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('order_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('gross_sales', sa.Float(), nullable=False, server_default='0'),
+    sa.Column('refunded_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('refunded_sales', sa.Float(), nullable=False, server_default='0'),
+    sa.Column('cancelled_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('restaurant_id', 'granularity', 'bucket_start')
+    )
+    op.create_table('item_sales_rollups',
+    sa.Column('restaurant_id', sa.String(), nullable=False),
+    sa.Column('granularity', sa.String(), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('menu_item_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('sales', sa.Float(), nullable=False, server_default='0'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('restaurant_id', 'granularity', 'bucket_start', 'menu_item_id')
+    )
+
+
+def downgrade():
+    op.drop_table('item_sales_rollups')
+    op.drop_table('sales_rollups')
@@ -0,0 +1,32 @@
+"""add_menu_versions
+
+Revision ID: e7b3d9f1a2c4
+Revises: d5a8c2e4f7b1
+Create Date: 2026-10-17 21:36:12.480193
+
+Per-restaurant version counter bumped by every menu write (see crud_menu), which the menu cache
+compares against. Rows are created on a restaurant's first menu change, so there is nothing to
+backfill.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3d9f1a2c4'
+down_revision = 'd5a8c2e4f7b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('menu_versions',
+    sa.Column('restaurant_id', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('restaurant_id')
+    )
+
+
+def downgrade():
+    op.drop_table('menu_versions')
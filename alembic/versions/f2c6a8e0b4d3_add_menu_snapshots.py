@@ -0,0 +1,33 @@
+"""add_menu_snapshots
+
+Revision ID: f2c6a8e0b4d3
+Revises: e7b3d9f1a2c4
+Create Date: 2026-10-17 22:18:45.902316
+
+The public menu responses of each restaurant, compiled by every menu write (see crud_menu).
+Menus not written since are compiled when first read, so there is nothing to backfill.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c6a8e0b4d3'
+down_revision = 'e7b3d9f1a2c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('menu_snapshots',
+    sa.Column('restaurant_id', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('items', sa.LargeBinary(), nullable=False),
+    sa.Column('categories', sa.LargeBinary(), nullable=False),
+    sa.Column('built_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('restaurant_id')
+    )
+
+
+def downgrade():
+    op.drop_table('menu_snapshots')
@@ -0,0 +1,62 @@
+import hmac
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy.orm import Session
+from ...auth.custom_auth import get_current_user, security, TokenData
+from ...database import get_db
+from ...utils.loop_monitor import loop_monitor
+from ...utils.menu_cache import menu_cache
+from ...utils.menu_search import menu_search
+
+router = APIRouter(tags=["diagnostics"])
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "") # Bearer token a Prometheus scraper may send instead of a system admin's JWT
+
+def verify_system_admin(current_user: TokenData):
+    if current_user.role != "system_admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User does not have sufficient privileges for this operation.")
+
+@router.get("/event-loop")
+async def event_loop_report(current_user: TokenData = Depends(get_current_user)):
+    """
+    Event loop stalls since startup (or the last reset), per route, with the stacks of the most
+    recent ones. Requires LOOP_MONITOR_ENABLED.
+    """
+    verify_system_admin(current_user)
+    return loop_monitor.report()
+
+@router.delete("/event-loop")
+async def reset_event_loop_report(current_user: TokenData = Depends(get_current_user)):
+    """Clears the collected stalls, e.g. between load test runs."""
+    verify_system_admin(current_user)
+    loop_monitor.reset()
+    return {"message": "Event loop stall report cleared"}
+
+@router.get("/menu-cache")
+async def menu_cache_report(current_user: TokenData = Depends(get_current_user)):
+    """This worker's menu cache: restaurants and bytes held, hits, misses and evictions."""
+    verify_system_admin(current_user)
+    return menu_cache.stats()
+
+@router.get("/menu-search")
+async def menu_search_report(current_user: TokenData = Depends(get_current_user)):
+    """This worker's menu search indexes: restaurants and items held, hits, misses, builds and evictions."""
+    verify_system_admin(current_user)
+    return menu_search.stats()
+
+@router.get("/metrics")
+def metrics(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+    """
+    Prometheus metrics, including event_loop_stall_seconds{route} and event_loop_lag_seconds.
+    Requires a system admin, or METRICS_TOKEN as the bearer token (set it as the scrape job's
+    bearer_token, since Prometheus cannot log in).
+    """
+    if not (METRICS_TOKEN and hmac.compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode())):
+        verify_system_admin(get_current_user(credentials, db))
+    try:
+        from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+    except ImportError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="prometheus-client is not installed.")
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,11 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, File, UploadFile, Query, Response
 from sqlalchemy.orm import Session, joinedload, selectinload
-from typing import List, Optional
+from typing import List, Optional, Union
 from ... import schemas, crud, models
-from ...database import get_db
+from ...database import get_db, get_async_db, get_async_sessionmaker, USE_ASYNC_DB, SessionLocal
+from ...crud.crud_async import AnySession
 from ...auth.custom_auth import get_current_user, TokenData
+from fastapi.security import HTTPAuthorizationCredentials
+from ...crud.pagination import DEFAULT_ORDER_PAGE_SIZE, MAX_ORDER_PAGE_SIZE
+from ...utils.kds_hub import kds_hub
+from ...utils.event_bus import event_bus
+from ...utils.receipts import receipt_renderer, receipt_cache_key, receipt_payload, receipt_filename, load_receipt_lines
+from ...utils.idempotency import idempotency
+from ...utils.menu_cache import menu_cache, menu_response
+from ...utils.menu_search import menu_search, popular_since, MENU_SEARCH_DEFAULT_LIMIT, MENU_SEARCH_MAX_LIMIT
+from ...utils.text_utils import search_words
+from ...utils.menu_import_jobs import menu_import_runner, menu_import_extension, MenuImportTooLarge
 from ...models import User, Restaurant
-from fastapi import Body
+from fastapi import Body, Header
+from fastapi.responses import StreamingResponse
 from datetime import datetime
 import logging
 import asyncio
@@ -17,10 +29,14 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["ordering"])
 
+# Session for the order lifecycle endpoints (place, confirm, pay, cancel, refund, status, filter,
+# export): an AsyncSession when USE_ASYNC_DB is set, otherwise the regular sync Session.
+get_order_db = get_async_db if USE_ASYNC_DB else get_db
+
 # Helper function to check if user is the admin of the restaurant
-async def verify_restaurant_admin(db: Session, restaurant_id: str, current_user: TokenData):
+async def verify_restaurant_admin(db: AnySession, restaurant_id: str, current_user: TokenData):
     # Check if the restaurant exists
-    restaurant = db.query(Restaurant).filter(Restaurant.restaurant_id == restaurant_id).first()
+    restaurant = await crud.get_restaurant_async(db, restaurant_id)
     if not restaurant:
         raise HTTPException(status_code=404, detail=f"Restaurant with ID {restaurant_id} not found")
     
@@ -30,14 +46,44 @@ async def verify_restaurant_admin(db: Session, restaurant_id: str, current_user:
     
     return restaurant
 
+def set_next_cursor_header(response: Response, next_cursor: Optional[str]):
+    # Order listings keep their list bodies; the opaque cursor for the next page travels in a header
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+def order_summary_response(summaries: List[dict], next_cursor: Optional[str]) -> Response:
+    # Summary rows are already JSON-ready dicts, so skip response_model validation entirely
+    response = Response(content=json.dumps(summaries), media_type="application/json")
+    set_next_cursor_header(response, next_cursor)
+    return response
+
+ORDER_LIST_RESPONSE = Union[List[schemas.OrderOut], List[schemas.OrderSummaryOut]]
+ORDER_VIEW_PATTERN = "^(full|summary)$"
+
 # --- MENU ---
+# Served from the menu cache as ready JSON, with an ETag for conditional requests
 @router.get("/menu", response_model=List[schemas.MenuItemOut])
-def list_menu(restaurant_id: str, db: Session = Depends(get_db)):
-    return crud.get_all_menu_items(db, restaurant_id)
+def list_menu(restaurant_id: str, db: Session = Depends(get_db), if_none_match: Optional[str] = Header(None)):
+    menu = menu_cache.get(db, restaurant_id)
+    return menu_response(menu.items, menu.items_etag, if_none_match)
 
 @router.get("/menu/categories", response_model=List[schemas.MenuCategoryOut])
-def list_menu_categories(restaurant_id: str, db: Session = Depends(get_db)):
-    return crud.get_all_menu_categories(db, restaurant_id)
+def list_menu_categories(restaurant_id: str, db: Session = Depends(get_db), if_none_match: Optional[str] = Header(None)):
+    menu = menu_cache.get(db, restaurant_id)
+    return menu_response(menu.categories, menu.categories_etag, if_none_match)
+
+@router.get("/menu/search", response_model=List[schemas.MenuItemOut])
+def search_menu(
+    restaurant_id: str,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(MENU_SEARCH_DEFAULT_LIMIT, ge=1, le=MENU_SEARCH_MAX_LIMIT),
+    db: Session = Depends(get_db)
+):
+    # Prefix and typo tolerant, best sellers first among similar matches (see utils.menu_search)
+    matches = menu_search.search(db, restaurant_id, q, limit)
+    if matches is None:
+        return crud.search_menu_items(db, restaurant_id, search_words(q), limit, popular_since())
+    return Response(content=b"[" + b",".join(matches) + b"]", media_type="application/json")
 
 # --- MENU CATEGORY CRUD (Admin) ---
 @router.post("/menu/categories", response_model=schemas.MenuCategoryOut)
@@ -69,13 +115,19 @@ async def delete_menu_category(category_id: int, restaurant_id: str, db: Session
 async def create_menu_item(restaurant_id: str, item: schemas.MenuItemCreate, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     # Verify admin access
     await verify_restaurant_admin(db, restaurant_id, current_user)
-    return crud.create_menu_item(db, restaurant_id, item)
+    try:
+        return crud.create_menu_item(db, restaurant_id, item)
+    except ValueError as ve:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
 
 @router.put("/menu/items/{item_id}", response_model=schemas.MenuItemOut)
 async def update_menu_item(item_id: int, item: schemas.MenuItemCreate, restaurant_id: str, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
     # Verify admin access
     await verify_restaurant_admin(db, restaurant_id, current_user)
-    updated = crud.update_menu_item(db, item_id, restaurant_id, item)
+    try:
+        updated = crud.update_menu_item(db, item_id, restaurant_id, item)
+    except ValueError as ve: # Invalid components, or combos nested in a cycle
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
     if not updated:
         raise HTTPException(status_code=404, detail="Menu item not found")
     return updated
@@ -111,14 +163,18 @@ async def bulk_create_menu_items(
     - `item_cost_price`: Cost price of the base item.
     - `item_available` (default: True): "True" or "False".
     - `item_image_url`: URL for the item's image.
-    - `item_type` (default: "regular"): "regular" or "combo". (Combo items might require more complex handling not fully detailed here).
+    - `item_type` (default: "regular"): Only "regular" items can be uploaded; create combos with POST /menu/items.
     - `variation_name`: Name of a variation (e.g., "Small", "Large").
     - `variation_price`: Price for this specific variation.
     - `variation_cost_price`: Cost price for the variation.
     - `variation_available` (default: True): "True" or "False" for variation availability.
 
-    The system processes items and their variations. If multiple rows share the same `category_name` and `item_name`,
-    subsequent rows with `variation_name` will be treated as variations of that item.
+    Rows sharing the same `category_name` and `item_name` make up one item, wherever they are in the
+    file: the first of them with an `item_price` gives the item's fields, and every one with `variation_name`
+    adds a variation.
+    Yes/no columns also accept yes/no and 1/0. Invalid rows are reported by row number and their item
+    is skipped; the other items are created in one transaction.
+    For large files use POST /menu/import_jobs, which imports them in the background.
     """
     await verify_restaurant_admin(db, restaurant_id, current_user)
 
@@ -141,155 +197,51 @@ async def bulk_create_menu_items(
         raise HTTPException(status_code=400, detail="File is empty or could not be parsed.")
 
     # Normalize column names (e.g., lower case, replace spaces with underscores)
-    df.columns = [col.lower().replace(' ', '_') for col in df.columns]
+    crud.normalize_menu_columns(df)
 
-    required_columns = ['category_name', 'item_name', 'item_price', 'inventory_available']
-    for col in required_columns:
+    for col in crud.MENU_IMPORT_REQUIRED_COLUMNS:
         if col not in df.columns:
             raise HTTPException(status_code=400, detail=f"Missing required column: {col}")
 
-    created_count = 0
-    error_count = 0
-    errors = []
-    
-    # Group by base item (category_name, item_name) to process item and its variations together
-    # This assumes variations for an item immediately follow its base item row or other variations of the same item.
-    # A more robust grouping might be needed if the file isn't sorted this way.
-    
-    current_item_data = None
-    processed_items = [] # To store schemas.MenuItemCreate objects
-
-    for index, row in df.iterrows():
-        try:
-            # --- Category Handling --- (Simplified: Assumes get_or_create logic)
-            category_name = row['category_name']
-            category_db = db.query(models.MenuCategory).filter(
-                models.MenuCategory.restaurant_id == restaurant_id,
-                models.MenuCategory.name == category_name
-            ).first()
-            if not category_db:
-                # Option: Auto-create category or add to errors
-                category_schema = schemas.MenuCategoryCreate(name=category_name)
-                category_db = crud.create_menu_category(db, restaurant_id, category_schema)
-                # logger.info(f"Created new category '{category_name}' for restaurant {restaurant_id}")
-            category_id = category_db.id
-
-            item_name = row['item_name']
-
-            # --- Logic to group item with its variations ---
-            # If this row starts a new item (different name or category)
-            if not current_item_data or \
-               current_item_data['name'] != item_name or \
-               current_item_data['category_id'] != category_id:
-                
-                # If there was a previous item, add it to the list to be created
-                if current_item_data:
-                    processed_items.append(schemas.MenuItemCreate(**current_item_data))
-                
-                # Start new item
-                current_item_data = {
-                    "restaurant_id": restaurant_id,
-                    "name": item_name,
-                    "description": row.get('item_description'),
-                    "price": float(row['item_price']), 
-                    "cost_price": float(row.get('item_cost_price')) if pd.notna(row.get('item_cost_price')) else None,
-                    "available": str(row.get('item_available', True)).lower() == 'true',
-                    "category_id": category_id,
-                    "image_url": row.get('item_image_url'),
-                    "item_type": row.get('item_type', 'regular').lower(),
-                    "inventory_available": str(row['inventory_available']).lower() == 'true',
-                    "inventory_quantity": None,
-                    "variations": []
-                }
-                
-                # Process inventory_quantity based on inventory_available
-                if current_item_data["inventory_available"]:
-                    if 'inventory_quantity' not in row or pd.isna(row['inventory_quantity']):
-                        raise ValueError(f"inventory_quantity is required for item '{item_name}' when inventory_available is True.")
-                    current_item_data["inventory_quantity"] = float(row['inventory_quantity'])
-                elif 'inventory_quantity' in row and pd.notna(row['inventory_quantity']):
-                    # If inventory_available is False, but quantity is provided, it will be set to None by Pydantic validator.
-                    # We can also explicitly set it to None here or let validator handle it.
-                    # For clarity, explicitly showing it's considered.
-                    current_item_data["inventory_quantity"] = float(row['inventory_quantity']) # Pydantic will nullify if not available
-
-            # --- Variation Handling ---
-            if pd.notna(row.get('variation_name')) and pd.notna(row.get('variation_price')):
-                variation_data = schemas.MenuItemVariationSchema(
-                    name=row['variation_name'],
-                    price=float(row['variation_price']), 
-                    cost_price=float(row.get('variation_cost_price')) if pd.notna(row.get('variation_cost_price')) else None,
-                    available=str(row.get('variation_available', True)).lower() == 'true'
-                )
-                if current_item_data: # Should always be true if logic is correct
-                    current_item_data["variations"].append(variation_data)
-            elif not current_item_data["variations"]: # If no variations yet and this row is not adding one, ensure base price if variation_price was empty
-                 # This case is if the first row for an item didn't have variation_name/price, so item_price is base.
-                 # If item_price was left blank expecting variation_price, this might need adjustment.
-                 # For simplicity, current logic assumes first row for an item defines its base price via 'item_price'.
-                pass # Base item details already captured
-
-        except Exception as e:
-            error_count += 1
-            errors.append(f"Row {index + 2}: Error processing - {str(e)}") # +2 for header and 0-indexing
-            if current_item_data: # If an error occurs, discard current partially processed item
-                current_item_data = None 
-            continue # Skip to next row on error for this item
-            
-    # Add the last processed item
-    if current_item_data:
-        processed_items.append(schemas.MenuItemCreate(**current_item_data))
+    # Column-wise validation; run off the event loop as it is CPU-bound on large files
+    processed_items, row_errors = await asyncio.get_running_loop().run_in_executor(None, crud.parse_menu_frame, df)
 
+    created_count = 0
     # --- Database Creation Step ---
     # Wrap the database operations in a transaction
     try:
-        for item_to_create_schema in processed_items:
-            # Complex validation for item_type='combo' and components would go here
-            # For now, assuming item_type regular or variations handle this correctly
-            if item_to_create_schema.item_type == 'combo' and not item_to_create_schema.components:
-                 # If combo, and your file format needs to specify components, this logic needs enhancement.
-                 # The current file format example focuses on variations, not combo components.
-                 logger.warning(f"Item {item_to_create_schema.name} is combo but no components specified in bulk format used.")
-
-            # Use the new CRUD function that adds to session without committing
-            crud.add_menu_item_to_session(db, restaurant_id, item_to_create_schema)
-            created_count += 1 # Increment optimistic count, actual commit determines success
-        
+        if processed_items:
+            created_count, category_errors = crud.insert_menu_items(db, restaurant_id, processed_items)
+            row_errors.extend(category_errors)
         if created_count > 0: # Only commit if items were processed and added to session
             db.commit() # Commit all items at once
             logger.info(f"Successfully committed {created_count} menu items from bulk upload for restaurant {restaurant_id}.")
         else:
+            db.rollback()
             # No items processed to commit, perhaps all rows had errors before DB stage or file was effectively empty of valid items.
             logger.info(f"No valid menu items processed from bulk upload for restaurant {restaurant_id} to commit.")
-            # If errors list is empty, it means no data rows were processed successfully to reach this stage.
-            if not errors: # and created_count == 0 (implicitly)
-                 errors.append("No valid data rows found in the file to create menu items.")
-                 error_count = len(errors) # Update error count if this specific error is added
-
     except Exception as e:
-        db.rollback() # Rollback any changes if an error occurs during add_to_session or commit
-        error_count = len(processed_items) if created_count == 0 else error_count # If commit fails, all are errors
+        db.rollback() # Rollback any changes if an error occurs during the inserts or commit
         created_count = 0 # Reset created count as nothing was committed
         specific_error_msg = f"Database transaction failed during bulk menu item creation: {str(e)}"
         logger.error(f"{specific_error_msg} for restaurant {restaurant_id}", exc_info=True)
-        errors.append(specific_error_msg) # Add the transaction error to the list of errors
-        # It's possible some row-specific errors were already added, this adds the overall transaction error.
+        errors = [f"Row {row}: Error processing - {message}" for row, message in sorted(row_errors)]
+        errors.append(specific_error_msg)
+        return schemas.StandardResponse(
+            status="error",
+            message=f"Bulk menu item creation failed. Attempted to process {len(processed_items)} items, but a database error occurred. All changes rolled back.",
+            data={"errors": errors}
+        )
 
-    if errors:
-        final_status = "error"
-        # Determine if it was a partial success at parsing stage but full DB failure, or error from the start.
-        if created_count > 0: # This should not happen if rollback occurred, but as a safeguard for messaging
-            final_status = "partial_success" # This state is less likely with atomic DB operations
-        
-        message = f"Bulk menu items processed. Created: {created_count}, Errors: {len(errors)}."
-        if created_count == 0 and len(processed_items) > 0 and any("Database transaction failed" in err for err in errors):
-            message = f"Bulk menu item creation failed. Attempted to process {len(processed_items)} items, but a database error occurred. All changes rolled back."
-        elif created_count == 0 and not errors:
-             message = "No menu items were created. The file might be empty or data improperly formatted."
+    errors = [f"Row {row}: Error processing - {message}" for row, message in sorted(row_errors)]
+    if not errors and created_count == 0:
+        errors.append("No valid data rows found in the file to create menu items.")
 
+    if errors:
+        # Items without errors are committed even when other rows failed
         return schemas.StandardResponse(
-            status=final_status,
-            message=message,
+            status="partial_success" if created_count > 0 else "error",
+            message=f"Bulk menu items processed. Created: {created_count}, Errors: {len(errors)}.",
             data={"errors": errors}
         )
 
@@ -298,6 +250,55 @@ async def bulk_create_menu_items(
         message=f"Successfully created {created_count} menu items from bulk upload."
     )
 
+@router.post("/menu/import_jobs", response_model=schemas.MenuImportJobOut, status_code=status.HTTP_202_ACCEPTED)
+async def create_menu_import_job(
+    restaurant_id: str,
+    response: Response,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """
+    Import a menu sheet in the background. Takes the same CSV or Excel files as POST
+    /menu/items/bulk_upload and returns the queued job at once; poll GET /menu/import_jobs/{job_id}
+    (also in the Location header) for its progress, row errors and final summary.
+
+    The file is imported MENU_IMPORT_CHUNK_ROWS rows at a time, each chunk in its own transaction,
+    so items from the chunks processed before a failure are kept.
+    """
+    await verify_restaurant_admin(db, restaurant_id, current_user)
+
+    extension = menu_import_extension(file.filename, file.content_type)
+    if extension is None:
+        raise HTTPException(status_code=400, detail="Unsupported file type. Please upload a CSV or Excel file.")
+    try:
+        path = await menu_import_runner.spool(file, extension)
+    except MenuImportTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+    job = crud.create_menu_import_job(db, restaurant_id, current_user.uid, file.filename)
+    menu_import_runner.submit(job.id, restaurant_id, path)
+    response.headers["Location"] = f"/menu/import_jobs/{job.id}?restaurant_id={restaurant_id}"
+    return job
+
+@router.get("/menu/import_jobs", response_model=List[schemas.MenuImportJobOut])
+async def list_menu_import_jobs(
+    restaurant_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: TokenData = Depends(get_current_user)
+):
+    await verify_restaurant_admin(db, restaurant_id, current_user)
+    return crud.get_menu_import_jobs(db, restaurant_id, limit)
+
+@router.get("/menu/import_jobs/{job_id}", response_model=schemas.MenuImportJobOut)
+async def get_menu_import_job(job_id: str, restaurant_id: str, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
+    await verify_restaurant_admin(db, restaurant_id, current_user)
+    job = crud.get_menu_import_job(db, restaurant_id, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Menu import job not found")
+    return job
+
 # --- ORDERS ---
 
 from fastapi import Security
@@ -306,7 +307,7 @@ from fastapi import Security
 async def confirm_order_endpoint(
     order_id: str, 
     restaurant_id: str,
-    db: Session = Depends(get_db), 
+    db: AnySession = Depends(get_order_db), 
     current_user: TokenData = Depends(get_current_user)
 ):
     """
@@ -320,29 +321,31 @@ async def confirm_order_endpoint(
     await verify_restaurant_admin(db, restaurant_id, current_user)
     
     # First, verify the order exists and belongs to the specified restaurant
-    db_order = db.query(models.Order).options(
-        joinedload(models.Order.items).joinedload(models.OrderItem.item)
-    ).filter(models.Order.id == order_id).first()
+    order_restaurant_id = await crud.get_order_restaurant_id_async(db, order_id)
     
-    if not db_order:
+    if not order_restaurant_id:
         raise HTTPException(status_code=404, detail="Order not found.")
     
     # Check if the order belongs to the specified restaurant
-    if db_order.restaurant_id != restaurant_id:
+    if order_restaurant_id != restaurant_id:
         raise HTTPException(
             status_code=403, 
             detail="This order does not belong to the specified restaurant."
         )
     
-    return crud.confirm_order(db, order_id, current_user.uid)
+    confirmed_order, kds_version = await crud.confirm_order_async(db, order_id, current_user.uid)
+    order_out = await crud.order_out_async(db, confirmed_order)
+    await notify_admins_order_status(confirmed_order, order_out, kds_version)
+    return order_out
 
 @router.post("/order/{order_id}/mark_paid", response_model=schemas.OrderOut)
 async def mark_order_paid_endpoint(
     order_id: str,
     restaurant_id: str,
     payment_details: schemas.OrderMarkPaidRequest,
-    db: Session = Depends(get_db), 
-    current_user: TokenData = Depends(get_current_user)
+    db: AnySession = Depends(get_order_db), 
+    current_user: TokenData = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     Mark an order as paid for a specific restaurant.
@@ -351,28 +354,27 @@ async def mark_order_paid_endpoint(
     - order_id: The ID of the order to mark as paid, in format "restaurant_id_number"
     - restaurant_id: The restaurant ID the order belongs to (for admin verification)
     - payment_details: Payment method and optional transaction ID.
+    - Idempotency-Key header (optional): retries with the same key get the first response back.
     """
     # Verify admin access - this ensures the current_user is admin of this restaurant_id
     await verify_restaurant_admin(db, restaurant_id, current_user)
-    
+
+    if idempotency_key:
+        fingerprint = crud.request_fingerprint("POST", "/order/{order_id}/mark_paid", order_id, restaurant_id, payment_details.model_dump())
+        return await idempotency.run(db, current_user.uid, idempotency_key, fingerprint,
+                                     lambda: _mark_order_paid(order_id, restaurant_id, payment_details, db, current_user))
+    return await _mark_order_paid(order_id, restaurant_id, payment_details, db, current_user)
+
+async def _mark_order_paid(order_id: str, restaurant_id: str, payment_details: schemas.OrderMarkPaidRequest, db: AnySession, current_user: TokenData) -> schemas.OrderOut:
     # First, verify the order exists and belongs to the specified restaurant
-    # No need to eager load payment here, crud function will handle it.
-    db_order = db.query(models.Order).filter(
-        models.Order.id == order_id,
-        models.Order.restaurant_id == restaurant_id # Ensure order matches restaurant from path
-    ).first()
-    
-    if not db_order:
+    # No need to load the order here, crud function will handle it.
+    if await crud.get_order_restaurant_id_async(db, order_id) != restaurant_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Order {order_id} not found or does not belong to restaurant {restaurant_id}.")
     
-    if db_order.payment_status == "Paid":
-        # If already paid, check if customer_uid needs to be updated or if it's an error to call this again.
-        # For now, the CRUD allows updating customer_uid on an already paid order. 
-        # If that's not desired, this check could be more strict.
-        pass # Allow proceeding to potentially update customer_uid
+    # If already paid, the CRUD allows updating customer_uid on an already paid order.
 
     try:
-        updated_order = crud.mark_order_paid(
+        updated_order, kds_version = await crud.mark_order_paid_async(
             db=db, 
             order_id=order_id, 
             changed_by=current_user.uid, 
@@ -382,7 +384,9 @@ async def mark_order_paid_endpoint(
         )
         # The updated_order from CRUD should have customer_detail loaded if customer_uid was set.
         # schemas.OrderOut is configured to handle this.
-        return schemas.OrderOut.from_orm(updated_order)
+        order_out = await crud.order_out_async(db, updated_order)
+        await notify_admins_order_status(updated_order, order_out, kds_version)
+        return order_out
     except ValueError as ve:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
     except Exception as e:
@@ -393,7 +397,7 @@ async def mark_order_paid_endpoint(
 async def cancel_order_endpoint(
     order_id: str,
     restaurant_id: str,
-    db: Session = Depends(get_db), 
+    db: AnySession = Depends(get_order_db), 
     current_user: TokenData = Depends(get_current_user)
 ):
     """
@@ -407,30 +411,31 @@ async def cancel_order_endpoint(
     await verify_restaurant_admin(db, restaurant_id, current_user)
     
     # First, verify the order exists and belongs to the specified restaurant
-    db_order = db.query(models.Order).options(
-        joinedload(models.Order.items).joinedload(models.OrderItem.item)
-    ).filter(models.Order.id == order_id).first()
+    order_restaurant_id = await crud.get_order_restaurant_id_async(db, order_id)
     
-    if not db_order:
+    if not order_restaurant_id:
         raise HTTPException(status_code=404, detail="Order not found.")
     
     # Check if the order belongs to the specified restaurant
-    if db_order.restaurant_id != restaurant_id:
+    if order_restaurant_id != restaurant_id:
         raise HTTPException(
             status_code=403, 
             detail="This order does not belong to the specified restaurant."
         )
     
     try:
-        return crud.cancel_order(db, order_id, current_user.uid)
+        updated_order, kds_version = await crud.cancel_order_async(db, order_id, current_user.uid)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    order_out = await crud.order_out_async(db, updated_order)
+    await notify_admins_order_status(updated_order, order_out, kds_version)
+    return order_out
 
 @router.post("/order/{order_id}/refund", response_model=schemas.OrderOut)
 async def refund_order_endpoint(
     order_id: str,
     restaurant_id: str,
-    db: Session = Depends(get_db), 
+    db: AnySession = Depends(get_order_db), 
     current_user: TokenData = Depends(get_current_user)
 ):
     """
@@ -444,35 +449,49 @@ async def refund_order_endpoint(
     await verify_restaurant_admin(db, restaurant_id, current_user)
     
     # First, verify the order exists and belongs to the specified restaurant
-    db_order = db.query(models.Order).options(
-        joinedload(models.Order.items).joinedload(models.OrderItem.item)
-    ).filter(models.Order.id == order_id).first()
+    order_restaurant_id = await crud.get_order_restaurant_id_async(db, order_id)
     
-    if not db_order:
+    if not order_restaurant_id:
         raise HTTPException(status_code=404, detail="Order not found.")
     
     # Check if the order belongs to the specified restaurant
-    if db_order.restaurant_id != restaurant_id:
+    if order_restaurant_id != restaurant_id:
         raise HTTPException(
             status_code=403, 
             detail="This order does not belong to the specified restaurant."
         )
     
     try:
-        return crud.refund_order(db, order_id, current_user.uid)
+        updated_order, kds_version = await crud.refund_order_async(db, order_id, current_user.uid)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    order_out = await crud.order_out_async(db, updated_order)
+    await notify_admins_order_status(updated_order, order_out, kds_version)
+    return order_out
 
 @router.post("/order", response_model=schemas.OrderOut)
-async def place_order(order: schemas.OrderCreate, db: Session = Depends(get_db), current_user: TokenData = Depends(get_current_user)):
-    # Any authenticated user can place orders
+async def place_order(
+    order: schemas.OrderCreate,
+    db: AnySession = Depends(get_order_db),
+    current_user: TokenData = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    # Any authenticated user can place orders. POS clients send an Idempotency-Key so that
+    # retries over flaky connections replay the first response instead of adding the items again.
+    if idempotency_key:
+        fingerprint = crud.request_fingerprint("POST", "/order", order.model_dump())
+        return await idempotency.run(db, current_user.uid, idempotency_key, fingerprint,
+                                     lambda: _place_order(order, db, current_user))
+    return await _place_order(order, db, current_user)
+
+async def _place_order(order: schemas.OrderCreate, db: AnySession, current_user: TokenData) -> schemas.OrderOut:
     try:
         order_obj = None # This will store the final order (models.Order)
-        # existing_unpaid_order = None # This line is not strictly needed here
+        order_out = None # Its OrderOut response, built before the KDS notification that carries it
 
         if order.table_number and order.restaurant_id:
             # Try to find an existing unpaid order for this table and restaurant
-            existing_unpaid_order_model = crud.get_unpaid_order_by_table(
+            existing_unpaid_order_model = await crud.get_unpaid_order_by_table_async(
                 db=db, 
                 restaurant_id=order.restaurant_id, 
                 table_number=order.table_number
@@ -484,33 +503,37 @@ async def place_order(order: schemas.OrderCreate, db: Session = Depends(get_db),
             if not order.items:
                  raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No items provided to add to existing order.")
             
-            logger.info(f"Existing order {existing_unpaid_order_model.id} found for table {order.table_number}. Current items: {len(existing_unpaid_order_model.items)}, total: {existing_unpaid_order_model.total_cost}")
+            logger.info(f"Existing order {existing_unpaid_order_model.id} found for table {order.table_number}. Current total: {existing_unpaid_order_model.total_cost}")
             logger.info(f"Attempting to add {len(order.items)} item entries.")
 
-            # Call the modified crud function which returns the order and list of affected items
-            updated_order_model, affected_item_models = crud.add_items_to_order(
+            # Call the modified crud function which returns the order, list of affected items and KDS version
+            updated_order_model, affected_item_models, kds_version = await crud.add_items_to_order_async(
                 db=db,
                 existing_order=existing_unpaid_order_model,
                 new_items_create=order.items, # These are schemas.OrderItemCreate
                 user_uid=current_user.uid
             )
-            order_obj = updated_order_model
+            order_obj = updated_order_model # Already re-fetched with its relationships
+            order_out = await crud.order_out_async(db, order_obj)
 
             # Convert affected model items to schema items for notification
-            affected_items_schema = [schemas.OrderItemOut.from_orm(item) for item in affected_item_models]
+            affected_items_schema = await crud.run_in_session(db, lambda _: [schemas.OrderItemOut.from_orm(item) for item in affected_item_models])
             
-            await notify_admins_items_added_to_order(order_obj.id, affected_items_schema)
+            await notify_admins_items_added_to_order(order_obj, order_out, affected_items_schema, kds_version)
             logger.info(f"Items added to order {order_obj.id}. {len(affected_items_schema)} items affected/added. New total items: {len(order_obj.items)}, new total cost: {order_obj.total_cost}")
 
         else:
             # No existing unpaid order, or table/restaurant not specified for check: create a new one
-            order_obj = crud.create_order(
+            order_obj, kds_version = await crud.create_order_async(
                 db=db, 
                 order=order, 
                 user_uid=current_user.uid, 
                 user_role=current_user.role
             )
-            await notify_admins_new_order(order_obj.id) # Existing notification for brand new order
+            # Re-fetch the new order with all necessary relationships for OrderOut in one eager query
+            order_out = await crud.get_order_out_async(db, order_obj.id)
+            if order_out:
+                await notify_admins_new_order(order_obj, order_out, kds_version)
             logger.info(f"New order {order_obj.id} created for table {order.table_number if order.table_number else 'N/A'}.")
 
     except ValueError as ve:
@@ -526,27 +549,19 @@ async def place_order(order: schemas.OrderCreate, db: Session = Depends(get_db),
         logger.error("Order object was not created or updated successfully after all processing, returning 500.")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to process order.")
 
-    # Re-fetch the order_obj with all necessary relationships for OrderOut
-    # to ensure they are loaded before from_orm is called.
-    db_order_for_response = db.query(models.Order).options(
-        selectinload(models.Order.items).selectinload(models.OrderItem.item).selectinload(models.MenuItem.category),
-        selectinload(models.Order.payment),
-        selectinload(models.Order.status_history)
-    ).filter(models.Order.id == order_obj.id).first()
-
-    if not db_order_for_response:
+    if not order_out:
         # This should ideally not happen if order_obj was valid
         logger.error(f"Failed to re-fetch order {order_obj.id} for response construction.")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error preparing order response.")
+    return order_out
 
-    # Convert the final order model (whether new or updated) to the OrderOut schema for the response
-    # This ensures relationships like .items and .item.category are correctly represented if loaded.
-    final_order_response = schemas.OrderOut.from_orm(db_order_for_response) # Use the re-fetched object
-    return final_order_response
-
-@router.get("/orders/history", response_model=List[schemas.OrderOut])
+@router.get("/orders/history", response_model=ORDER_LIST_RESPONSE)
 def user_order_history(
+    response: Response,
     restaurant_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_ORDER_PAGE_SIZE, ge=1, le=MAX_ORDER_PAGE_SIZE),
+    view: str = Query("full", pattern=ORDER_VIEW_PATTERN),
     db: Session = Depends(get_db), 
     current_user: TokenData = Depends(get_current_user)
 ):
@@ -555,17 +570,31 @@ def user_order_history(
     
     Parameters:
     - restaurant_id: Optional filter to show orders only for a specific restaurant
+    - cursor: Opaque cursor from the previous page's X-Next-Cursor header
+    - limit: Page size
+    - view: "full" (default) or "summary" for id, number, table, status, total and time only
     """
-    return crud.get_orders_by_user(db, current_user.uid, restaurant_id)
+    try:
+        if view == "summary":
+            return order_summary_response(*crud.get_order_summaries(db, cursor=cursor, limit=limit, user_uid=current_user.uid, restaurant_id=restaurant_id))
+        orders, next_cursor = crud.get_orders_by_user(db, current_user.uid, restaurant_id, cursor=cursor, limit=limit)
+    except ValueError as ve:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+    set_next_cursor_header(response, next_cursor)
+    return orders
 
-@router.get("/orders/all", response_model=List[schemas.OrderOut])
+@router.get("/orders/all", response_model=ORDER_LIST_RESPONSE)
 async def all_orders_history(
+    response: Response,
     restaurant_id: str,
     status: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     payment_status: Optional[str] = None,
     user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_ORDER_PAGE_SIZE, ge=1, le=MAX_ORDER_PAGE_SIZE),
+    view: str = Query("full", pattern=ORDER_VIEW_PATTERN),
     db: Session = Depends(get_db), 
     current_user: TokenData = Depends(get_current_user)
 ):
@@ -579,29 +608,43 @@ async def all_orders_history(
     # Dates are now automatically parsed by FastAPI from ISO 8601 strings to datetime objects.
     # No manual parsing needed here.
     
-    orders = crud.filter_orders(
-        db=db,
-        restaurant_id=restaurant_id,
-        status=status,
-        start_date=start_date,
-        end_date=end_date,
-        payment_method=None,
-        user_uid=user_id,
-        # The following parameters are available in crud.filter_orders but not directly in this endpoint's signature currently
-        # order_id=None, 
-        # user_email=None, 
-        # user_phone=None
-    )
+    try:
+        if view == "summary":
+            return order_summary_response(*crud.get_order_summaries(
+                db, cursor=cursor, limit=limit, restaurant_id=restaurant_id, status=status,
+                start_date=start_date, end_date=end_date, user_uid=user_id
+            ))
+        orders, next_cursor = crud.filter_orders(
+            db=db,
+            restaurant_id=restaurant_id,
+            status=status,
+            start_date=start_date,
+            end_date=end_date,
+            payment_method=None,
+            user_uid=user_id,
+            # The following parameters are available in crud.filter_orders but not directly in this endpoint's signature currently
+            # order_id=None, 
+            # user_email=None, 
+            # user_phone=None
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     
     # The crud.filter_orders function returns a list of dictionaries that should be
     # compatible with schemas.OrderOut or be instances of models.Order that Pydantic can serialize.
-    # Assuming the response_model=List[schemas.OrderOut] is on the endpoint (or will be added if not)
+    set_next_cursor_header(response, next_cursor)
     return orders
 
-@router.get("/orders/user/{user_id}", response_model=List[schemas.OrderOut])
+@router.get("/orders/user/{user_id}", response_model=ORDER_LIST_RESPONSE)
 async def orders_by_user(
+    response: Response,
     user_id: str, 
     restaurant_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_ORDER_PAGE_SIZE, ge=1, le=MAX_ORDER_PAGE_SIZE),
+    view: str = Query("full", pattern=ORDER_VIEW_PATTERN),
     db: Session = Depends(get_db), 
     current_user: TokenData = Depends(get_current_user)
 ):
@@ -611,15 +654,29 @@ async def orders_by_user(
     Parameters:
     - user_id: The user ID to get orders for
     - restaurant_id: The restaurant ID to filter orders by
+    - cursor: Opaque cursor from the previous page's X-Next-Cursor header
+    - limit: Page size
+    - view: "full" (default) or "summary" for id, number, table, status, total and time only
     """
     # Verify admin access
     await verify_restaurant_admin(db, restaurant_id, current_user)
     
-    return crud.get_orders_by_user(db, user_id, restaurant_id)
+    try:
+        if view == "summary":
+            return order_summary_response(*crud.get_order_summaries(db, cursor=cursor, limit=limit, user_uid=user_id, restaurant_id=restaurant_id))
+        orders, next_cursor = crud.get_orders_by_user(db, user_id, restaurant_id, cursor=cursor, limit=limit)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    set_next_cursor_header(response, next_cursor)
+    return orders
 
-@router.get("/orders", response_model=List[schemas.OrderOut])
+@router.get("/orders", response_model=ORDER_LIST_RESPONSE)
 async def admin_list_orders(
+    response: Response,
     restaurant_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_ORDER_PAGE_SIZE, ge=1, le=MAX_ORDER_PAGE_SIZE),
+    view: str = Query("full", pattern=ORDER_VIEW_PATTERN),
     db: Session = Depends(get_db),
     current_user: TokenData = Depends(get_current_user)
 ):
@@ -628,24 +685,38 @@ async def admin_list_orders(
     
     Parameters:
     - restaurant_id: Filter to show orders for this restaurant
+    - cursor: Opaque cursor from the previous page's X-Next-Cursor header
+    - limit: Page size
+    - view: "full" (default) or "summary" for id, number, table, status, total and time only
     """
     # Verify admin access
     await verify_restaurant_admin(db, restaurant_id, current_user)
     
-    return crud.get_all_orders(db, restaurant_id)
+    try:
+        if view == "summary":
+            return order_summary_response(*crud.get_order_summaries(db, cursor=cursor, limit=limit, restaurant_id=restaurant_id))
+        orders, next_cursor = crud.get_all_orders(db, restaurant_id, cursor=cursor, limit=limit)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    set_next_cursor_header(response, next_cursor)
+    return orders
 
-@router.get("/orders/filter", response_model=List[schemas.OrderOut])
+@router.get("/orders/filter", response_model=ORDER_LIST_RESPONSE)
 async def filter_orders(
+    response: Response,
     restaurant_id: str,
     status: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     payment_method: Optional[str] = None,
     user_id: Optional[str] = None,
-    order_id: Optional[int] = None,
+    order_id: Optional[str] = None,
     user_email: Optional[str] = None,
     user_phone: Optional[str] = None,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_ORDER_PAGE_SIZE, ge=1, le=MAX_ORDER_PAGE_SIZE),
+    view: str = Query("full", pattern=ORDER_VIEW_PATTERN),
+    db: AnySession = Depends(get_order_db),
     current_user: TokenData = Depends(get_current_user)
 ):
     """
@@ -661,6 +732,9 @@ async def filter_orders(
     - order_id: Filter by order ID
     - user_email: Filter by user email (partial match)
     - user_phone: Filter by user phone (partial match)
+    - cursor: Opaque cursor from the previous page's X-Next-Cursor header
+    - limit: Page size
+    - view: "full" (default) or "summary" for id, number, table, status, total and time only
     """
     # Verify admin access
     await verify_restaurant_admin(db, restaurant_id, current_user)
@@ -670,25 +744,32 @@ async def filter_orders(
     start = datetime.fromisoformat(start_date) if start_date else None
     end = datetime.fromisoformat(end_date) if end_date else None
     
-    return crud.filter_orders(
-        db,
+    filters = dict(
         status=status,
         start_date=start,
         end_date=end,
         payment_method=payment_method,
-        user_id=user_id,
+        user_uid=user_id,
         order_id=order_id,
         user_email=user_email,
         user_phone=user_phone,
         restaurant_id=restaurant_id
     )
+    try:
+        if view == "summary":
+            return order_summary_response(*await crud.get_order_summaries_async(db, cursor=cursor, limit=limit, **filters))
+        orders, next_cursor = await crud.filter_orders_async(db, cursor=cursor, limit=limit, **filters)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    set_next_cursor_header(response, next_cursor)
+    return orders
 
 @router.put("/order/{order_id}/status", response_model=schemas.OrderOut)
 async def update_order_status(
     order_id: str, 
     restaurant_id: str,
     status: str = Body(...), 
-    db: Session = Depends(get_db), 
+    db: AnySession = Depends(get_order_db), 
     current_user: TokenData = Depends(get_current_user)
 ):
     """
@@ -703,24 +784,76 @@ async def update_order_status(
     await verify_restaurant_admin(db, restaurant_id, current_user)
     
     # First, verify the order exists and belongs to the specified restaurant
-    db_order = db.query(models.Order).options(
-        joinedload(models.Order.items).joinedload(models.OrderItem.item)
-    ).filter(models.Order.id == order_id).first()
+    order_restaurant_id = await crud.get_order_restaurant_id_async(db, order_id)
     
-    if not db_order:
+    if not order_restaurant_id:
         raise HTTPException(status_code=404, detail="Order not found.")
     
     # Check if the order belongs to the specified restaurant
-    if db_order.restaurant_id != restaurant_id:
+    if order_restaurant_id != restaurant_id:
         raise HTTPException(
             status_code=403, 
             detail="This order does not belong to the specified restaurant."
         )
     
     try:
-        return crud.update_order_status(db, order_id, status, current_user.uid)
+        updated_order, kds_version = await crud.update_order_status_async(db, order_id, status, current_user.uid)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    order_out = await crud.order_out_async(db, updated_order)
+    await notify_admins_order_status(updated_order, order_out, kds_version)
+    return order_out
+
+@router.post("/orders/status/bulk", response_model=schemas.OrderBulkStatusResult)
+async def bulk_update_order_status(
+    restaurant_id: str,
+    bulk_update: schemas.OrderBulkStatusUpdate,
+    db: AnySession = Depends(get_order_db),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """
+    Move many orders of a restaurant to one status in a single transaction.
+    Each move is checked against the order status transition table; orders that cannot move are
+    reported per order and do not block the others. KDS screens get one batched event.
+    """
+    # Verify admin access
+    await verify_restaurant_admin(db, restaurant_id, current_user)
+
+    try:
+        results, changes = await crud.bulk_transition_order_status_async(
+            db, restaurant_id, bulk_update.order_ids, bulk_update.status, current_user.uid
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if changes:
+        await notify_admins_order_status_batch(restaurant_id, changes)
+    return {"updated": len(changes), "results": results}
+
+@router.post("/orders/bulk", response_model=schemas.OfflineOrderBatchResult)
+async def ingest_offline_orders(
+    restaurant_id: str,
+    batch: schemas.OfflineOrderBatch,
+    db: AnySession = Depends(get_order_db),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """
+    Upload orders a POS took while offline, up to 1000 per request, in one transaction.
+    Each order is identified by the client_order_id its POS assigned: orders already uploaded are
+    reported as "already_ingested", so a queue can be sent again after a lost response. Invalid
+    orders are reported per order and do not block the others. KDS screens get one event.
+    """
+    # Verify admin access
+    await verify_restaurant_admin(db, restaurant_id, current_user)
+
+    try:
+        results, notification = await crud.ingest_offline_orders_async(
+            db, restaurant_id, batch.orders, current_user.uid, current_user.role
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if notification:
+        await notify_admins_orders_ingested(restaurant_id, notification)
+    return {"ingested": notification["ingested"] if notification else 0, "results": results}
 
 # --- PAYMENT ---
 
@@ -739,9 +872,7 @@ async def order_receipt(
     - restaurant_id: The restaurant ID the order belongs to
     """
     # Verify admin access or if user owns the order
-    db_order = db.query(models.Order).options(
-        joinedload(models.Order.items).joinedload(models.OrderItem.item)
-    ).filter(models.Order.id == order_id).first()
+    db_order = db.query(models.Order).filter(models.Order.id == order_id).first() or crud.get_archived_order(db, order_id)
 
     if not db_order:
         raise HTTPException(status_code=404, detail="Order not found.")
@@ -766,45 +897,62 @@ async def order_receipt(
     # if db_order.status not in ["Completed", "Done"] and db_order.payment_status not in ["Paid", "Refunded"]:
     #     raise HTTPException(status_code=400, detail="Receipt only available for completed or paid orders.")
     
-    from fastapi.responses import StreamingResponse
-    from reportlab.lib.pagesizes import letter
-    from reportlab.pdfgen import canvas
-    import io
-    
-    # Generate PDF
-    buffer = io.BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-    p.setFont("Helvetica-Bold", 16)
-    p.drawString(200, 750, "Order Receipt")
-    p.setFont("Helvetica", 12)
-    p.drawString(50, 720, f"Order ID: {db_order.id}")
-    p.drawString(50, 700, f"User ID: {db_order.user_uid}") # Changed from user_id
-    p.drawString(50, 680, f"Restaurant ID: {db_order.restaurant_id}") # Use db_order.restaurant_id
-    if db_order.table_number:
-        p.drawString(50, 660, f"Table Number: {db_order.table_number}")
-        p.drawString(50, 640, f"Created At: {utc_to_ist(db_order.created_at).strftime('%Y-%m-%d %I:%M %p') if db_order.created_at else 'N/A'}")
-        p.drawString(50, 620, f"Status: {db_order.status}")
-        p.drawString(50, 600, f"Payment Status: {db_order.payment_status}")
-        y_start_items = 570
-    else:
-        p.drawString(50, 660, f"Created At: {utc_to_ist(db_order.created_at).strftime('%Y-%m-%d %I:%M %p') if db_order.created_at else 'N/A'}")
-        p.drawString(50, 640, f"Status: {db_order.status}")
-        p.drawString(50, 620, f"Payment Status: {db_order.payment_status}")
-        y_start_items = 590
-
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(50, y_start_items, "Items:")
-    y = y_start_items - 20
-    p.setFont("Helvetica", 12)
-    for item in db_order.items:
-        p.drawString(60, y, f"{item.quantity} x {item.item.name} @ {item.price} each")
-        y -= 18
-    p.drawString(50, y-10, f"Total: {db_order.total_cost}")
-    p.showPage()
-    p.save()
-    buffer.seek(0)
-    return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=receipt_order_{order_id}.pdf"})
+    # Reprints come from the disk cache; misses render in the process pool, off the event loop
+    cache_key = receipt_cache_key(db_order)
+    pdf = await receipt_renderer.cached(cache_key)
+    if pdf is None:
+        item_model = models.ArchivedOrderItem if isinstance(db_order, models.ArchivedOrder) else models.OrderItem
+        lines = load_receipt_lines(db, [db_order.id], item_model)[db_order.id]
+        pdf = await receipt_renderer.render(cache_key, receipt_payload(db_order, lines))
+    return Response(content=pdf, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename={receipt_filename(order_id)}"})
+
+
+RECEIPT_BATCH_MAX_ORDERS = 5000 # Upper bound on receipts in one zip export
+
+@router.get("/orders/receipts")
+async def export_receipts(
+    restaurant_id: str,
+    start_date: str,
+    end_date: str,
+    db: Session = Depends(get_db),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """
+    Download the receipts of a restaurant's orders created in a date range as a zip of PDFs.
+    The archive is streamed while receipts are rendered; cached receipts are reused.
 
+    Parameters:
+    - start_date, end_date: ISO dates/datetimes (UTC); orders with start_date <= created_at < end_date
+    """
+    # Verify admin access
+    await verify_restaurant_admin(db, restaurant_id, current_user)
+
+    try:
+        start = datetime.fromisoformat(start_date)
+        end = datetime.fromisoformat(end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid date: {e}")
+
+    rows = []
+    for order in (models.Order, models.ArchivedOrder) if crud.reaches_archive(db, start) else (models.Order,):
+        rows += db.query(order.created_at, order.id).filter(
+            order.restaurant_id == restaurant_id,
+            order.created_at >= start,
+            order.created_at < end
+        ).order_by(order.created_at, order.id).limit(RECEIPT_BATCH_MAX_ORDERS + 1).all()
+    order_ids = [order_id for _, order_id in sorted(rows)[:RECEIPT_BATCH_MAX_ORDERS + 1]]
+    if len(order_ids) > RECEIPT_BATCH_MAX_ORDERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"More than {RECEIPT_BATCH_MAX_ORDERS} orders in range; export a shorter period."
+        )
+
+    filename = f"receipts_{restaurant_id}_{start.date().isoformat()}_{end.date().isoformat()}.zip"
+    return StreamingResponse(
+        receipt_renderer.iter_zip(order_ids, SessionLocal),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
 
 @router.get("/order/{order_id}/audit")
 async def order_audit_log(
@@ -826,7 +974,9 @@ async def order_audit_log(
     # First, verify the order exists and belongs to the specified restaurant
     db_order = db.query(models.Order).options(
         joinedload(models.Order.items).joinedload(models.OrderItem.item)
-    ).filter(models.Order.id == order_id).first()
+    ).filter(models.Order.id == order_id).first() or crud.get_archived_order(
+        db, order_id, joinedload(models.ArchivedOrder.items).joinedload(models.ArchivedOrderItem.item)
+    )
     
     if not db_order:
         raise HTTPException(status_code=404, detail="Order not found.")
@@ -887,9 +1037,11 @@ async def update_payment_status(
         )
     
     try:
-        return crud.update_payment(db, order_id, payment)
+        db_payment, kds_version = crud.update_payment(db, order_id, payment)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    await notify_admins_order_status(db_order, db_order, kds_version) # The payment status decides whether the order stays on the board
+    return db_payment
 
 # --- PROMO CODE ---
 @router.post("/promo/apply", response_model=schemas.PromoCodeOut)
@@ -924,6 +1076,7 @@ def delete_promo_code(promo_id: int, db: Session = Depends(get_db), current_user
 async def order_analytics(
     restaurant_id: str,
     period: Optional[str] = "daily", 
+    raw: bool = False,
     db: Session = Depends(get_db), 
     current_user: TokenData = Depends(get_current_user)
 ):
@@ -932,12 +1085,19 @@ async def order_analytics(
     
     Parameters:
     - restaurant_id: The restaurant ID to get analytics for
-    - period: Time period for analytics (daily, weekly, monthly)
+    - period: Time period for analytics (daily, weekly, monthly), in the restaurant's timezone
+    - raw: Compute from the orders tables instead of the sales rollups (for verification)
+
+    order_count is every order created in the period, whatever its status; paid_count,
+    total_sales, gross_sales and popular_items cover paid orders (refunds netted out of total_sales).
     """
     # Verify admin access
     await verify_restaurant_admin(db, restaurant_id, current_user)
     
-    return crud.get_order_analytics(db, period=period)
+    try:
+        return crud.get_order_analytics(db, period=period, restaurant_id=restaurant_id, raw=raw)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 from fastapi.responses import StreamingResponse
 import io
@@ -950,14 +1110,21 @@ async def export_orders(
     end_date: Optional[str] = None,
     payment_method: Optional[str] = None,
     user_id: Optional[str] = None,
-    order_id: Optional[int] = None,
+    order_id: Optional[str] = None,
     user_email: Optional[str] = None,
     user_phone: Optional[str] = None,
-    db: Session = Depends(get_db),
+    include_items: bool = False,
+    gzip: bool = False,
+    db: AnySession = Depends(get_order_db),
     current_user: TokenData = Depends(get_current_user)
 ):
     """
-    Export orders to CSV with optional filters for a specific restaurant
+    Export orders to CSV with optional filters for a specific restaurant.
+    Rows are streamed from the database as they are encoded, so exports of any size use constant memory.
+
+    Parameters:
+    - include_items: One row per order line (item id, name, quantity, unit price) instead of one row per order
+    - gzip: Return a gzip-compressed file (orders.csv.gz)
     """
     # Verify admin access
     await verify_restaurant_admin(db, restaurant_id, current_user)
@@ -966,41 +1133,100 @@ async def export_orders(
     start = datetime.fromisoformat(start_date) if start_date else None
     end = datetime.fromisoformat(end_date) if end_date else None
     
-    orders = crud.filter_orders(
-        db,
-        status=status,
-        start_date=start,
-        end_date=end,
-        payment_method=payment_method,
-        user_id=user_id,
-        order_id=order_id,
-        user_email=user_email,
-        user_phone=user_phone,
-        restaurant_id=restaurant_id
-    )
-    
-    csv_data = crud.export_orders_csv(db, orders)
-    return StreamingResponse(io.StringIO(csv_data), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=orders.csv"})
+    def stream_csv():
+        # The request-scoped session is closed before the response body is sent,
+        # so the stream owns a session of its own for the life of the cursor.
+        export_db = SessionLocal()
+        try:
+            yield from crud.iter_orders_csv(
+                export_db,
+                include_items=include_items,
+                compress=gzip,
+                status=status,
+                start_date=start,
+                end_date=end,
+                payment_method=payment_method,
+                user_uid=user_id,
+                order_id=order_id,
+                user_email=user_email,
+                user_phone=user_phone,
+                restaurant_id=restaurant_id
+            )
+        finally:
+            export_db.close()
+
+    if gzip:
+        return StreamingResponse(stream_csv(), media_type="application/gzip", headers={"Content-Disposition": "attachment; filename=orders.csv.gz"})
+    return StreamingResponse(stream_csv(), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=orders.csv"})
 
 # --- REAL-TIME NOTIFICATIONS (WebSocket) ---
 
-# Use a dict to map websocket to its asyncio.Queue
-active_admin_connections = {}
+async def load_kds_board(restaurant_id: str):
+    """Loads a restaurant's KDS board in a session of its own: websockets hold no request session."""
+    if USE_ASYNC_DB:
+        async with get_async_sessionmaker()() as db:
+            return await crud.load_kds_snapshot_async(db, restaurant_id)
 
-@router.websocket("/ws/admin/orders")
-async def admin_orders_ws(websocket: WebSocket):
+    def load():
+        with SessionLocal() as db:
+            return crud.load_kds_snapshot(db, restaurant_id)
+    return await asyncio.get_running_loop().run_in_executor(None, load)
+
+@router.get("/kds/{restaurant_id}/snapshot")
+async def kds_snapshot(
+    restaurant_id: str,
+    db: AnySession = Depends(get_order_db),
+    current_user: TokenData = Depends(get_current_user)
+):
+    """
+    The restaurant's open orders with their lines, and the KDS version they are current as of.
+    Screens subscribe to the order events first, load this, then apply the events whose version
+    is newer; after a disconnect they reconnect with ?since=<last version seen> to resume.
+    """
+    # Verify admin access
+    await verify_restaurant_admin(db, restaurant_id, current_user)
+    snapshot = await kds_hub.snapshot(restaurant_id, lambda: crud.load_kds_snapshot_async(db, restaurant_id))
+    return {"restaurant_id": restaurant_id, **snapshot}
+
+async def is_kds_admin(restaurant_id: str, token: Optional[str]) -> bool:
+    """
+    Whether `token` is a valid access token (decoded as get_current_user does) of the restaurant's
+    admin, checked in a session of its own like load_kds_board.
+    """
+    if not token:
+        return False
+    try:
+        current_user = get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token), None)
+    except HTTPException:
+        return False
+    if USE_ASYNC_DB:
+        async with get_async_sessionmaker()() as db:
+            restaurant = await crud.get_restaurant_async(db, restaurant_id)
+    else:
+        def load():
+            with SessionLocal() as db:
+                return crud.get_restaurant(db, restaurant_id)
+        restaurant = await asyncio.get_running_loop().run_in_executor(None, load)
+    return restaurant is not None and restaurant.admin_uid == current_user.uid
+
+async def _serve_kds(websocket: WebSocket, restaurant_id: Optional[str], since: Optional[int] = None, token: Optional[str] = None):
+    # Checked before accepting, so a refused screen never subscribes to the restaurant's events
+    if not restaurant_id:
+        # Every screen must name its restaurant; there is no cross-tenant feed
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="restaurant_id is required")
+        return
+    authorization = websocket.headers.get("authorization", "")
+    if token is None and authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):]
+    if not await is_kds_admin(restaurant_id, token):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Only restaurant admin can subscribe to its orders")
+        return
     await websocket.accept()
-    queue = asyncio.Queue()
-    active_admin_connections[websocket] = queue
-    # Background task to send notifications
-    async def sender():
-        try:
-            while True:
-                notification = await queue.get()
-                await websocket.send_text(json.dumps(notification))
-        except Exception as e:
-            logging.exception(f"WebSocket sender task exception: {e}")
-    sender_task = asyncio.create_task(sender())
+    if since is None:
+        connection = kds_hub.subscribe(restaurant_id)
+    else:
+        connection = await kds_hub.resume(restaurant_id, since, lambda: load_kds_board(restaurant_id))
+    sender_task = asyncio.create_task(kds_hub.serve(connection, websocket))
     try:
         while True:
             # Only wait for client pings/keepalives
@@ -1010,19 +1236,56 @@ async def admin_orders_ws(websocket: WebSocket):
                 break
     finally:
         sender_task.cancel()
-        del active_admin_connections[websocket]
-
-async def notify_admins_new_order(order_id: int):
-    print(f"[KDS_DEBUG] notify_admins_new_order called for order_id: {order_id}")
-    # Put a notification on every connected admin's queue
-    for queue in list(active_admin_connections.values()):
-        try:
-            await queue.put({"event": "new_order", "order_id": order_id})
-        except Exception as e:
-            logging.exception(f"Failed to queue new order notification: {e}")
+        kds_hub.unsubscribe(connection)
 
-async def notify_admins_items_added_to_order(order_id: str, affected_items: List[schemas.OrderItemOut]):
-    print(f"[KDS_DEBUG] notify_admins_items_added_to_order called for order_id: {order_id}")
+@router.websocket("/ws/admin/orders")
+async def admin_orders_ws(websocket: WebSocket, restaurant_id: Optional[str] = None, since: Optional[int] = None, token: Optional[str] = None):
+    """
+    Order events for one restaurant (?restaurant_id=...). Frames may hold a {"type": "batch"} of events.
+    ?since=<version> first replays the events after that version (or sends a resync if they are gone).
+    Requires the restaurant admin's access token, as ?token=... (browsers cannot set headers on a
+    websocket) or an Authorization: Bearer header; other clients are closed with 1008.
+    """
+    await _serve_kds(websocket, restaurant_id, since, token)
+
+@router.websocket("/ws/kds/{restaurant_id}")
+async def kds_orders_ws(websocket: WebSocket, restaurant_id: str, since: Optional[int] = None, token: Optional[str] = None):
+    await _serve_kds(websocket, restaurant_id, since, token)
+
+# Order events carry the KDS version of the change ("version") and the order's board entry after
+# it ("order", null once the order is paid or cancelled); see crud_kds.
+
+async def notify_admins_new_order(order: models.Order, order_out: schemas.OrderOut, version: int):
+    logger.debug(f"notify_admins_new_order called for order_id: {order.id}")
+    await event_bus.publish(order.restaurant_id, {
+        "event": "new_order",
+        "order_id": order.id,
+        "version": version,
+        "order": crud.kds_order_entry(order_out)
+    })
+
+async def notify_admins_order_status(order: models.Order, order_out: Union[models.Order, schemas.OrderOut], version: int):
+    # Keyed by order so a screen that is behind only receives the latest status
+    await event_bus.publish(order.restaurant_id, {
+        "type": "order_status",
+        "order_id": order.id,
+        "status": order.status,
+        "payment_status": order.payment_status,
+        "version": version,
+        "order": crud.kds_order_entry(order_out)
+    }, coalesce_key=("order_status", order.id))
+
+async def notify_admins_order_status_batch(restaurant_id: str, changes: List[dict]):
+    # One bulk transition is one version; each change also carries it
+    await event_bus.publish(restaurant_id, {"type": "order_status_batch", "version": changes[0]["version"], "orders": changes})
+
+async def notify_admins_orders_ingested(restaurant_id: str, notification: dict):
+    # Only the orders still open are listed; a batch of paid orders leaves the board as it was
+    await event_bus.publish(restaurant_id, {"type": "orders_ingested", **notification})
+
+async def notify_admins_items_added_to_order(order: models.Order, order_out: schemas.OrderOut, affected_items: List[schemas.OrderItemOut], version: int):
+    order_id, restaurant_id = order.id, order.restaurant_id
+    logger.debug(f"notify_admins_items_added_to_order called for order_id: {order_id}")
     affected_items_data = []
     for item_out in affected_items:
         if item_out.item: 
@@ -1038,14 +1301,10 @@ async def notify_admins_items_added_to_order(order_id: str, affected_items: List
                 "quantity": item_out.quantity,
                 "price": item_out.price,
             })
-    print(f"[KDS_DEBUG] Affected items for order {order_id}: {affected_items_data}")
-    # Put a notification on every connected admin's queue for items added
-    for queue in list(active_admin_connections.values()):
-        try:
-            await queue.put({
-                "type": "items_added_to_order", 
-                "order_id": order_id, 
-                "affected_items": affected_items_data
-            })
-        except Exception as e:
-            logging.exception(f"Failed to queue items_added notification for order {order_id} to websocket {queue}: {e}")
+    await event_bus.publish(restaurant_id, {
+        "type": "items_added_to_order", 
+        "order_id": order_id, 
+        "affected_items": affected_items_data,
+        "version": version,
+        "order": crud.kds_order_entry(order_out)
+    })
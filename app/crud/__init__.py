@@ -13,11 +13,11 @@ from .general import (
     create_audit_log, list_audit_logs,
     get_all_menu_categories, create_menu_category, get_menu_category, update_menu_category, delete_menu_category,
     get_all_menu_items, create_menu_item, get_menu_item, update_menu_item, delete_menu_item,
-    create_order, get_orders_by_user, get_all_orders, filter_orders, update_order_status,
+    create_order, get_orders_by_user, get_all_orders, filter_orders, get_order_summaries, update_order_status,
     confirm_order, mark_order_paid, cancel_order, refund_order,
     update_payment,
     apply_promo_code, create_promo_code, get_all_promo_codes, update_promo_code, delete_promo_code,
-    get_order_analytics, export_orders_csv,
+    get_order_analytics, export_orders_csv, iter_orders_csv,
     get_unpaid_order_by_table, add_items_to_order, add_menu_item_to_session
 )
 
@@ -29,7 +29,8 @@ from .crud_inventory import (
     create_inventory_item,
     update_inventory_item_stock,
     list_inventory_update_logs,
-    deduct_inventory_for_sale
+    deduct_inventory_for_sale,
+    deduct_inventory_for_sale_bulk
 )
 
 # Import from coupon-specific CRUD functions
@@ -56,6 +57,116 @@ from .crud_tables import (
     delete_restaurant_table
 )
 
+# Import from order-number sequence CRUD functions
+from .crud_sequences import (
+    reserve_order_numbers,
+    allocate_order_number
+)
+
+# Import from sales rollup CRUD functions
+from .crud_rollups import (
+    get_sales_analytics,
+    rebuild_sales_rollups,
+    get_item_quantities_sold
+)
+
+# Import from order status transition CRUD functions
+from .crud_order_status import (
+    bulk_transition_order_status
+)
+
+# Import from open table order CRUD functions
+from .crud_open_tables import (
+    get_open_table_order
+)
+
+# Import from idempotency key CRUD functions
+from .crud_idempotency import (
+    request_fingerprint,
+    claim_idempotency_key,
+    complete_idempotency_key,
+    release_idempotency_key,
+    purge_expired_idempotency_keys
+)
+
+# Import from async order lifecycle CRUD functions
+from .crud_async import (
+    run_in_session,
+    get_restaurant_async,
+    get_order_restaurant_id_async,
+    order_out_async,
+    get_order_out_async,
+    get_unpaid_order_by_table_async,
+    create_order_async,
+    add_items_to_order_async,
+    update_order_status_async,
+    confirm_order_async,
+    mark_order_paid_async,
+    cancel_order_async,
+    refund_order_async,
+    bulk_transition_order_status_async,
+    filter_orders_async,
+    get_order_summaries_async,
+    load_kds_snapshot_async,
+    ingest_offline_orders_async
+)
+
+# Import from order archive CRUD functions
+from .crud_archive import (
+    archive_closed_orders,
+    archive_watermark,
+    reaches_archive,
+    paginate_orders,
+    get_archived_order
+)
+
+# Import from KDS board CRUD functions
+from .crud_kds import (
+    bump_kds_version,
+    kds_order_entry,
+    kds_order_entries,
+    load_kds_snapshot
+)
+
+# Import from offline order ingestion CRUD functions
+from .crud_ingest import (
+    ingest_offline_orders
+)
+
+# Import from menu version CRUD functions
+from .crud_menu import (
+    bump_menu_version,
+    get_menu_version,
+    build_menu_snapshot,
+    publish_menu_snapshot,
+    get_menu_snapshot,
+    get_active_menu_restaurant_ids,
+    flatten_combo_components,
+    rebuild_combo_expansions,
+    expand_combo_quantities,
+    menu_item_out_options,
+    search_menu_items
+)
+
+# Import from menu import CRUD functions
+from .crud_menu_import import (
+    MENU_IMPORT_REQUIRED_COLUMNS,
+    normalize_menu_columns,
+    parse_menu_frame,
+    get_or_create_menu_categories,
+    insert_menu_items,
+    parse_menu_variation_rows,
+    add_menu_item_variations,
+    import_menu_chunk,
+    create_menu_import_job,
+    get_menu_import_job,
+    get_menu_import_jobs,
+    start_menu_import_job,
+    record_menu_import_progress,
+    finish_menu_import_job,
+    fail_stale_menu_import_jobs
+)
+
 # If you have other specific CRUD files (e.g., app/crud/crud_coupons.py), import from them similarly:
 # from .crud_coupons import (
 #    create_coupon,
@@ -77,16 +188,16 @@ __all__ = [
     "create_audit_log", "list_audit_logs",
     "get_all_menu_categories", "create_menu_category", "get_menu_category", "update_menu_category", "delete_menu_category",
     "get_all_menu_items", "create_menu_item", "get_menu_item", "update_menu_item", "delete_menu_item",
-    "create_order", "get_orders_by_user", "get_all_orders", "filter_orders", "update_order_status",
+    "create_order", "get_orders_by_user", "get_all_orders", "filter_orders", "get_order_summaries", "update_order_status",
     "confirm_order", "mark_order_paid", "cancel_order", "refund_order",
     "update_payment",
     "apply_promo_code", "create_promo_code", "get_all_promo_codes", "update_promo_code", "delete_promo_code",
-    "get_order_analytics", "export_orders_csv",
+    "get_order_analytics", "export_orders_csv", "iter_orders_csv",
     "get_unpaid_order_by_table", "add_items_to_order", "add_menu_item_to_session",
 
     # Functions from .crud_inventory
     "get_inventory_item", "get_inventory_item_by_menu_id", "create_inventory_item",
-    "update_inventory_item_stock", "list_inventory_update_logs", "deduct_inventory_for_sale",
+    "update_inventory_item_stock", "list_inventory_update_logs", "deduct_inventory_for_sale", "deduct_inventory_for_sale_bulk",
 
     # Functions from .crud_coupons
     "create_coupon_instance",
@@ -108,6 +219,94 @@ __all__ = [
     "update_table_details",
     "delete_restaurant_table",
 
+    # Functions from .crud_sequences
+    "reserve_order_numbers",
+    "allocate_order_number",
+
+    # Functions from .crud_rollups
+    "get_sales_analytics",
+    "rebuild_sales_rollups",
+    "get_item_quantities_sold",
+
+    # Functions from .crud_order_status
+    "bulk_transition_order_status",
+
+    # Functions from .crud_open_tables
+    "get_open_table_order",
+
+    # Functions from .crud_idempotency
+    "request_fingerprint",
+    "claim_idempotency_key",
+    "complete_idempotency_key",
+    "release_idempotency_key",
+    "purge_expired_idempotency_keys",
+
+    # Functions from .crud_async
+    "run_in_session",
+    "get_restaurant_async",
+    "get_order_restaurant_id_async",
+    "order_out_async",
+    "get_order_out_async",
+    "get_unpaid_order_by_table_async",
+    "create_order_async",
+    "add_items_to_order_async",
+    "update_order_status_async",
+    "confirm_order_async",
+    "mark_order_paid_async",
+    "cancel_order_async",
+    "refund_order_async",
+    "bulk_transition_order_status_async",
+    "filter_orders_async",
+    "get_order_summaries_async",
+    "load_kds_snapshot_async",
+    "ingest_offline_orders_async",
+
+    # Functions from .crud_archive
+    "archive_closed_orders",
+    "archive_watermark",
+    "reaches_archive",
+    "paginate_orders",
+    "get_archived_order",
+
+    # Functions from .crud_kds
+    "bump_kds_version",
+    "kds_order_entry",
+    "kds_order_entries",
+    "load_kds_snapshot",
+
+    # Functions from .crud_ingest
+    "ingest_offline_orders",
+
+    # Functions from .crud_menu
+    "bump_menu_version",
+    "get_menu_version",
+    "build_menu_snapshot",
+    "publish_menu_snapshot",
+    "get_menu_snapshot",
+    "get_active_menu_restaurant_ids",
+    "flatten_combo_components",
+    "rebuild_combo_expansions",
+    "expand_combo_quantities",
+    "menu_item_out_options",
+    "search_menu_items",
+
+    # Functions from .crud_menu_import
+    "MENU_IMPORT_REQUIRED_COLUMNS",
+    "normalize_menu_columns",
+    "parse_menu_frame",
+    "get_or_create_menu_categories",
+    "insert_menu_items",
+    "parse_menu_variation_rows",
+    "add_menu_item_variations",
+    "import_menu_chunk",
+    "create_menu_import_job",
+    "get_menu_import_job",
+    "get_menu_import_jobs",
+    "start_menu_import_job",
+    "record_menu_import_progress",
+    "finish_menu_import_job",
+    "fail_stale_menu_import_jobs",
+
     # Add functions from other crud files like crud_coupons to this list as well if they exist
 ]
 
@@ -0,0 +1,135 @@
+"""
+Hot/cold split of the order tables.
+
+Orders that have been closed (paid, cancelled or refunded) for ORDER_ARCHIVE_AFTER_DAYS are moved,
+with their lines, payment and status history, into the archived_* tables in bounded batches (see
+archive_closed_orders and app/utils/order_archiver.py). The hot tables then only grow with recent
+activity, so their indexes stay small however much history accumulates.
+
+Reads go to the archive only when they can reach it: list and filter pages use paginate_orders,
+which queries the archive only if the requested range starts at or before the newest archived
+order (the watermark) and the hot rows do not already fill the page. Archived orders are read-only;
+status changes, payments and refunds only apply to hot orders.
+"""
+from sqlalchemy.orm import Query, Session
+from sqlalchemy import and_, delete, exists, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from typing import Callable, List, NamedTuple, Optional, Tuple
+import logging
+import os
+
+from .. import models
+from .pagination import apply_order_keyset, apply_undated_order_keyset, split_order_page
+
+logger = logging.getLogger(__name__)
+
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "90")) # Closed this long -> moved to the archive
+ARCHIVE_BATCH_SIZE = 500 # Orders moved per transaction
+
+class OrderTables(NamedTuple):
+    order: type
+    item: type
+    payment: type
+    history: type
+
+HOT_ORDER_TABLES = OrderTables(models.Order, models.OrderItem, models.Payment, models.OrderStatusHistory)
+ARCHIVED_ORDER_TABLES = OrderTables(models.ArchivedOrder, models.ArchivedOrderItem, models.ArchivedPayment, models.ArchivedOrderStatusHistory)
+
+def _archivable(cutoff: datetime):
+    """Closed before `cutoff` and not referenced by a coupon usage or an open table (both FK orders.id)."""
+    order = models.Order
+    return and_(
+        or_(order.payment_status.in_(("Paid", "Refunded")), order.status.in_(("Cancelled", "Refunded"))),
+        or_(order.updated_at < cutoff, and_(order.updated_at.is_(None), order.created_at < cutoff)),
+        ~exists().where(models.CouponUsage.order_id == order.id),
+        ~exists().where(models.OpenTableOrder.order_id == order.id)
+    )
+
+def _move_orders(db: Session, order_ids: List[str]) -> None:
+    """Copies the orders and their child rows into the archive, then deletes them from the hot tables."""
+    for hot, archived in zip(HOT_ORDER_TABLES, ARCHIVED_ORDER_TABLES): # Orders first: the children reference them
+        names = [column.name for column in archived.__table__.columns]
+        key = hot.__table__.c.id if hot is models.Order else hot.__table__.c.order_id
+        db.execute(insert(archived.__table__).from_select(
+            names, select(*(hot.__table__.c[name] for name in names)).where(key.in_(order_ids))
+        ))
+    for hot in reversed(HOT_ORDER_TABLES):
+        key = hot.__table__.c.id if hot is models.Order else hot.__table__.c.order_id
+        db.execute(delete(hot.__table__).where(key.in_(order_ids)))
+
+def archive_closed_orders(db: Session, older_than_days: int = ORDER_ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE, max_batches: Optional[int] = None) -> int:
+    """
+    Moves orders closed more than `older_than_days` ago into the archive tables, `batch_size`
+    orders per transaction, oldest first, until none are left (or after `max_batches`).
+    Rows locked by another transaction are skipped (FOR UPDATE SKIP LOCKED on PostgreSQL) and picked
+    up by a later run. Sales rollups are left as they are: they already include these orders.
+    Returns the number of orders archived.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        order_ids = [order_id for (order_id,) in db.query(models.Order.id)
+                     .filter(_archivable(cutoff))
+                     .order_by(models.Order.updated_at, models.Order.id)
+                     .limit(batch_size)
+                     .with_for_update(skip_locked=True)]
+        if not order_ids:
+            break
+        try:
+            _move_orders(db, order_ids)
+            db.commit()
+        except IntegrityError as e:
+            # E.g. an archive row left by a partially restored backup; stop rather than spin on the same batch
+            db.rollback()
+            logger.error(f"Archiving a batch of {len(order_ids)} orders failed, starting at {order_ids[0]}: {e}")
+            break
+        archived += len(order_ids)
+        batches += 1
+        if len(order_ids) < batch_size:
+            break
+    if archived:
+        logger.info(f"Archived {archived} orders closed before {cutoff.isoformat()}")
+    return archived
+
+def archive_watermark(db: Session) -> Optional[datetime]:
+    """created_at of the newest archived order: ranges starting after it never need the archive."""
+    return db.query(func.max(models.ArchivedOrder.created_at)).scalar()
+
+def reaches_archive(db: Session, start_date: Optional[datetime] = None) -> bool:
+    """Whether orders created at or after `start_date` (any time if None) can be in the archive."""
+    watermark = archive_watermark(db)
+    return watermark is not None and (start_date is None or start_date <= watermark)
+
+def _sort_key(row) -> Tuple[datetime, str]:
+    return row.created_at or datetime.min, row.id
+
+def paginate_orders(db: Session, build_query: Callable[[OrderTables], Query], position: Optional[Tuple[Optional[datetime], str]], page_size: int, start_date: Optional[datetime] = None) -> Tuple[list, Optional[str]]:
+    """
+    One keyset page (newest first) across the hot and archived tables. `build_query(tables)` returns
+    the filtered query for one set of tables; its rows need created_at and id.
+
+    The hot page is fetched first. The archive is only queried when the range can reach it and the
+    hot rows do not fill the page with orders newer than anything archived, so recent pages cost
+    exactly what they did before archiving. Orders without a created_at come last, by id; the
+    page that runs out of dated orders looks them up too.
+    """
+    rows = apply_order_keyset(build_query(HOT_ORDER_TABLES), position, page_size).all()
+    watermark = archive_watermark(db) # Index lookup
+    if watermark is not None and (start_date is None or start_date <= watermark) \
+            and (len(rows) <= page_size or rows[-1].created_at is None or rows[-1].created_at <= watermark):
+        rows += apply_order_keyset(build_query(ARCHIVED_ORDER_TABLES), position, page_size, model=models.ArchivedOrder).all()
+        rows.sort(key=_sort_key, reverse=True)
+        rows = rows[:page_size + 1]
+    if len(rows) <= page_size and start_date is None and not (position and position[0] is None):
+        # Dated orders ran out; any without a created_at follow them
+        remaining = page_size - len(rows)
+        rows += apply_undated_order_keyset(build_query(HOT_ORDER_TABLES), None, remaining).all()
+        if watermark is not None:
+            rows += apply_undated_order_keyset(build_query(ARCHIVED_ORDER_TABLES), None, remaining, model=models.ArchivedOrder).all()
+        rows.sort(key=_sort_key, reverse=True)
+        rows = rows[:page_size + 1]
+    return split_order_page(rows, page_size)
+
+def get_archived_order(db: Session, order_id: str, *options) -> Optional[models.ArchivedOrder]:
+    return db.query(models.ArchivedOrder).options(*options).filter(models.ArchivedOrder.id == order_id).first()
@@ -0,0 +1,101 @@
+"""
+Async variants of the order lifecycle CRUD, for the AsyncSession mode (USE_ASYNC_DB; see
+database.get_async_db).
+
+Each variant runs the sync implementation through AsyncSession.run_sync: the ORM logic stays in one
+place, but its SQL goes through the async driver, so the event loop keeps serving other requests
+while a query is in flight. Given a plain Session, a variant calls the sync function directly, so
+endpoints can be written once for both modes. ORM objects loaded through an AsyncSession cannot
+lazy-load outside run_sync; build responses with order_out_async.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar, Union
+
+from .. import models, schemas
+from .general import (
+    get_restaurant, create_order, add_items_to_order, get_unpaid_order_by_table,
+    update_order_status, confirm_order, mark_order_paid, cancel_order, refund_order,
+    filter_orders, get_order_summaries
+)
+from .crud_order_status import bulk_transition_order_status
+from .crud_kds import load_kds_snapshot
+from .crud_ingest import ingest_offline_orders
+from .crud_menu import menu_item_out_options
+
+AnySession = Union[Session, AsyncSession]
+T = TypeVar("T")
+
+async def run_in_session(db: AnySession, fn: Callable[..., T], *args, **kwargs) -> T:
+    """Calls fn(session, *args, **kwargs) on the sync session behind `db`, without blocking the loop for an AsyncSession."""
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return fn(db, *args, **kwargs)
+
+def _order_restaurant_id(db: Session, order_id: str) -> Optional[str]:
+    return db.query(models.Order.restaurant_id).filter(models.Order.id == order_id).scalar()
+
+def _order_out(db: Session, order: models.Order) -> schemas.OrderOut:
+    return schemas.OrderOut.from_orm(order)
+
+def _get_order_out(db: Session, order_id: str) -> Optional[schemas.OrderOut]:
+    order = db.query(models.Order).options(
+        selectinload(models.Order.items).selectinload(models.OrderItem.item).options(*menu_item_out_options()),
+        selectinload(models.Order.payment),
+        selectinload(models.Order.status_history)
+    ).filter(models.Order.id == order_id).first()
+    return schemas.OrderOut.from_orm(order) if order else None
+
+async def get_restaurant_async(db: AnySession, restaurant_id: str) -> Optional[models.Restaurant]:
+    return await run_in_session(db, get_restaurant, restaurant_id)
+
+async def get_order_restaurant_id_async(db: AnySession, order_id: str) -> Optional[str]:
+    """The restaurant an order belongs to (None if there is no such order), without loading the order."""
+    return await run_in_session(db, _order_restaurant_id, order_id)
+
+async def order_out_async(db: AnySession, order: models.Order) -> schemas.OrderOut:
+    """Builds the OrderOut response, letting any relationship it needs load inside the session."""
+    return await run_in_session(db, _order_out, order)
+
+async def get_order_out_async(db: AnySession, order_id: str) -> Optional[schemas.OrderOut]:
+    """Loads an order with everything OrderOut needs in one eager query and converts it."""
+    return await run_in_session(db, _get_order_out, order_id)
+
+async def get_unpaid_order_by_table_async(db: AnySession, restaurant_id: str, table_number: str) -> Optional[models.Order]:
+    return await run_in_session(db, get_unpaid_order_by_table, restaurant_id, table_number)
+
+async def create_order_async(db: AnySession, order: schemas.OrderCreate, user_uid: str, user_role: str, admin_uid: Optional[str] = None) -> Tuple[models.Order, int]:
+    return await run_in_session(db, create_order, order, user_uid, user_role, admin_uid)
+
+async def add_items_to_order_async(db: AnySession, existing_order: models.Order, new_items_create: List[schemas.OrderItemCreate], user_uid: str) -> Tuple[models.Order, List[models.OrderItem], int]:
+    return await run_in_session(db, add_items_to_order, existing_order, new_items_create, user_uid)
+
+async def update_order_status_async(db: AnySession, order_id: str, status: str, changed_by: str) -> Tuple[models.Order, int]:
+    return await run_in_session(db, update_order_status, order_id, status, changed_by)
+
+async def confirm_order_async(db: AnySession, order_id: str, changed_by: str) -> Tuple[models.Order, int]:
+    return await run_in_session(db, confirm_order, order_id, changed_by)
+
+async def mark_order_paid_async(db: AnySession, order_id: str, changed_by: str, payment_method: str, transaction_id: Optional[str] = None, customer_uid: Optional[str] = None) -> Tuple[models.Order, int]:
+    return await run_in_session(db, mark_order_paid, order_id, changed_by, payment_method, transaction_id, customer_uid)
+
+async def cancel_order_async(db: AnySession, order_id: str, cancelled_by: str) -> Tuple[models.Order, int]:
+    return await run_in_session(db, cancel_order, order_id, cancelled_by)
+
+async def refund_order_async(db: AnySession, order_id: str, refunded_by: str) -> Tuple[models.Order, int]:
+    return await run_in_session(db, refund_order, order_id, refunded_by)
+
+async def bulk_transition_order_status_async(db: AnySession, restaurant_id: str, order_ids: List[str], target_status: str, changed_by: str) -> Tuple[List[Dict], List[Dict]]:
+    return await run_in_session(db, bulk_transition_order_status, restaurant_id, order_ids, target_status, changed_by)
+
+async def filter_orders_async(db: AnySession, cursor: Optional[str] = None, limit: Optional[int] = None, **filters) -> Tuple[List[Dict], Optional[str]]:
+    return await run_in_session(db, filter_orders, cursor=cursor, limit=limit, **filters)
+
+async def get_order_summaries_async(db: AnySession, cursor: Optional[str] = None, limit: Optional[int] = None, **filters) -> Tuple[List[Dict], Optional[str]]:
+    return await run_in_session(db, get_order_summaries, cursor=cursor, limit=limit, **filters)
+
+async def load_kds_snapshot_async(db: AnySession, restaurant_id: str) -> Tuple[int, List[Dict]]:
+    return await run_in_session(db, load_kds_snapshot, restaurant_id)
+
+async def ingest_offline_orders_async(db: AnySession, restaurant_id: str, orders: List[schemas.OfflineOrderCreate], user_uid: str, user_role: str) -> Tuple[List[Dict], Optional[Dict]]:
+    return await run_in_session(db, ingest_offline_orders, restaurant_id, orders, user_uid, user_role)
@@ -0,0 +1,105 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import update, delete
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from typing import Optional
+import hashlib
+import json
+import logging
+import os
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# How long a completed response is replayed for, and how long a claim may stay in progress
+# before another request may take it over (the owning worker is assumed to have died).
+IDEMPOTENCY_KEY_TTL = timedelta(hours=int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24")))
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(seconds=int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT_SECONDS", "60")))
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+def request_fingerprint(*parts) -> str:
+    """Stable hash of everything that identifies a request (method, path, parameters, body)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def _take_over(db: Session, record: Row, fingerprint: str, now: datetime) -> bool:
+    """Re-claims an expired or abandoned key; compare-and-set on locked_at so only one request wins."""
+    table = models.IdempotencyKey
+    claimed = db.execute(update(table).where(
+        table.user_uid == record.user_uid,
+        table.key == record.key,
+        table.locked_at == record.locked_at
+    ).values(
+        request_fingerprint=fingerprint, status="in_progress", response_status=None, response_body=None,
+        created_at=now, locked_at=now, expires_at=now + IDEMPOTENCY_KEY_TTL
+    ).execution_options(synchronize_session=False)).rowcount
+    db.commit()
+    return bool(claimed)
+
+def claim_idempotency_key(db: Session, user_uid: str, key: str, fingerprint: str) -> Optional[Row]:
+    """
+    Tries to make the current request the owner of (user_uid, key). Returns None when it is the
+    owner: the caller runs the request, then calls complete_idempotency_key (or
+    release_idempotency_key if it failed). Otherwise returns the existing record's columns, either
+    "completed" (replay its response) or "in_progress" (another request is running it).
+
+    Raises ValueError if the key was already used for a different request.
+    """
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters.")
+    table = models.IdempotencyKey
+    for _ in range(3): # The existing row can be purged or taken over between our INSERT and SELECT
+        now = datetime.utcnow()
+        try:
+            # Savepoint so losing the race to a concurrent duplicate does not abort the session
+            with db.begin_nested():
+                db.add(table(
+                    user_uid=user_uid, key=key, request_fingerprint=fingerprint, status="in_progress",
+                    created_at=now, locked_at=now, expires_at=now + IDEMPOTENCY_KEY_TTL
+                ))
+            db.commit()
+            return None
+        except IntegrityError:
+            pass
+
+        record = db.query(
+            table.user_uid, table.key, table.request_fingerprint, table.status,
+            table.response_status, table.response_body, table.locked_at, table.expires_at
+        ).filter(table.user_uid == user_uid, table.key == key).first()
+        db.commit() # End the read so the next poll sees fresh rows
+        if record is None:
+            continue
+        if record.expires_at <= now or (record.status == "in_progress" and record.locked_at <= now - IDEMPOTENCY_LOCK_TIMEOUT):
+            if _take_over(db, record, fingerprint, now):
+                logger.warning(f"Idempotency key {key!r} of user {user_uid} was expired or abandoned; re-running the request.")
+                return None
+            continue
+        if record.request_fingerprint != fingerprint:
+            raise ValueError("Idempotency-Key was already used with a different request.")
+        return record
+    raise Exception(f"Could not claim idempotency key {key!r} for user {user_uid}")
+
+def complete_idempotency_key(db: Session, user_uid: str, key: str, status_code: int, body: str) -> None:
+    """Stores the response of a claimed request so retries are answered from the store."""
+    table = models.IdempotencyKey
+    db.execute(update(table).where(
+        table.user_uid == user_uid, table.key == key, table.status == "in_progress"
+    ).values(status="completed", response_status=status_code, response_body=body).execution_options(synchronize_session=False))
+    db.commit()
+
+def release_idempotency_key(db: Session, user_uid: str, key: str) -> None:
+    """Drops the claim of a request that failed, so a retry with the same key runs it again."""
+    db.rollback() # The failed request may have left the session mid-transaction
+    table = models.IdempotencyKey
+    db.execute(delete(table).where(
+        table.user_uid == user_uid, table.key == key, table.status == "in_progress"
+    ).execution_options(synchronize_session=False))
+    db.commit()
+
+def purge_expired_idempotency_keys(db: Session) -> int:
+    """Deletes keys past their TTL and returns how many were removed."""
+    table = models.IdempotencyKey
+    removed = db.execute(delete(table).where(table.expires_at <= datetime.utcnow()).execution_options(synchronize_session=False)).rowcount
+    db.commit()
+    return removed
@@ -0,0 +1,199 @@
+"""
+Bulk ingestion of orders a POS took while offline.
+
+A batch is checked against one menu snapshot (one query for every item it mentions), gets its
+order numbers as one reserved block, and is written in a single transaction with executemany
+inserts for orders, lines, payments and open tables. Inventory is deducted once per menu item for
+the whole batch, sales rollups move with one upsert, and KDS screens get one event. Each order
+carries the client_order_id its POS gave it, so uploading a batch again only reports the orders
+that are already in.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from .. import models, schemas
+from .crud_inventory import deduct_inventory_for_sale_bulk
+from .crud_menu import expand_combo_quantities
+from .crud_sequences import reserve_order_numbers
+from .crud_rollups import SalesTransition, apply_sales_transitions
+from .crud_open_tables import is_open_order
+from .crud_order_status import PAYMENT_STATUS_FOR
+from .crud_kds import bump_kds_version, kds_order_entries
+
+logger = logging.getLogger(__name__)
+
+MAX_OFFLINE_BATCH_ORDERS = 1000
+OFFLINE_ORDER_STATUSES = ("Pending", "Order Confirmed", "Payment Done", "Cancelled")
+
+def _utc_naive(moment: Optional[datetime], now: datetime) -> datetime:
+    """A POS timestamp as the naive UTC the order tables store, never later than `now`."""
+    if moment is None:
+        return now
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(moment, now)
+
+def _existing_client_orders(db: Session, restaurant_id: str, client_order_ids: List[str]) -> Dict[str, Tuple[str, Optional[int]]]:
+    """client_order_id -> (order id, order number) of the orders already ingested, hot or archived."""
+    found = {}
+    for order in (models.Order, models.ArchivedOrder):
+        for client_order_id, order_id, order_number in db.query(order.client_order_id, order.id, order.order_number).filter(
+            order.restaurant_id == restaurant_id,
+            order.client_order_id.in_(client_order_ids)
+        ):
+            found[client_order_id] = (order_id, order_number)
+    return found
+
+def _validate(order: schemas.OfflineOrderCreate, menu_items: Dict[int, models.MenuItem]) -> Tuple[Optional[str], Dict[int, int]]:
+    """(rejection reason or None, menu item id -> quantity) for one offline order."""
+    if order.status not in OFFLINE_ORDER_STATUSES:
+        return f"Unknown order status '{order.status}'. Choose from {', '.join(OFFLINE_ORDER_STATUSES)}.", {}
+    if (order.status == "Payment Done") != (order.payment is not None):
+        return "A payment must be given exactly when the status is 'Payment Done'.", {}
+    if not order.items:
+        return "Order must contain at least one item.", {}
+    quantities: Dict[int, int] = {} # Repeated menu items in one order are merged
+    for item in order.items:
+        if item.quantity <= 0:
+            return f"Invalid quantity for item {item.item_id}", {}
+        if item.item_id not in menu_items:
+            return f"Menu item not found: {item.item_id}", {}
+        quantities[item.item_id] = quantities.get(item.item_id, 0) + item.quantity
+    return None, quantities
+
+def _ingest(db: Session, restaurant_id: str, orders: List[schemas.OfflineOrderCreate], user_uid: str, user_role: str) -> Tuple[List[Dict], Optional[Dict]]:
+    client_order_ids = [str(order.client_order_id) for order in orders]
+    existing = _existing_client_orders(db, restaurant_id, list(set(client_order_ids)))
+    restaurant = db.query(models.Restaurant).filter(models.Restaurant.restaurant_id == restaurant_id).first()
+    if restaurant is None:
+        raise ValueError(f"Restaurant {restaurant_id} not found.")
+    # The menu snapshot: every item the batch mentions, available or not, since these sales already happened
+    menu_items = {menu_item.id: menu_item for menu_item in db.query(models.MenuItem).filter(
+        models.MenuItem.restaurant_id == restaurant_id,
+        models.MenuItem.id.in_(list({item.item_id for order in orders for item in order.items}))
+    )}
+    tables_taken = {table_number for (table_number,) in db.query(models.OpenTableOrder.table_number).filter(
+        models.OpenTableOrder.restaurant_id == restaurant_id,
+        models.OpenTableOrder.table_number.in_(list({order.table_number for order in orders if order.table_number}))
+    )}
+
+    now = datetime.utcnow()
+    results: List[Dict] = []
+    accepted = [] # (result, order, created_at, quantities)
+    seen = set()
+    for client_order_id, order in zip(client_order_ids, orders):
+        result = {"client_order_id": client_order_id}
+        results.append(result)
+        if client_order_id in existing:
+            result["result"] = "already_ingested"
+            result["order_id"], result["order_number"] = existing[client_order_id]
+            continue
+        if client_order_id in seen:
+            result.update(result="duplicate", detail="The same client_order_id appears earlier in this batch.")
+            continue
+        seen.add(client_order_id)
+        reason, quantities = _validate(order, menu_items)
+        opens_table = order.table_number and is_open_order(order.status, PAYMENT_STATUS_FOR.get(order.status, "Pending"))
+        if reason is None and opens_table:
+            if order.table_number in tables_taken:
+                reason = f"Table {order.table_number} already has an open order; settle it or upload this order as paid or cancelled."
+            else:
+                tables_taken.add(order.table_number)
+        if reason:
+            result.update(result="rejected", detail=reason)
+            continue
+        accepted.append((result, order, _utc_naive(order.created_at, now), quantities))
+    if not accepted:
+        return results, None
+
+    # Numbers follow the order the sales were made in
+    accepted.sort(key=lambda entry: entry[2])
+    first, _ = reserve_order_numbers(db, restaurant_id, len(accepted), restaurant.bill_series_start or 1)
+    prefix = restaurant.bill_number_prefix
+    order_rows, line_rows, payment_rows, table_rows, transitions = [], [], [], [], []
+    sold: Dict[int, float] = {}
+    for number, (result, order, created_at, quantities) in enumerate(accepted, start=first):
+        order_id = f"{restaurant_id}_{number}"
+        payment_status = PAYMENT_STATUS_FOR.get(order.status, "Pending")
+        total_cost = sum(menu_items[item_id].price * quantity for item_id, quantity in quantities.items())
+        order_rows.append({
+            "id": order_id, "order_number": number, "bill_number": f"{prefix}{number}" if prefix else None,
+            "client_order_id": result["client_order_id"], "user_uid": user_uid, "user_role": user_role,
+            "table_number": order.table_number, "created_at": created_at, "updated_at": now,
+            "status": order.status, "total_cost": total_cost, "payment_status": payment_status,
+            "restaurant_id": restaurant_id, "restaurant_name": restaurant.restaurant_name
+        })
+        line_rows.extend({"order_id": order_id, "item_id": item_id, "quantity": quantity, "price": menu_items[item_id].price}
+                         for item_id, quantity in quantities.items())
+        if order.payment is not None:
+            payment_rows.append({
+                "order_id": order_id, "amount": total_cost, "method": order.payment.method, "status": "Paid",
+                "paid_at": _utc_naive(order.payment.paid_at, now) if order.payment.paid_at else created_at,
+                "processed_at": now, "transaction_id": order.payment.transaction_id
+            })
+        if order.table_number and is_open_order(order.status, payment_status):
+            table_rows.append({"restaurant_id": restaurant_id, "table_number": order.table_number, "order_id": order_id, "opened_at": created_at})
+        for item_id, quantity in quantities.items(): # Deducted as POST /order would have, cancelled orders included
+            sold[item_id] = sold.get(item_id, 0.0) + quantity
+        transitions.append(SalesTransition(order_id, restaurant_id, created_at, total_cost, (None, None), (order.status, payment_status)))
+        result.update(result="created", order_id=order_id, order_number=number)
+
+    # render_nulls keeps every row's column set the same, so each table is one executemany
+    db.bulk_insert_mappings(models.Order, order_rows, render_nulls=True)
+    db.bulk_insert_mappings(models.OrderItem, line_rows)
+    if payment_rows:
+        db.bulk_insert_mappings(models.Payment, payment_rows, render_nulls=True)
+    if table_rows:
+        db.bulk_insert_mappings(models.OpenTableOrder, table_rows)
+    deduct_inventory_for_sale_bulk(
+        db=db,
+        restaurant_id=restaurant_id,
+        quantities_sold=expand_combo_quantities(menu_items.values(), sold),
+        order_id=f"{order_rows[0]['id']}..{order_rows[-1]['id']} (offline batch of {len(order_rows)})",
+        changed_by_user_id=user_uid
+    )
+    apply_sales_transitions(db, transitions)
+    kds_version = bump_kds_version(db, restaurant_id)
+    db.commit()
+
+    open_ids = [row["id"] for row in order_rows if is_open_order(row["status"], row["payment_status"])]
+    entries = kds_order_entries(db, restaurant_id, open_ids)
+    notification = {
+        "version": kds_version,
+        "ingested": len(order_rows),
+        "orders": [
+            {"order_id": order_id, "status": entries[order_id]["status"], "payment_status": "Pending", "order": entries[order_id]}
+            for order_id in open_ids if order_id in entries
+        ]
+    }
+    return results, notification
+
+def ingest_offline_orders(db: Session, restaurant_id: str, orders: List[schemas.OfflineOrderCreate], user_uid: str, user_role: str) -> Tuple[List[Dict], Optional[Dict]]:
+    """
+    Creates a batch of offline orders for one restaurant in a single transaction.
+
+    Returns (per-order results in request order, the KDS notification: version, ingested count and
+    the new open orders' board entries; None if nothing was created). Orders whose client_order_id
+    is already stored are reported as "already_ingested" with their order id, so a POS can simply
+    upload its queue again after a lost response.
+    """
+    if not orders:
+        raise ValueError("No orders provided.")
+    if len(orders) > MAX_OFFLINE_BATCH_ORDERS:
+        raise ValueError(f"At most {MAX_OFFLINE_BATCH_ORDERS} orders can be uploaded at once.")
+    for attempt in range(2):
+        try:
+            return _ingest(db, restaurant_id, orders, user_uid, user_role)
+        except IntegrityError as e:
+            db.rollback()
+            # Another upload of the same queue (or an order for the same table) committed first; a
+            # second pass reports what it stored
+            if attempt:
+                logger.error(f"Offline batch for restaurant {restaurant_id} conflicted twice: {e}")
+                raise ValueError("The batch conflicted with concurrent changes; upload it again.")
+        except Exception:
+            db.rollback()
+            raise
@@ -1,6 +1,6 @@
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func as sql_func # To avoid conflict with datetime.func if used
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 from .. import models, schemas # Use .. to go up to app directory then import models, schemas
@@ -206,4 +206,55 @@ def deduct_inventory_for_sale(
     # For now, assuming it's part of a larger transaction.
     # If standalone commit is needed: db.commit(); db.refresh(inventory_item)
     
-    return inventory_item 
\ No newline at end of file
+    return inventory_item
+
+
+def deduct_inventory_for_sale_bulk(
+    db: Session,
+    restaurant_id: str,
+    quantities_sold: Dict[int, float],
+    order_id: str, # For logging purposes
+    changed_by_user_id: Optional[str] = None
+) -> List[models.InventoryItem]:
+    """
+    Set-based variant of deduct_inventory_for_sale for a whole order.
+    Loads every tracked inventory row for the given menu items in one query, applies the
+    deductions in memory and bulk-inserts the log rows, so the statement count does not
+    grow with the number of order lines. Untracked menu items are skipped.
+    """
+    if not quantities_sold:
+        return []
+
+    inventory_items = db.query(models.InventoryItem).filter(
+        models.InventoryItem.restaurant_id == restaurant_id,
+        models.InventoryItem.menu_item_id.in_(list(quantities_sold.keys()))
+    ).all()
+    if not inventory_items:
+        return []
+
+    now = datetime.utcnow()
+    log_rows = []
+    for inventory_item in inventory_items:
+        previous_quantity = inventory_item.quantity
+        quantity_change = -abs(quantities_sold[inventory_item.menu_item_id])
+        new_quantity = previous_quantity + quantity_change
+
+        inventory_item.quantity = new_quantity
+        inventory_item.last_updated_at = now
+
+        log_rows.append({
+            "inventory_item_id": inventory_item.id,
+            "changed_by_user_id": changed_by_user_id,
+            "change_type": schemas.InventoryChangeType.SALE_DEDUCTION.value,
+            "quantity_changed": quantity_change,
+            "previous_quantity": previous_quantity,
+            "new_quantity": new_quantity,
+            "reason": f"Sale - Order ID: {order_id}",
+            "timestamp": now,
+        })
+
+    # Flush the quantity updates (batched per column set by the unit of work) before the logs
+    db.flush()
+    db.bulk_insert_mappings(models.InventoryUpdateLog, log_rows)
+    # Commit is handled by the calling transaction, as with deduct_inventory_for_sale
+    return inventory_items
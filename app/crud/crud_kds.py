@@ -0,0 +1,97 @@
+"""
+Versioned open-order state for kitchen display screens.
+
+Every order lifecycle change bumps its restaurant's row in kds_versions inside the change's own
+transaction, and the event published for it carries that version together with the order's
+entry on the board (kds_order_entry; None once the order is paid or cancelled). A screen loads
+the board once (load_kds_snapshot, or kds_hub's in-memory copy of it) and then applies the events
+newer than the board's version; entries are full states, so applying one twice is harmless.
+
+The counter row serializes lifecycle writes of one restaurant, the way order_number_sequences
+already does for order creation; it is bumped just before commit to keep the lock short.
+"""
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+from .. import models
+from .crud_open_tables import is_open_order
+
+logger = logging.getLogger(__name__)
+
+def bump_kds_version(db: Session, restaurant_id: str) -> int:
+    """Increments a restaurant's KDS version in the caller's transaction and returns the new value."""
+    kds = models.KDSVersion
+    stmt = update(kds).where(kds.restaurant_id == restaurant_id).values(
+        version=kds.version + 1, updated_at=datetime.utcnow()
+    ).returning(kds.version).execution_options(synchronize_session=False)
+
+    version = db.execute(stmt).scalar()
+    if version is None:
+        try:
+            # Savepoint so a concurrent seed by another worker does not abort the caller's transaction
+            with db.begin_nested():
+                db.add(models.KDSVersion(restaurant_id=restaurant_id, version=0))
+        except IntegrityError:
+            logger.info(f"KDS version for restaurant {restaurant_id} was seeded concurrently.")
+        version = db.execute(stmt).scalar()
+    if version is None:
+        raise Exception(f"Could not bump the KDS version of restaurant {restaurant_id}")
+    return version
+
+def kds_order_entry(order) -> Optional[Dict]:
+    """
+    An order as the KDS board shows it, or None if it is no longer open. Takes a models.Order with
+    its lines (and their menu items) loaded, or the schemas.OrderOut built from one.
+    """
+    if not is_open_order(order.status, order.payment_status):
+        return None
+    return {
+        "id": order.id,
+        "order_number": order.order_number,
+        "table_number": order.table_number,
+        "status": order.status,
+        "payment_status": order.payment_status,
+        "created_at": order.created_at.isoformat() if order.created_at else None,
+        "total_cost": order.total_cost,
+        "lines": [
+            {
+                "id": line.id,
+                "item_id": line.item_id,
+                "name": line.item.name if line.item else None,
+                "quantity": line.quantity,
+                "price": line.price
+            }
+            for line in order.items
+        ]
+    }
+
+def _open_orders(db: Session, restaurant_id: str, order_ids: Optional[Iterable[str]] = None) -> List[models.Order]:
+    query = db.query(models.Order).options(
+        selectinload(models.Order.items).selectinload(models.OrderItem.item)
+    ).filter(
+        models.Order.restaurant_id == restaurant_id,
+        models.Order.payment_status == "Pending",
+        models.Order.status != "Cancelled"
+    )
+    if order_ids is not None:
+        query = query.filter(models.Order.id.in_(list(order_ids)))
+    return query.order_by(models.Order.created_at, models.Order.id).all()
+
+def kds_order_entries(db: Session, restaurant_id: str, order_ids: Iterable[str]) -> Dict[str, Dict]:
+    """Board entries of those of `order_ids` that are open, in one query."""
+    order_ids = list(order_ids)
+    if not order_ids:
+        return {}
+    return {order.id: kds_order_entry(order) for order in _open_orders(db, restaurant_id, order_ids)}
+
+def load_kds_snapshot(db: Session, restaurant_id: str) -> Tuple[int, List[Dict]]:
+    """
+    (version, open orders oldest first) for a restaurant. The version is read first, so the orders
+    are at least that recent; events after it may already be reflected and re-apply cleanly.
+    """
+    version = db.query(models.KDSVersion.version).filter(models.KDSVersion.restaurant_id == restaurant_id).scalar() or 0
+    return version, [kds_order_entry(order) for order in _open_orders(db, restaurant_id)]
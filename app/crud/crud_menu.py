@@ -0,0 +1,290 @@
+"""
+Versioned, pre-serialized menus for the public menu endpoints.
+
+Every write to a restaurant's menu (items, categories, combo components, availability and stock
+flags) calls publish_menu_snapshot inside its own transaction: that bumps the restaurant's row in
+menu_versions and compiles the GET /menu and /menu/categories bodies into menu_snapshots. The
+compiler reads plain rows and builds the JSON directly, in the shape schemas.MenuItemOut and
+MenuCategoryOut give it, so neither ORM objects nor Pydantic are involved. Readers fetch the
+version and reuse whatever they hold for it (see utils.menu_cache), or the stored blobs; a change
+made through any worker is served on the next request.
+
+Writes that change combos also rebuild the restaurant's combo expansions: each combo's regular
+items flattened through nested combos, which orders use to deduct component stock and menus show.
+"""
+from sqlalchemy.orm import Session, aliased, selectinload
+from sqlalchemy import update, insert, select, delete, or_, and_, case, func
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import logging
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+_ITEM_COLUMNS = (
+    models.MenuItem.id, models.MenuItem.restaurant_id, models.MenuItem.name, models.MenuItem.description,
+    models.MenuItem.price, models.MenuItem.cost_price, models.MenuItem.available, models.MenuItem.category_id,
+    models.MenuItem.image_url, models.MenuItem.variations, models.MenuItem.item_type,
+    models.MenuItem.inventory_available, models.MenuItem.inventory_quantity
+)
+
+def bump_menu_version(db: Session, restaurant_id: str) -> int:
+    """Increments a restaurant's menu version in the caller's transaction and returns the new value."""
+    menu = models.MenuVersion
+    stmt = update(menu).where(menu.restaurant_id == restaurant_id).values(
+        version=menu.version + 1, updated_at=datetime.utcnow()
+    ).returning(menu.version).execution_options(synchronize_session=False)
+
+    version = db.execute(stmt).scalar()
+    if version is None:
+        try:
+            # Savepoint so a concurrent seed by another worker does not abort the caller's transaction
+            with db.begin_nested():
+                db.add(models.MenuVersion(restaurant_id=restaurant_id, version=0))
+        except IntegrityError:
+            logger.info(f"Menu version for restaurant {restaurant_id} was seeded concurrently.")
+        version = db.execute(stmt).scalar()
+    if version is None:
+        raise Exception(f"Could not bump the menu version of restaurant {restaurant_id}")
+    return version
+
+def get_menu_version(db: Session, restaurant_id: str) -> int:
+    """A restaurant's current menu version; 0 if its menu was never changed since versioning began."""
+    return db.query(models.MenuVersion.version).filter(models.MenuVersion.restaurant_id == restaurant_id).scalar() or 0
+
+def _float(value) -> Optional[float]:
+    return None if value is None else float(value)
+
+def _variation_entry(variation: Dict) -> Dict:
+    # As schemas.MenuItemVariationSchema dumps it
+    return {
+        "name": variation.get("name"),
+        "price": _float(variation.get("price")),
+        "cost_price": _float(variation.get("cost_price")),
+        "available": variation.get("available", True)
+    }
+
+def _item_entry(row) -> Dict:
+    # As schemas.MenuItemOut dumps it, validators included; category and components are filled in later
+    return {
+        "restaurant_id": row.restaurant_id,
+        "name": row.name,
+        "description": row.description,
+        "price": _float(row.price),
+        "cost_price": _float(row.cost_price),
+        "available": row.available,
+        "category_id": row.category_id,
+        "image_url": row.image_url,
+        "variations": [_variation_entry(variation) for variation in row.variations] if row.variations is not None else None,
+        "item_type": row.item_type.lower() if isinstance(row.item_type, str) else row.item_type,
+        "inventory_available": row.inventory_available,
+        "inventory_quantity": None if row.inventory_available is False else _float(row.inventory_quantity),
+        "id": row.id,
+        "category": None,
+        "components": [],
+        "expansion": []
+    }
+
+def _json_bytes(rows: List[Dict]) -> bytes:
+    return json.dumps(rows, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def build_menu_snapshot(db: Session, restaurant_id: str) -> Tuple[bytes, bytes]:
+    """
+    (GET /menu body, GET /menu/categories body) for a restaurant, compiled from plain rows in five
+    queries whatever the menu's size. Pending changes in the session must be flushed first.
+    """
+    rows = db.execute(select(*_ITEM_COLUMNS).where(
+        models.MenuItem.restaurant_id == restaurant_id
+    ).order_by(models.MenuItem.name, models.MenuItem.id)).all()
+    entries = {row.id: _item_entry(row) for row in rows}
+
+    component = models.ComboItemComponent
+    links = db.execute(select(
+        component.id, component.combo_menu_item_id, component.component_menu_item_id, component.quantity
+    ).join(models.MenuItem, models.MenuItem.id == component.combo_menu_item_id).where(
+        models.MenuItem.restaurant_id == restaurant_id
+    ).order_by(component.id)).all()
+    foreign_ids = {link.component_menu_item_id for link in links} - entries.keys()
+    if foreign_ids: # Components are validated to belong to the same restaurant, but older rows may not
+        entries.update((row.id, _item_entry(row)) for row in db.execute(select(*_ITEM_COLUMNS).where(models.MenuItem.id.in_(list(foreign_ids)))))
+    for link in links:
+        # Component entries are shared, so a component shows its own category and components too
+        entries[link.combo_menu_item_id]["components"].append(
+            {"id": link.id, "quantity": link.quantity, "component_item": entries.get(link.component_menu_item_id)}
+        )
+    expansion = models.ComboExpansion
+    for combo_id, component_id, quantity in db.execute(select(
+        expansion.combo_menu_item_id, expansion.component_menu_item_id, expansion.quantity
+    ).where(expansion.restaurant_id == restaurant_id).order_by(expansion.combo_menu_item_id, expansion.component_menu_item_id)):
+        entries[combo_id]["expansion"].append({"component_menu_item_id": component_id, "quantity": quantity})
+
+    category_ids = {entry["category_id"] for entry in entries.values() if entry["category_id"] is not None}
+    categories = db.execute(select(
+        models.MenuCategory.id, models.MenuCategory.restaurant_id, models.MenuCategory.name, models.MenuCategory.description
+    ).where(or_(
+        models.MenuCategory.restaurant_id == restaurant_id, models.MenuCategory.id.in_(list(category_ids))
+    )).order_by(models.MenuCategory.id)).all()
+    category_entries = {category.id: {"name": category.name, "description": category.description, "id": category.id} for category in categories}
+    for entry in entries.values():
+        entry["category"] = category_entries.get(entry["category_id"])
+
+    return (
+        _json_bytes([entries[row.id] for row in rows]),
+        _json_bytes([category_entries[category.id] for category in categories if category.restaurant_id == restaurant_id])
+    )
+
+def flatten_combo_components(components: Dict[int, List[Tuple[int, int]]]) -> Dict[int, Dict[int, int]]:
+    """
+    combo id -> {regular item id: units in one combo} from combo id -> [(component id, quantity)],
+    multiplying quantities down nested combos. Each combo is expanded once, however many combos
+    contain it. Raises ValueError if a combo contains itself, directly or through others.
+    """
+    flat: Dict[int, Dict[int, int]] = {}
+    for root in components:
+        if root in flat:
+            continue
+        # Depth-first without recursion, so deep nesting cannot hit the recursion limit
+        stack = [(root, iter(components[root]))]
+        in_progress = {root}
+        while stack:
+            combo, remaining = stack[-1]
+            for component, _ in remaining:
+                if component in components and component not in flat:
+                    if component in in_progress:
+                        raise ValueError(f"Combo item {component} contains itself through its components")
+                    in_progress.add(component)
+                    stack.append((component, iter(components[component])))
+                    break
+            else:
+                stack.pop()
+                in_progress.discard(combo)
+                totals: Dict[int, int] = {}
+                for component, quantity in components[combo]:
+                    for item_id, units in (flat[component].items() if component in components else ((component, 1),)):
+                        totals[item_id] = totals.get(item_id, 0) + units * quantity
+                flat[combo] = totals
+    return flat
+
+def rebuild_combo_expansions(db: Session, restaurant_id: str) -> int:
+    """
+    Recomputes a restaurant's combo_expansions rows from its combo components, in the caller's
+    transaction, with one read, one delete and one executemany. Returns the rows written; raises
+    ValueError if the combos nest in a cycle. Pending changes in the session must be flushed first.
+    """
+    component, component_item = models.ComboItemComponent, aliased(models.MenuItem)
+    components: Dict[int, List[Tuple[int, int]]] = {}
+    for combo_id, component_id, quantity in db.execute(select(
+        component.combo_menu_item_id, component.component_menu_item_id, component.quantity
+    ).join(models.MenuItem, models.MenuItem.id == component.combo_menu_item_id).join(
+        # Skips links to deleted items, left behind where foreign keys are not enforced (SQLite)
+        component_item, component_item.id == component.component_menu_item_id
+    ).where(
+        models.MenuItem.restaurant_id == restaurant_id
+    ).order_by(component.id)):
+        components.setdefault(combo_id, []).append((component_id, quantity))
+    rows = [
+        {"combo_menu_item_id": combo_id, "component_menu_item_id": item_id, "restaurant_id": restaurant_id, "quantity": units}
+        for combo_id, totals in flatten_combo_components(components).items() for item_id, units in totals.items()
+    ]
+    expansion = models.ComboExpansion
+    db.execute(delete(expansion).where(expansion.restaurant_id == restaurant_id).execution_options(synchronize_session=False))
+    if rows:
+        db.execute(insert(expansion), rows)
+    return len(rows)
+
+def expand_combo_quantities(menu_items: Iterable[models.MenuItem], quantities: Dict[int, float]) -> Dict[int, float]:
+    """
+    `quantities` (menu item id -> units sold) plus the units of every regular item inside the combos
+    among `menu_items`, taken from their expansion, so no query is needed. A combo keeps its own
+    entry, for restaurants that stock combos as such.
+    """
+    expanded = dict(quantities)
+    for menu_item in menu_items:
+        sold = quantities.get(menu_item.id)
+        if not sold:
+            continue
+        for entry in menu_item.expansion:
+            expanded[entry.component_menu_item_id] = expanded.get(entry.component_menu_item_id, 0.0) + entry.quantity * sold
+    return expanded
+
+def menu_item_out_options() -> Tuple:
+    """
+    Loader options for what schemas.MenuItemOut reads off menu items, to pass to .options() on the
+    query or loader of the items. A combo's component items come with their category and their own
+    components in batches: MenuItem.components refers back to MenuItem, so its default eager load
+    stops there and would load each component's components one query at a time.
+    """
+    return (
+        selectinload(models.MenuItem.category),
+        selectinload(models.MenuItem.components).selectinload(models.ComboItemComponent.component_item).options(
+            selectinload(models.MenuItem.category), selectinload(models.MenuItem.components)
+        )
+    )
+
+def publish_menu_snapshot(db: Session, restaurant_id: str, combos_changed: bool = False) -> int:
+    """
+    Records a menu write: flushes it, bumps the menu version and stores the menu compiled at that
+    version, all in the caller's transaction. Writes that change combos pass `combos_changed` to
+    rebuild the combo expansions first. Returns the new version.
+    """
+    db.flush()
+    if combos_changed:
+        rebuild_combo_expansions(db, restaurant_id)
+    version = bump_menu_version(db, restaurant_id)
+    items, categories = build_menu_snapshot(db, restaurant_id)
+    snapshot = models.MenuSnapshot
+    values = {"version": version, "items": items, "categories": categories, "built_at": datetime.utcnow()}
+    updated = db.execute(update(snapshot).where(snapshot.restaurant_id == restaurant_id).values(**values).execution_options(synchronize_session=False))
+    if not updated.rowcount:
+        # The bumped version row serializes writers of this restaurant, so nobody races this insert
+        db.execute(insert(snapshot).values(restaurant_id=restaurant_id, **values))
+    return version
+
+def get_menu_snapshot(db: Session, restaurant_id: str) -> Tuple[int, bytes, bytes]:
+    """
+    (version, GET /menu body, GET /menu/categories body) for a restaurant, as stored by its latest
+    menu write. Menus not written since snapshots were introduced are compiled on the fly.
+    """
+    version = get_menu_version(db, restaurant_id)
+    snapshot = db.query(models.MenuSnapshot.version, models.MenuSnapshot.items, models.MenuSnapshot.categories).filter(
+        models.MenuSnapshot.restaurant_id == restaurant_id
+    ).first()
+    if snapshot is not None and snapshot.version >= version:
+        return snapshot.version, snapshot.items, snapshot.categories
+    items, categories = build_menu_snapshot(db, restaurant_id)
+    return version, items, categories
+
+def get_active_menu_restaurant_ids(db: Session, limit: int) -> List[str]:
+    """Open restaurants, those with the most recent order activity first, for warming menu caches."""
+    return [restaurant_id for (restaurant_id,) in db.query(models.Restaurant.restaurant_id).outerjoin(
+        models.KDSVersion, models.KDSVersion.restaurant_id == models.Restaurant.restaurant_id
+    ).filter(
+        models.Restaurant.is_open == True
+    ).order_by(models.KDSVersion.updated_at.desc().nullslast(), models.Restaurant.restaurant_id).limit(limit)]
+
+def search_menu_items(db: Session, restaurant_id: str, words: List[str], limit: int, popular_since: datetime) -> List[models.MenuItem]:
+    """
+    Menu items whose name, description or category contains every word, for searches the in-memory
+    index (utils.menu_search) cannot answer yet: available items first, then name matches, then the
+    best sellers since `popular_since`. Words come from text_utils.search_words, so they hold no
+    LIKE wildcards.
+    """
+    item_rollup = models.ItemSalesRollup
+    sold = select(item_rollup.menu_item_id, func.sum(item_rollup.quantity).label("quantity")).where(
+        item_rollup.restaurant_id == restaurant_id, item_rollup.granularity == "day", item_rollup.bucket_start >= popular_since
+    ).group_by(item_rollup.menu_item_id).subquery()
+    name_matches = and_(*(models.MenuItem.name.ilike(f"%{word}%") for word in words))
+    return db.query(models.MenuItem).outerjoin(
+        models.MenuCategory, models.MenuCategory.id == models.MenuItem.category_id
+    ).outerjoin(sold, sold.c.menu_item_id == models.MenuItem.id).filter(
+        models.MenuItem.restaurant_id == restaurant_id,
+        *(or_(
+            models.MenuItem.name.ilike(f"%{word}%"), models.MenuItem.description.ilike(f"%{word}%"), models.MenuCategory.name.ilike(f"%{word}%")
+        ) for word in words)
+    ).options(*menu_item_out_options()).order_by(
+        case((models.MenuItem.available == False, 1), else_=0), case((name_matches, 0), else_=1),
+        func.coalesce(sold.c.quantity, 0).desc(), models.MenuItem.name, models.MenuItem.id
+    ).limit(limit).all()
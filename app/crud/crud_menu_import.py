@@ -0,0 +1,375 @@
+"""
+Set-based bulk import of menu items from an uploaded CSV or Excel sheet.
+
+parse_menu_frame validates and coerces whole columns at once and reports errors per row; rows
+are grouped by (category_name, item_name), so an item's rows may appear anywhere in the sheet. An item
+with any invalid row is skipped whole. insert_menu_items then gets or creates every category the
+items use in one pass and inserts the items with multi-row INSERTs, in the caller's
+transaction. Neither function builds Pydantic objects.
+
+Import jobs (POST /menu/import_jobs, see utils/menu_import_jobs) run the same steps per chunk of
+the sheet with import_menu_chunk, one transaction per chunk, and record their progress and row
+errors on a MenuImportJob.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from typing import Dict, List, Optional, Set, Tuple
+import datetime
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from .. import models
+from .crud_menu import bump_menu_version, publish_menu_snapshot
+
+logger = logging.getLogger(__name__)
+
+MENU_IMPORT_REQUIRED_COLUMNS = ("category_name", "item_name", "item_price", "inventory_available")
+MENU_IMPORT_ITEM_TYPES = ("regular", "combo")
+_BOOLEANS = {"true": True, "false": False, "yes": True, "no": False, "y": True, "n": False, "1": True, "0": False, "1.0": True, "0.0": False}
+_KEY = ["category_name", "item_name"]
+
+MENU_IMPORT_MAX_STORED_ERRORS = int(os.getenv("MENU_IMPORT_MAX_STORED_ERRORS", "1000")) # Row errors kept on a job; error_count has them all
+MENU_IMPORT_STALE_SECONDS = int(os.getenv("MENU_IMPORT_STALE_SECONDS", "900")) # Unfinished jobs not updated for this long are failed
+
+def normalize_menu_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Lower-cases the header and replaces spaces with underscores ("Item Name" -> item_name)."""
+    df.columns = [str(col).strip().lower().replace(" ", "_") for col in df.columns]
+    return df
+
+def _text(df: pd.DataFrame, column: str) -> pd.Series:
+    """A column as stripped strings, blank cells and missing columns as NA."""
+    if column not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype="string")
+    text = df[column].astype("string").str.strip()
+    return text.mask(text == "")
+
+def _number(text: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """(float values, NaN where blank or invalid; mask of non-blank cells that are not finite numbers)"""
+    values = pd.to_numeric(text.astype(object), errors="coerce").astype("float64")
+    return values, text.notna() & ~np.isfinite(values)
+
+def _boolean(text: pd.Series, default: bool) -> Tuple[pd.Series, pd.Series]:
+    """(booleans, blank cells as `default`; mask of non-blank cells that are not a yes/no value)"""
+    values = text.str.lower().astype(object).map(_BOOLEANS)
+    return values.fillna(default).astype(bool), text.notna() & values.isna()
+
+def _optional(values: pd.Series) -> List:
+    """Values as a list with NA/NaN as None."""
+    return values.astype(object).where(values.notna(), None).tolist()
+
+def _key_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series, pd.Series]:
+    """(frame of category_name/item_name, empty error column, rows with both) for a sheet."""
+    frame = pd.DataFrame({"category_name": _text(df, "category_name"), "item_name": _text(df, "item_name")}, index=df.index)
+    return frame, pd.Series(None, index=df.index, dtype=object), frame["category_name"].notna() & frame["item_name"].notna()
+
+def _flagger(errors: pd.Series):
+    def flag(mask: pd.Series, message: str) -> None:
+        errors[mask & errors.isna()] = message # First problem of a row wins
+    return flag
+
+def _parse_variations(df: pd.DataFrame, frame: pd.DataFrame, flag) -> pd.Series:
+    """Adds the variation columns to `frame`, flagging bad ones; returns the rows that add a variation."""
+    frame["variation_name"] = _text(df, "variation_name")
+    variation_price_text = _text(df, "variation_price")
+    frame["variation_price"], bad = _number(variation_price_text)
+    has_variation = frame["variation_name"].notna()
+    flag(has_variation & variation_price_text.isna(), "variation_price is required with variation_name")
+    flag(has_variation & bad, "variation_price must be a number")
+    flag(variation_price_text.notna() & ~has_variation, "variation_name is required with variation_price")
+    frame["variation_cost_price"], bad = _number(_text(df, "variation_cost_price"))
+    flag(has_variation & bad, "variation_cost_price must be a number")
+    frame["variation_available"], bad = _boolean(_text(df, "variation_available"), True)
+    flag(has_variation & bad, "variation_available must be True or False")
+    return has_variation
+
+def _variations_by_item(with_variations: pd.DataFrame) -> Dict[Tuple[str, str], List[Dict]]:
+    records = [
+        {"name": name, "price": price, "cost_price": cost_price, "available": available}
+        for name, price, cost_price, available in zip(
+            with_variations["variation_name"].tolist(), with_variations["variation_price"].tolist(),
+            _optional(with_variations["variation_cost_price"]), with_variations["variation_available"].tolist()
+        )
+    ]
+    return {
+        key: [records[position] for position in positions]
+        for key, positions in with_variations.groupby(_KEY, sort=False).indices.items()
+    }
+
+def _row_errors(df: pd.DataFrame, first_row: int, frame: pd.DataFrame, errors: pd.Series, skipped: str) -> List[Tuple[int, str]]:
+    failed = errors.notna()
+    return [
+        (first_row + int(index), f"{message} ({skipped.format(name=name)})" if isinstance(name, str) else message)
+        for index, message, name in zip(df.index[failed], errors[failed], frame.loc[failed, "item_name"])
+    ]
+
+def parse_menu_frame(df: pd.DataFrame, first_row: int = 2) -> Tuple[List[Dict], List[Tuple[int, str]]]:
+    """
+    (items, row errors) from a sheet with normalized column names. Each item is a dict of MenuItem
+    fields plus "category_name", its variations and "row", the sheet row it took its fields from; errors
+    are (sheet row, message). A line's sheet row is `first_row` plus its index label, so frames read
+    in chunks keep their numbering.
+    """
+    frame, errors, keyed = _key_frame(df)
+    flag = _flagger(errors)
+    flag(frame["category_name"].isna(), "category_name is required")
+    flag(frame["item_name"].isna(), "item_name is required")
+    keys = [frame.loc[keyed, "category_name"], frame.loc[keyed, "item_name"]]
+
+    # An item's first row with a price carries its fields; its other rows only add variations
+    price_text = _text(df, "item_price")
+    priced = price_text.notna()
+    first = keyed & priced & ~frame[priced].duplicated(subset=_KEY, keep="first").reindex(df.index, fill_value=True)
+    item_priced = priced[keyed].groupby(keys, sort=False).transform("any").reindex(df.index, fill_value=True)
+    flag(keyed & ~item_priced & ~frame.duplicated(subset=_KEY, keep="first"), "item_price is required")
+    frame["price"], bad = _number(price_text)
+    flag(first & bad, "item_price must be a number")
+    frame["cost_price"], bad = _number(_text(df, "item_cost_price"))
+    flag(first & bad, "item_cost_price must be a number")
+    frame["available"], bad = _boolean(_text(df, "item_available"), True)
+    flag(first & bad, "item_available must be True or False")
+    tracked_text = _text(df, "inventory_available")
+    frame["inventory_available"], bad = _boolean(tracked_text, False)
+    flag(first & tracked_text.isna(), "inventory_available is required")
+    flag(first & bad, "inventory_available must be True or False")
+    quantity_text = _text(df, "inventory_quantity")
+    frame["inventory_quantity"], bad = _number(quantity_text)
+    tracked = frame["inventory_available"]
+    flag(first & tracked & quantity_text.isna(), "inventory_quantity is required when inventory_available is True")
+    flag(first & tracked & bad, "inventory_quantity must be a number")
+    flag(first & tracked & (frame["inventory_quantity"] < 0), "inventory_quantity cannot be negative when inventory_available is True")
+    frame["item_type"] = _text(df, "item_type").str.lower().fillna("regular")
+    flag(first & ~frame["item_type"].isin(MENU_IMPORT_ITEM_TYPES), f"item_type must be one of {', '.join(MENU_IMPORT_ITEM_TYPES)}")
+    flag(first & (frame["item_type"] == "combo"), "combo items need their components; create them with POST /menu/items")
+    has_variation = _parse_variations(df, frame, flag)
+
+    # An item is skipped whole if any of its rows failed
+    item_failed = errors.notna()[keyed].groupby(keys, sort=False).transform("any")
+    ok = keyed & ~item_failed.reindex(df.index, fill_value=True)
+    row_errors = _row_errors(df, first_row, frame, errors, "item '{name}' skipped")
+    variations = _variations_by_item(frame[ok & has_variation])
+
+    items = frame[ok & first]
+    descriptions = _optional(_text(df, "item_description")[items.index])
+    image_urls = _optional(_text(df, "item_image_url")[items.index])
+    return [
+        {
+            "row": first_row + int(index),
+            "category_name": category_name,
+            "name": name,
+            "description": description,
+            "price": price,
+            "cost_price": cost_price,
+            "available": available,
+            "image_url": image_url,
+            "variations": variations.get((category_name, name)) or None,
+            "item_type": item_type,
+            "inventory_available": inventory_available,
+            "inventory_quantity": inventory_quantity if inventory_available else None
+        }
+        for index, category_name, name, description, price, cost_price, available, image_url, item_type, inventory_available, inventory_quantity in zip(
+            items.index.tolist(), items["category_name"].tolist(), items["item_name"].tolist(), descriptions,
+            items["price"].tolist(), _optional(items["cost_price"]), items["available"].tolist(), image_urls,
+            items["item_type"].tolist(), items["inventory_available"].tolist(), _optional(items["inventory_quantity"])
+        )
+    ], row_errors
+
+def parse_menu_variation_rows(df: pd.DataFrame, first_row: int = 2) -> Tuple[Dict[Tuple[str, str], List[Dict]], List[Tuple[int, str]]]:
+    """
+    ((category_name, item_name) -> variations, row errors) for rows of items that already exist, as
+    when an item's rows straddle two chunks of an import. Only the variation columns are read, and
+    a bad row skips only itself.
+    """
+    frame, errors, keyed = _key_frame(df)
+    flag = _flagger(errors)
+    has_variation = _parse_variations(df, frame, flag)
+    return _variations_by_item(frame[keyed & has_variation & errors.isna()]), _row_errors(df, first_row, frame, errors, "row of item '{name}' skipped")
+
+def get_or_create_menu_categories(db: Session, restaurant_id: str, names: Set[str]) -> Tuple[Dict[str, int], Set[str]]:
+    """
+    (category name -> id for the restaurant, names held by other restaurants) for `names`, creating
+    the missing categories in the caller's transaction. Category names are unique across
+    restaurants, so names already taken elsewhere cannot be created.
+    """
+    ids, taken = {}, set()
+    for name, category_id, owner in db.query(models.MenuCategory.name, models.MenuCategory.id, models.MenuCategory.restaurant_id).filter(
+        models.MenuCategory.name.in_(list(names))
+    ):
+        if owner == restaurant_id:
+            ids[name] = category_id
+        else:
+            taken.add(name)
+    missing = names - ids.keys() - taken
+    if missing:
+        db.bulk_insert_mappings(models.MenuCategory, [{"restaurant_id": restaurant_id, "name": name} for name in sorted(missing)])
+        ids.update(db.query(models.MenuCategory.name, models.MenuCategory.id).filter(
+            models.MenuCategory.restaurant_id == restaurant_id,
+            models.MenuCategory.name.in_(list(missing))
+        ).all())
+    return ids, taken
+
+def insert_menu_items(db: Session, restaurant_id: str, items: List[Dict], publish: bool = True) -> Tuple[int, List[Tuple[int, str]]]:
+    """
+    Inserts parsed items (see parse_menu_frame), setting each inserted item's "id", and publishes
+    the menu, in the caller's transaction. Returns (items inserted, row errors for items whose
+    category cannot be created). With `publish=False` the caller bumps the menu version itself.
+    """
+    category_ids, taken = get_or_create_menu_categories(db, restaurant_id, {item["category_name"] for item in items})
+    row_errors = [
+        (item["row"], f"Category name '{item['category_name']}' is already used by another restaurant (item '{item['name']}' skipped)")
+        for item in items if item["category_name"] in taken
+    ]
+    rows = [
+        {
+            **{field: value for field, value in item.items() if field not in ("row", "category_name")},
+            "restaurant_id": restaurant_id,
+            "category_id": category_ids[item["category_name"]]
+        }
+        for item in items if item["category_name"] not in taken
+    ]
+    if rows:
+        # A Core insert on the table keeps this one multi-row INSERT per batch (the ORM one splits
+        # rows by which values are None); the returned keys give each item its id
+        table = models.MenuItem.__table__
+        ids = {(category_id, name): item_id for item_id, category_id, name in db.execute(
+            insert(table).returning(table.c.id, table.c.category_id, table.c.name), rows
+        )}
+        for item in items:
+            if item["category_name"] not in taken:
+                item["id"] = ids[(category_ids[item["category_name"]], item["name"])]
+        if publish:
+            publish_menu_snapshot(db, restaurant_id)
+    return len(rows), row_errors
+
+def add_menu_item_variations(db: Session, variations: Dict[int, List[Dict]]) -> None:
+    """Appends variations to existing menu items (menu item id -> variations), in the caller's transaction."""
+    if not variations:
+        return
+    current = dict(db.query(models.MenuItem.id, models.MenuItem.variations).filter(models.MenuItem.id.in_(list(variations))).all())
+    db.bulk_update_mappings(models.MenuItem, [
+        {"id": item_id, "variations": (current.get(item_id) or []) + added} for item_id, added in variations.items() if item_id in current
+    ])
+
+def import_menu_chunk(
+    db: Session, restaurant_id: str, df: pd.DataFrame, seen: Dict[Tuple[str, str], Optional[int]],
+    pending: Optional[pd.DataFrame] = None, final: bool = False, first_row: int = 2
+) -> Tuple[int, List[Tuple[int, str]], Optional[pd.DataFrame]]:
+    """
+    Imports one chunk of a sheet read in chunks with a continuing index, in the caller's
+    transaction. Returns (items created, row errors, rows to pass as `pending` with the next chunk).
+
+    `seen` maps each (category_name, item_name) met in earlier chunks to the id of the item created
+    for it, or None if it was skipped, and is updated here. Rows of created items add their
+    variations to the item; rows of skipped items are reported. Rows of new items that have no
+    row with an item_price yet are held back for the next chunk, until the `final` one.
+    """
+    if pending is not None and len(pending):
+        df = pd.concat([pending, df])
+    keys = pd.Series(list(zip(_text(df, "category_name").tolist(), _text(df, "item_name").tolist())), index=df.index, dtype=object)
+    item_ids = keys.map(lambda key: seen.get(key, -1))
+    known = item_ids.ne(-1)
+    created_rows = known & item_ids.notna()
+    skipped_rows = known & item_ids.isna()
+    row_errors = [
+        (first_row + int(index), f"item '{key[1]}' was skipped at an earlier row")
+        for index, key in keys[skipped_rows].items()
+    ]
+
+    new_rows = ~known
+    held = pd.Series(False, index=df.index)
+    if not final:
+        keyed = new_rows & keys.map(lambda key: isinstance(key[0], str) and isinstance(key[1], str))
+        priced = _text(df, "item_price").notna()
+        held[keyed] = ~priced[keyed].groupby(keys[keyed], sort=False).transform("any")
+
+    created = 0
+    changed = False
+    to_parse = new_rows & ~held
+    if to_parse.any():
+        items, errors = parse_menu_frame(df[to_parse], first_row)
+        row_errors.extend(errors)
+        if items:
+            created, errors = insert_menu_items(db, restaurant_id, items, publish=False)
+            row_errors.extend(errors)
+            changed = created > 0
+            for item in items:
+                if "id" in item:
+                    seen[(item["category_name"], item["name"])] = item["id"]
+        for key in keys[to_parse]:
+            if isinstance(key[0], str) and isinstance(key[1], str):
+                seen.setdefault(key, None)
+
+    if created_rows.any():
+        variations, errors = parse_menu_variation_rows(df[created_rows], first_row)
+        row_errors.extend(errors)
+        if variations:
+            add_menu_item_variations(db, {seen[key]: added for key, added in variations.items()})
+            changed = True
+
+    if changed:
+        bump_menu_version(db, restaurant_id)
+    return created, sorted(row_errors), df[held] if held.any() else None
+
+# --- Import jobs ---
+
+def create_menu_import_job(db: Session, restaurant_id: str, created_by: str, filename: Optional[str]) -> models.MenuImportJob:
+    job = models.MenuImportJob(restaurant_id=restaurant_id, created_by=created_by, filename=filename, status="queued")
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def get_menu_import_job(db: Session, restaurant_id: str, job_id: str) -> Optional[models.MenuImportJob]:
+    return db.query(models.MenuImportJob).filter(
+        models.MenuImportJob.id == job_id,
+        models.MenuImportJob.restaurant_id == restaurant_id
+    ).first()
+
+def get_menu_import_jobs(db: Session, restaurant_id: str, limit: int = 20) -> List[models.MenuImportJob]:
+    """A restaurant's latest import jobs, newest first."""
+    return db.query(models.MenuImportJob).filter(
+        models.MenuImportJob.restaurant_id == restaurant_id
+    ).order_by(models.MenuImportJob.created_at.desc()).limit(limit).all()
+
+def start_menu_import_job(db: Session, job_id: str, total_rows: Optional[int]) -> None:
+    job = db.get(models.MenuImportJob, job_id)
+    job.status = "running"
+    job.total_rows = total_rows
+    job.started_at = datetime.datetime.utcnow()
+    db.commit()
+
+def record_menu_import_progress(db: Session, job_id: str, rows: int, created: int, row_errors: List[Tuple[int, str]]) -> None:
+    """Adds a chunk's counts and row errors to the job, in the chunk's transaction so they commit together."""
+    job = db.get(models.MenuImportJob, job_id)
+    job.processed_rows = (job.processed_rows or 0) + rows
+    job.created_items = (job.created_items or 0) + created
+    job.error_count = (job.error_count or 0) + len(row_errors)
+    stored = job.errors or []
+    room = MENU_IMPORT_MAX_STORED_ERRORS - len(stored)
+    if row_errors and room > 0:
+        job.errors = stored + [{"row": row, "error": message} for row, message in row_errors[:room]]
+    job.updated_at = datetime.datetime.utcnow() # Also when nothing else changed, so the job does not look stale
+
+def finish_menu_import_job(db: Session, job_id: str, status: str, message: str) -> None:
+    """Marks the job "completed" or "failed" and commits."""
+    job = db.get(models.MenuImportJob, job_id)
+    job.status = status
+    job.message = message
+    job.finished_at = datetime.datetime.utcnow()
+    db.commit()
+
+def fail_stale_menu_import_jobs(db: Session, older_than_seconds: int = MENU_IMPORT_STALE_SECONDS) -> int:
+    """Fails queued or running jobs not updated for `older_than_seconds`, left by a worker that stopped; returns how many."""
+    now = datetime.datetime.utcnow()
+    failed = db.query(models.MenuImportJob).filter(
+        models.MenuImportJob.status.in_(("queued", "running")),
+        models.MenuImportJob.updated_at < now - datetime.timedelta(seconds=older_than_seconds)
+    ).update({
+        models.MenuImportJob.status: "failed",
+        models.MenuImportJob.message: "The import stopped with its worker; items from the chunks it committed were kept",
+        models.MenuImportJob.finished_at: now
+    }, synchronize_session=False)
+    db.commit()
+    return failed
@@ -0,0 +1,52 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import delete
+from typing import Iterable, Optional, Tuple
+import logging
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+def is_open_order(status: Optional[str], payment_status: Optional[str]) -> bool:
+    """Whether an order still takes items for its table; mirrors models.OPEN_ORDER_PREDICATE."""
+    return payment_status == "Pending" and status != "Cancelled"
+
+def get_open_table_order(db: Session, restaurant_id: str, table_number: str) -> Optional[models.Order]:
+    """The open order of a table, found by primary key through open_table_orders. Items are not loaded."""
+    if not table_number:
+        return None
+    return db.query(models.Order).join(
+        models.OpenTableOrder, models.OpenTableOrder.order_id == models.Order.id
+    ).filter(
+        models.OpenTableOrder.restaurant_id == restaurant_id,
+        models.OpenTableOrder.table_number == table_number
+    ).first()
+
+def open_table_order(db: Session, order: models.Order) -> None:
+    """
+    Records `order` as its table's open order, in the caller's transaction. If the table already
+    has one (e.g. two POS clients opening the same table at once), the flush fails with an
+    IntegrityError from the primary key or the orders partial unique index.
+    """
+    if not order.table_number or not order.restaurant_id or not is_open_order(order.status, order.payment_status):
+        return
+    db.add(models.OpenTableOrder(restaurant_id=order.restaurant_id, table_number=order.table_number, order_id=order.id))
+
+def close_table_orders(db: Session, order_ids: Iterable[str]) -> None:
+    """Frees the tables of orders that were paid, cancelled or refunded, in the caller's transaction."""
+    order_ids = list(order_ids)
+    if order_ids:
+        db.execute(delete(models.OpenTableOrder).where(models.OpenTableOrder.order_id.in_(order_ids))
+                   .execution_options(synchronize_session=False))
+
+def sync_open_table_order(db: Session, order: models.Order, previous_state: Tuple[Optional[str], Optional[str]]) -> None:
+    """
+    Keeps open_table_orders in step with a status change of `order`; `previous_state` is the
+    (status, payment_status) captured before the change (see crud_rollups.capture_sales_state).
+    """
+    was_open = is_open_order(*previous_state)
+    now_open = is_open_order(order.status, order.payment_status)
+    if was_open and not now_open:
+        close_table_orders(db, [order.id])
+    elif now_open and not was_open:
+        open_table_order(db, order)
@@ -0,0 +1,143 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import update
+from datetime import datetime
+from typing import Dict, List, Tuple
+import logging
+
+from .. import models
+from .crud_rollups import SalesTransition, apply_sales_transitions
+from .crud_open_tables import is_open_order, close_table_orders
+from .crud_kds import bump_kds_version, kds_order_entries
+
+logger = logging.getLogger(__name__)
+
+# Allowed moves of Order.status. Terminal statuses have no outgoing transitions.
+# "Refunded" is stored as refund_order stores it: the order keeps "Payment Done" and only its
+# payment_status (and its Payment row) move to "Refunded".
+ORDER_STATUS_TRANSITIONS: Dict[str, Tuple[str, ...]] = {
+    "Order Placed": ("Order Confirmed", "Payment Done", "Cancelled"), # Order.status default
+    "Pending": ("Order Confirmed", "Payment Done", "Cancelled"),
+    "Order Confirmed": ("Payment Done", "Cancelled"),
+    "Payment Done": ("Refunded",),
+    "Cancelled": (),
+    "Refunded": (),
+}
+# Order.payment_status implied by reaching a status; other statuses leave it unchanged
+PAYMENT_STATUS_FOR = {"Payment Done": "Paid", "Refunded": "Refunded"}
+REFUND_STATUS = "Refunded"
+MAX_BULK_STATUS_ORDERS = 500
+
+def bulk_transition_order_status(db: Session, restaurant_id: str, order_ids: List[str], target_status: str, changed_by: str) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Moves many orders of one restaurant to `target_status` in a single transaction, checking
+    each move against ORDER_STATUS_TRANSITIONS. Orders are updated with one compare-and-set
+    UPDATE per source status, so an order changed concurrently since it was read is reported
+    as a conflict instead of being overwritten. History rows go in with one executemany insert.
+    A refund leaves Order.status alone and, like refund_order, refunds the Payment rows with one
+    UPDATE and writes one "refund" AuditLog row per order instead of a history row.
+
+    Returns (per-order results in request order, the updated orders' new state for notifications).
+    All updated orders share one KDS version; each state carries it and the order's board entry.
+    """
+    if target_status not in ORDER_STATUS_TRANSITIONS:
+        raise ValueError(f"Unknown order status '{target_status}'. Choose from {', '.join(ORDER_STATUS_TRANSITIONS)}.")
+    order_ids = list(dict.fromkeys(order_ids)) # De-duplicate, keep request order
+    if not order_ids:
+        raise ValueError("No order ids provided.")
+    if len(order_ids) > MAX_BULK_STATUS_ORDERS:
+        raise ValueError(f"At most {MAX_BULK_STATUS_ORDERS} orders can be updated at once.")
+
+    rows = {row.id: row for row in db.query(
+        models.Order.id, models.Order.status, models.Order.payment_status,
+        models.Order.total_cost, models.Order.created_at
+    ).filter(models.Order.restaurant_id == restaurant_id, models.Order.id.in_(order_ids))}
+
+    refund = target_status == REFUND_STATUS
+    results: Dict[str, Dict] = {}
+    by_source: Dict[str, List[str]] = {}
+    for order_id in order_ids:
+        row = rows.get(order_id)
+        if row is None:
+            results[order_id] = {"order_id": order_id, "result": "not_found", "detail": "Order not found for this restaurant."}
+        elif row.status == target_status or (refund and row.payment_status == "Refunded"):
+            results[order_id] = {"order_id": order_id, "result": "unchanged", "previous_status": row.status, "status": row.status}
+        elif target_status not in ORDER_STATUS_TRANSITIONS.get(row.status, ()):
+            results[order_id] = {
+                "order_id": order_id, "result": "invalid_transition", "previous_status": row.status, "status": row.status,
+                "detail": f"Cannot move an order from '{row.status}' to '{target_status}'."
+            }
+        elif refund and row.payment_status != "Paid":
+            results[order_id] = {
+                "order_id": order_id, "result": "invalid_transition", "previous_status": row.status, "status": row.status,
+                "detail": "Order is not paid, cannot refund."
+            }
+        else:
+            by_source.setdefault(row.status, []).append(order_id)
+
+    now = datetime.utcnow()
+    values = {"updated_at": now} if refund else {"status": target_status, "updated_at": now}
+    if target_status in PAYMENT_STATUS_FOR:
+        values["payment_status"] = PAYMENT_STATUS_FOR[target_status]
+    new_status = {} # Order.status after the move, per updated order
+    updated_ids: List[str] = []
+    kds_version = None
+    try:
+        for source_status, ids in by_source.items():
+            stmt = update(models.Order).where(
+                models.Order.restaurant_id == restaurant_id,
+                models.Order.id.in_(ids),
+                models.Order.status == source_status, # Compare-and-set against what was read
+                *([models.Order.payment_status == "Paid"] if refund else [])
+            ).values(**values).returning(models.Order.id).execution_options(synchronize_session=False)
+            changed = {order_id for (order_id,) in db.execute(stmt)}
+            for order_id in ids:
+                if order_id in changed:
+                    updated_ids.append(order_id)
+                    new_status[order_id] = source_status if refund else target_status
+                    results[order_id] = {"order_id": order_id, "result": "updated", "previous_status": source_status, "status": new_status[order_id]}
+                else:
+                    results[order_id] = {
+                        "order_id": order_id, "result": "conflict", "previous_status": source_status,
+                        "detail": "Order was modified concurrently; reload and retry."
+                    }
+
+        if updated_ids:
+            if refund:
+                db.execute(update(models.Payment).where(models.Payment.order_id.in_(updated_ids))
+                           .values(status="Refunded").execution_options(synchronize_session=False))
+                db.bulk_insert_mappings(models.AuditLog, [
+                    {"order_id": order_id, "user_id": changed_by, "action": "refund", "timestamp": now, "details": "Order refunded"}
+                    for order_id in updated_ids
+                ])
+            else:
+                db.bulk_insert_mappings(models.OrderStatusHistory, [
+                    {"order_id": order_id, "status": target_status, "changed_by": changed_by, "changed_at": now}
+                    for order_id in updated_ids
+                ])
+            close_table_orders(db, [
+                order_id for order_id in updated_ids
+                if not is_open_order(new_status[order_id], values.get("payment_status", rows[order_id].payment_status))
+            ])
+            apply_sales_transitions(db, [
+                SalesTransition(
+                    order_id, restaurant_id, rows[order_id].created_at, rows[order_id].total_cost,
+                    (rows[order_id].status, rows[order_id].payment_status),
+                    (new_status[order_id], values.get("payment_status", rows[order_id].payment_status))
+                ) for order_id in updated_ids
+            ])
+            kds_version = bump_kds_version(db, restaurant_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    payment_status = {order_id: values.get("payment_status", rows[order_id].payment_status) for order_id in updated_ids}
+    entries = kds_order_entries(db, restaurant_id, [
+        order_id for order_id in updated_ids if is_open_order(new_status[order_id], payment_status[order_id])
+    ])
+    changes = [
+        {"order_id": order_id, "status": new_status[order_id], "payment_status": payment_status[order_id],
+         "version": kds_version, "order": entries.get(order_id)}
+        for order_id in updated_ids
+    ]
+    return [results[order_id] for order_id in order_ids], changes
@@ -0,0 +1,370 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from itertools import chain
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import logging
+import pytz
+
+from .. import models
+from .crud_archive import HOT_ORDER_TABLES, ARCHIVED_ORDER_TABLES, reaches_archive
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_GRANULARITIES = ("hour", "day")
+SALES_METRICS = ("placed_count", "order_count", "gross_sales", "refunded_count", "refunded_sales", "cancelled_count")
+ITEM_METRICS = ("quantity", "sales")
+ROLLUP_CHUNK_DAYS = 30 # Width of the created_at ranges a rebuild aggregates independently
+
+SalesKey = Tuple[str, str, datetime] # (restaurant_id, granularity, bucket_start)
+ItemKey = Tuple[str, str, datetime, int] # SalesKey + menu_item_id
+
+@lru_cache(maxsize=None)
+def _timezone(name: Optional[str]):
+    try:
+        return pytz.timezone(name) if name else pytz.utc
+    except pytz.UnknownTimeZoneError:
+        logger.warning(f"Unknown restaurant timezone {name!r}; bucketing sales in UTC.")
+        return pytz.utc
+
+def restaurant_timezone(db: Session, restaurant_id: str):
+    name = db.query(models.Restaurant.timezone).filter(models.Restaurant.restaurant_id == restaurant_id).scalar()
+    return _timezone(name)
+
+def restaurant_timezone_of(restaurant: Optional[models.Restaurant]):
+    """restaurant_timezone for an already loaded restaurant, without a query."""
+    return _timezone(restaurant.timezone if restaurant else None)
+
+def restaurant_timezones(db: Session, restaurant_ids: Optional[List[str]] = None) -> Dict[str, object]:
+    query = db.query(models.Restaurant.restaurant_id, models.Restaurant.timezone)
+    if restaurant_ids:
+        query = query.filter(models.Restaurant.restaurant_id.in_(restaurant_ids))
+    return {restaurant_id: _timezone(name) for restaurant_id, name in query}
+
+def _bucket_starts(created_at: datetime, tz) -> List[Tuple[str, datetime]]:
+    """Local hour and day buckets (naive local datetimes) for a naive UTC timestamp."""
+    local = created_at.replace(tzinfo=pytz.utc).astimezone(tz).replace(tzinfo=None)
+    hour = local.replace(minute=0, second=0, microsecond=0)
+    return [("hour", hour), ("day", hour.replace(hour=0))]
+
+def local_day_to_utc(day: date, tz) -> datetime:
+    """Naive UTC instant at which the local calendar day starts."""
+    return tz.localize(datetime.combine(day, datetime.min.time())).astimezone(pytz.utc).replace(tzinfo=None)
+
+def _sales_contribution(status: Optional[str], payment_status: Optional[str], total_cost: Optional[float]) -> Dict[str, float]:
+    """
+    What one order in the given state adds to its buckets: every existing order counts as placed,
+    and refunded orders stay in gross sales and the paid count.
+    """
+    paid = payment_status in ("Paid", "Refunded")
+    refunded = payment_status == "Refunded"
+    total = total_cost or 0.0
+    return {
+        "placed_count": int(status is not None),
+        "order_count": int(paid),
+        "gross_sales": total if paid else 0.0,
+        "refunded_count": int(refunded),
+        "refunded_sales": total if refunded else 0.0,
+        "cancelled_count": int(status == "Cancelled"),
+    }
+
+def _upsert_increments(db: Session, table, rows: List[Dict], metrics: Iterable[str]) -> None:
+    """Adds each row's metric values onto the existing rollup row, inserting it if missing, in one statement."""
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Sales rollups need INSERT ... ON CONFLICT support (got {dialect}).")
+    now = datetime.utcnow()
+    stmt = insert(table).values([dict(row, updated_at=now) for row in rows])
+    increments = {metric: table.c[metric] + stmt.excluded[metric] for metric in metrics}
+    increments["updated_at"] = stmt.excluded.updated_at
+    db.execute(stmt.on_conflict_do_update(index_elements=[c.name for c in table.primary_key.columns], set_=increments))
+
+def capture_sales_state(order: models.Order) -> Tuple[Optional[str], Optional[str]]:
+    """Snapshot of the fields the rollups depend on; take it before changing an order's status."""
+    return order.status, order.payment_status
+
+def apply_sales_transition(db: Session, order: models.Order, previous_state: Tuple[Optional[str], Optional[str]], tz=None) -> None:
+    """
+    Moves an order's contribution in the hourly/daily rollups from `previous_state` (from
+    capture_sales_state) to its current status. Runs in the caller's transaction, so the rollups
+    commit or roll back with the status change. Calls where nothing relevant changed (e.g. marking
+    an already-paid order paid) write nothing. New orders pass (None, None) as `previous_state`.
+    Callers holding the restaurant pass its `tz` (restaurant_timezone_of) to save the lookup.
+    """
+    apply_sales_transitions(db, [SalesTransition(
+        order.id, order.restaurant_id, order.created_at, order.total_cost,
+        previous_state, capture_sales_state(order)
+    )], {order.restaurant_id: tz} if tz is not None else None)
+
+class SalesTransition(NamedTuple):
+    order_id: str
+    restaurant_id: str
+    created_at: Optional[datetime]
+    total_cost: Optional[float]
+    previous_state: Tuple[Optional[str], Optional[str]] # (status, payment_status) before
+    new_state: Tuple[Optional[str], Optional[str]] # and after the change
+
+def apply_sales_transitions(db: Session, transitions: List[SalesTransition], timezones: Optional[Dict[str, object]] = None) -> None:
+    """
+    Set-based apply_sales_transition: deltas for all `transitions` are summed per bucket and
+    written with one upsert per rollup table, plus one query for the affected order lines.
+    `timezones` may carry restaurants' timezones the caller already knows.
+    """
+    sales: Dict[SalesKey, Dict] = {}
+    item_signs: Dict[str, Tuple[int, List[SalesKey]]] = {}
+    timezones = dict(timezones or {})
+    for transition in transitions:
+        if transition.created_at is None or not transition.restaurant_id:
+            continue
+        before = _sales_contribution(*transition.previous_state, transition.total_cost)
+        after = _sales_contribution(*transition.new_state, transition.total_cost)
+        delta = {metric: after[metric] - before[metric] for metric in SALES_METRICS}
+        item_sign = int(transition.new_state[1] == "Paid") - int(transition.previous_state[1] == "Paid")
+        if not any(delta.values()) and not item_sign:
+            continue
+        if transition.restaurant_id not in timezones:
+            timezones[transition.restaurant_id] = restaurant_timezone(db, transition.restaurant_id)
+        keys = [(transition.restaurant_id, granularity, bucket_start)
+                for granularity, bucket_start in _bucket_starts(transition.created_at, timezones[transition.restaurant_id])]
+        if any(delta.values()):
+            for key in keys:
+                totals = sales.setdefault(key, dict.fromkeys(SALES_METRICS, 0))
+                for metric, value in delta.items():
+                    totals[metric] += value
+        if item_sign:
+            item_signs[transition.order_id] = (item_sign, keys)
+
+    _upsert_increments(db, models.SalesRollup.__table__, [
+        dict(restaurant_id=key[0], granularity=key[1], bucket_start=key[2], **values) for key, values in sales.items()
+    ], SALES_METRICS)
+    if not item_signs:
+        return
+    items: Dict[ItemKey, Dict] = {}
+    lines = db.query(
+        models.OrderItem.order_id, models.OrderItem.item_id,
+        func.sum(models.OrderItem.quantity), func.sum(models.OrderItem.quantity * models.OrderItem.price)
+    ).filter(models.OrderItem.order_id.in_(list(item_signs))).group_by(models.OrderItem.order_id, models.OrderItem.item_id)
+    for order_id, item_id, quantity, line_sales in lines:
+        item_sign, keys = item_signs[order_id]
+        for key in keys:
+            totals = items.setdefault(key + (item_id,), dict.fromkeys(ITEM_METRICS, 0))
+            totals["quantity"] += item_sign * (quantity or 0)
+            totals["sales"] += item_sign * (line_sales or 0.0)
+    _upsert_increments(db, models.ItemSalesRollup.__table__, [
+        dict(restaurant_id=key[0], granularity=key[1], bucket_start=key[2], menu_item_id=key[3], **values)
+        for key, values in items.items()
+    ], ITEM_METRICS)
+
+def _aggregate_sales(order_rows, item_rows, tz_for: Callable[[str], object]) -> Tuple[Dict[SalesKey, Dict], Dict[ItemKey, Dict]]:
+    """
+    Buckets raw rows the same way apply_sales_transition does.
+    order_rows: (restaurant_id, created_at, status, payment_status, total_cost)
+    item_rows: (restaurant_id, created_at, menu_item_id, quantity, line_sales) for paid orders only
+    """
+    sales: Dict[SalesKey, Dict] = {}
+    for restaurant_id, created_at, status, payment_status, total_cost in order_rows:
+        contribution = _sales_contribution(status, payment_status, total_cost)
+        if created_at is None or not any(contribution.values()):
+            continue
+        for granularity, bucket_start in _bucket_starts(created_at, tz_for(restaurant_id)):
+            totals = sales.setdefault((restaurant_id, granularity, bucket_start), dict.fromkeys(SALES_METRICS, 0))
+            for metric, value in contribution.items():
+                totals[metric] += value
+    items: Dict[ItemKey, Dict] = {}
+    for restaurant_id, created_at, item_id, quantity, line_sales in item_rows:
+        if created_at is None:
+            continue
+        for granularity, bucket_start in _bucket_starts(created_at, tz_for(restaurant_id)):
+            totals = items.setdefault((restaurant_id, granularity, bucket_start, item_id), dict.fromkeys(ITEM_METRICS, 0))
+            totals["quantity"] += quantity or 0
+            totals["sales"] += line_sales or 0.0
+    return sales, items
+
+def aggregate_sales_range(db: Session, start: datetime, end: datetime, restaurant_ids: Optional[List[str]] = None) -> Tuple[Dict[SalesKey, Dict], Dict[ItemKey, Dict]]:
+    """Scans raw orders created in [start, end) (naive UTC), archived ones included, and returns their bucketed rollup values."""
+    order_queries, item_queries = [], []
+    for tables in (HOT_ORDER_TABLES, ARCHIVED_ORDER_TABLES) if reaches_archive(db, start) else (HOT_ORDER_TABLES,):
+        order, line = tables.order, tables.item
+        order_query = db.query(
+            order.restaurant_id, order.created_at, order.status, order.payment_status, order.total_cost
+        ).filter(order.created_at >= start, order.created_at < end)
+        item_query = db.query(
+            order.restaurant_id, order.created_at, line.item_id, line.quantity, line.quantity * line.price
+        ).join(line, line.order_id == order.id)\
+         .filter(order.created_at >= start, order.created_at < end, order.payment_status == "Paid")
+        if restaurant_ids:
+            order_query = order_query.filter(order.restaurant_id.in_(restaurant_ids))
+            item_query = item_query.filter(order.restaurant_id.in_(restaurant_ids))
+        order_queries.append(order_query)
+        item_queries.append(item_query)
+    timezones = restaurant_timezones(db, restaurant_ids)
+    return _aggregate_sales(chain(*order_queries), chain(*item_queries), lambda restaurant_id: timezones.get(restaurant_id, pytz.utc))
+
+def merge_sales_aggregates(into: Tuple[Dict, Dict], part: Tuple[Dict, Dict]) -> Tuple[Dict, Dict]:
+    """Sums `part` into `into`; buckets straddling two chunks end up with both halves."""
+    for target, source in zip(into, part):
+        for key, values in source.items():
+            totals = target.setdefault(key, dict.fromkeys(values, 0))
+            for metric, value in values.items():
+                totals[metric] += value
+    return into
+
+def sales_rollup_chunks(db: Session, restaurant_ids: Optional[List[str]] = None, chunk_days: int = ROLLUP_CHUNK_DAYS) -> List[Tuple[datetime, datetime]]:
+    """Splits the created_at span of the orders (archived ones included) into [start, end) ranges of `chunk_days`."""
+    spans = []
+    for order in (models.Order, models.ArchivedOrder):
+        query = db.query(func.min(order.created_at), func.max(order.created_at))
+        if restaurant_ids:
+            query = query.filter(order.restaurant_id.in_(restaurant_ids))
+        spans.append(query.one())
+    firsts = [first for first, _ in spans if first is not None]
+    if not firsts:
+        return []
+    first, last = min(firsts), max(last for _, last in spans if last is not None)
+    chunks, start = [], first.replace(hour=0, minute=0, second=0, microsecond=0)
+    while start <= last:
+        end = start + timedelta(days=chunk_days)
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+def replace_sales_rollups(db: Session, aggregates: Tuple[Dict, Dict], restaurant_ids: Optional[List[str]] = None) -> Tuple[int, int]:
+    """Swaps the stored rollups (all, or just `restaurant_ids`) for `aggregates` in one transaction."""
+    sales, items = aggregates
+    now = datetime.utcnow()
+    try:
+        for model in (models.SalesRollup, models.ItemSalesRollup):
+            query = db.query(model)
+            if restaurant_ids:
+                query = query.filter(model.restaurant_id.in_(restaurant_ids))
+            query.delete(synchronize_session=False)
+        db.bulk_insert_mappings(models.SalesRollup, [
+            dict(restaurant_id=key[0], granularity=key[1], bucket_start=key[2], updated_at=now, **values)
+            for key, values in sales.items()
+        ])
+        db.bulk_insert_mappings(models.ItemSalesRollup, [
+            dict(restaurant_id=key[0], granularity=key[1], bucket_start=key[2], menu_item_id=key[3], updated_at=now, **values)
+            for key, values in items.items()
+        ])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(sales), len(items)
+
+def rebuild_sales_rollups(db: Session, restaurant_ids: Optional[List[str]] = None, chunk_days: int = ROLLUP_CHUNK_DAYS) -> Tuple[int, int]:
+    """In-process rebuild from raw orders; the backfill command runs the chunks in parallel instead."""
+    aggregates = ({}, {})
+    for start, end in sales_rollup_chunks(db, restaurant_ids, chunk_days):
+        merge_sales_aggregates(aggregates, aggregate_sales_range(db, start, end, restaurant_ids))
+    return replace_sales_rollups(db, aggregates, restaurant_ids)
+
+def analytics_window(period: str, today: date) -> Tuple[date, date]:
+    if period == "daily":
+        return today, today + timedelta(days=1)
+    if period == "weekly":
+        start = today - timedelta(days=today.weekday())
+        return start, start + timedelta(days=7)
+    if period == "monthly":
+        start = today.replace(day=1)
+        if start.month == 12:
+            return start, start.replace(year=start.year + 1, month=1)
+        return start, start.replace(month=start.month + 1)
+    raise ValueError("Invalid period for analytics. Choose from 'daily', 'weekly', 'monthly'.")
+
+def _sales_totals(rows: Iterable[Dict]) -> Dict[str, float]:
+    totals = dict.fromkeys(SALES_METRICS, 0)
+    for row in rows:
+        for metric in SALES_METRICS:
+            totals[metric] += row[metric] or 0
+    return totals
+
+def _rollup_row(row) -> Dict:
+    return {metric: getattr(row, metric) for metric in SALES_METRICS}
+
+def get_sales_analytics(db: Session, restaurant_id: str, period: str = "daily", raw: bool = False) -> Dict:
+    """
+    Sales for the current local day/week/month of a restaurant, read from the rollup tables.
+    With raw=True the same figures are computed by scanning orders/order_items instead, which
+    is slower but useful to verify the rollups. order_count counts every order created in the
+    period, whatever its status; paid_count, the sales figures and popular_items cover paid ones.
+    """
+    tz = restaurant_timezone(db, restaurant_id)
+    start_date, end_date = analytics_window(period, datetime.now(tz).date())
+    start_local = datetime.combine(start_date, datetime.min.time())
+    end_local = datetime.combine(end_date, datetime.min.time())
+
+    if raw:
+        sales, items = aggregate_sales_range(db, local_day_to_utc(start_date, tz), local_day_to_utc(end_date, tz), [restaurant_id])
+        days = [values for key, values in sales.items() if key[1] == "day"]
+        hours = sorted((key[2], values) for key, values in sales.items() if key[1] == "hour")
+        item_totals: Dict[int, Dict] = {}
+        for key, values in items.items():
+            if key[1] == "day":
+                totals = item_totals.setdefault(key[3], dict.fromkeys(ITEM_METRICS, 0))
+                totals["quantity"] += values["quantity"]
+                totals["sales"] += values["sales"]
+        item_totals = {item_id: values for item_id, values in item_totals.items() if values["quantity"] > 0}
+        top = sorted(item_totals.items(), key=lambda entry: (-entry[1]["quantity"], entry[0]))[:5]
+        names = dict(db.query(models.MenuItem.id, models.MenuItem.name).filter(models.MenuItem.id.in_([item_id for item_id, _ in top])))
+        popular = [(item_id, names.get(item_id), values["quantity"], values["sales"]) for item_id, values in top]
+    else:
+        rollup = models.SalesRollup
+        in_window = (rollup.restaurant_id == restaurant_id, rollup.bucket_start >= start_local, rollup.bucket_start < end_local)
+        days = [_rollup_row(row) for row in db.query(rollup).filter(rollup.granularity == "day", *in_window)]
+        hours = []
+        if period == "daily":
+            hours = [(row.bucket_start, _rollup_row(row)) for row in
+                     db.query(rollup).filter(rollup.granularity == "hour", *in_window).order_by(rollup.bucket_start)]
+        item_rollup = models.ItemSalesRollup
+        total_quantity = func.sum(item_rollup.quantity)
+        popular = db.query(item_rollup.menu_item_id, models.MenuItem.name, total_quantity, func.sum(item_rollup.sales))\
+            .outerjoin(models.MenuItem, models.MenuItem.id == item_rollup.menu_item_id)\
+            .filter(item_rollup.restaurant_id == restaurant_id, item_rollup.granularity == "day",
+                    item_rollup.bucket_start >= start_local, item_rollup.bucket_start < end_local)\
+            .group_by(item_rollup.menu_item_id, models.MenuItem.name)\
+            .having(total_quantity > 0)\
+            .order_by(total_quantity.desc(), item_rollup.menu_item_id)\
+            .limit(5).all()
+
+    totals = _sales_totals(days)
+    result = {
+        "period": period,
+        "restaurant_id": restaurant_id,
+        "timezone": tz.zone,
+        "source": "raw" if raw else "rollup",
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "order_count": totals["placed_count"], # Every order created in the period, as before the rollups
+        "paid_count": totals["order_count"],
+        "total_sales": round(totals["gross_sales"] - totals["refunded_sales"], 2), # Net of refunds
+        "gross_sales": round(totals["gross_sales"], 2),
+        "refunded_count": totals["refunded_count"],
+        "refunded_sales": round(totals["refunded_sales"], 2),
+        "cancelled_count": totals["cancelled_count"],
+        "popular_items": [
+            {"menu_item_id": item_id, "name": name, "quantity": quantity, "sales": round(sales or 0.0, 2)}
+            for item_id, name, quantity, sales in popular
+        ],
+    }
+    if period == "daily":
+        result["hourly"] = [
+            {"hour": bucket_start.isoformat(), "order_count": values["placed_count"], "paid_count": values["order_count"],
+             "total_sales": round(values["gross_sales"] - values["refunded_sales"], 2)}
+            for bucket_start, values in hours if values["placed_count"] or values["order_count"]
+        ]
+    return result
+
+def get_item_quantities_sold(db: Session, restaurant_id: str, since: datetime) -> Dict[int, int]:
+    """Quantities sold per menu item from the local day starting at `since` on, read from the day rollups."""
+    item_rollup = models.ItemSalesRollup
+    return {item_id: int(quantity) for item_id, quantity in db.query(item_rollup.menu_item_id, func.sum(item_rollup.quantity)).filter(
+        item_rollup.restaurant_id == restaurant_id, item_rollup.granularity == "day", item_rollup.bucket_start >= since
+    ).group_by(item_rollup.menu_item_id) if quantity}
@@ -0,0 +1,102 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import update, case, func, create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.exc import IntegrityError
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import threading
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# Numbers reserved per round trip when a worker pre-allocates a block of order numbers.
+# 1 (the default) keeps numbering gapless by allocating inside the order's own transaction.
+ORDER_NUMBER_BLOCK_SIZE = max(1, int(os.getenv("ORDER_NUMBER_BLOCK_SIZE", "1")))
+
+def _seed_sequence(db: Session, restaurant_id: str, floor: int) -> None:
+    """Creates the counter row for a restaurant, starting after any order numbers already in use."""
+    max_existing = db.query(func.max(models.Order.order_number)).filter(
+        models.Order.restaurant_id == restaurant_id
+    ).scalar() or 0
+    try:
+        # Savepoint so a concurrent seed by another worker does not abort the caller's transaction
+        with db.begin_nested():
+            db.add(models.OrderNumberSequence(restaurant_id=restaurant_id, last_value=max(max_existing, floor)))
+    except IntegrityError:
+        logger.info(f"Order number sequence for restaurant {restaurant_id} was seeded concurrently.")
+
+def reserve_order_numbers(db: Session, restaurant_id: str, count: int = 1, series_start: int = 1) -> Tuple[int, int]:
+    """
+    Atomically reserves `count` consecutive order numbers for a restaurant and returns the
+    inclusive (first, last) range. The counter never drops below `series_start - 1`, so raising
+    Restaurant.bill_series_start moves the series forward. The reservation is part of the
+    session's transaction; the caller commits.
+    """
+    if count < 1:
+        raise ValueError("Must reserve at least one order number.")
+    floor = max((series_start or 1) - 1, 0)
+    seq = models.OrderNumberSequence
+    stmt = update(seq).where(seq.restaurant_id == restaurant_id).values(
+        last_value=case((seq.last_value < floor, floor), else_=seq.last_value) + count
+    ).returning(seq.last_value).execution_options(synchronize_session=False)
+
+    last = db.execute(stmt).scalar()
+    if last is None:
+        _seed_sequence(db, restaurant_id, floor)
+        last = db.execute(stmt).scalar()
+    if last is None:
+        raise Exception(f"Could not allocate an order number for restaurant {restaurant_id}")
+    return last - count + 1, last
+
+class OrderNumberAllocator:
+    """
+    Per-process cache of pre-allocated order number blocks. Each block is reserved and committed
+    in its own short transaction, so the counter row is never locked for the length of an order.
+    Numbers left in a block when the process exits are skipped, and numbers from different
+    workers interleave, so this trades gapless ordering for throughput.
+    """
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self.blocks: Dict[str, List[int]] = {} # restaurant_id -> [next, last]
+        self.engines: Dict[str, Engine] = {}
+        self.lock = threading.Lock()
+
+    def _engine_for(self, db: Session) -> Engine:
+        # Reserve through an unpooled engine: the caller already holds a pooled connection, and
+        # waiting on a second one from the same pool can starve when every worker does the same.
+        engine = db.get_bind()
+        engine = getattr(engine, "engine", engine)
+        if engine.url.get_backend_name() == "sqlite" and engine.url.database in (None, "", ":memory:"):
+            return engine # An in-memory database only exists on the original pool
+        key = str(engine.url)
+        if key not in self.engines:
+            self.engines[key] = create_engine(engine.url, poolclass=NullPool)
+        return self.engines[key]
+
+    def next_number(self, db: Session, restaurant_id: str, series_start: int = 1) -> int:
+        with self.lock:
+            block = self.blocks.get(restaurant_id)
+            if not block or block[0] > block[1]:
+                with Session(bind=self._engine_for(db)) as seq_db:
+                    first, last = reserve_order_numbers(seq_db, restaurant_id, self.block_size, series_start)
+                    seq_db.commit()
+                block = self.blocks[restaurant_id] = [first, last]
+            number = block[0]
+            block[0] += 1
+            return number
+
+order_number_allocator = OrderNumberAllocator(ORDER_NUMBER_BLOCK_SIZE)
+
+def allocate_order_number(db: Session, restaurant: Optional[models.Restaurant], restaurant_id: str) -> Tuple[int, Optional[str]]:
+    """Returns the next order number for a restaurant and its bill number (prefix + number), if a prefix is set."""
+    series_start = restaurant.bill_series_start if restaurant and restaurant.bill_series_start else 1
+    if order_number_allocator.block_size > 1:
+        order_number = order_number_allocator.next_number(db, restaurant_id, series_start)
+    else:
+        order_number, _ = reserve_order_numbers(db, restaurant_id, 1, series_start)
+    prefix = restaurant.bill_number_prefix if restaurant else None
+    bill_number = f"{prefix}{order_number}" if prefix else None
+    return order_number, bill_number
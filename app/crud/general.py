@@ -1,16 +1,27 @@
 from sqlalchemy.orm import Session, joinedload, selectinload
 from .. import models, schemas # Adjusted for new location
-from typing import List, Optional, Tuple, Dict
+from typing import List, Optional, Tuple, Dict, Iterator
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func, desc, or_
+from sqlalchemy import func, desc, or_, update, bindparam
 from datetime import datetime, timedelta
 from ..utils.timezone import ist_now, utc_to_ist # Adjusted for new location
 from ..auth.custom_auth import get_password_hash # Adjusted for new location
 import logging
 import uuid
 import re
-from .crud_inventory import deduct_inventory_for_sale # Correct after move
+import csv
+import heapq
+import zlib
+from io import StringIO
+from .crud_inventory import deduct_inventory_for_sale, deduct_inventory_for_sale_bulk # Correct after move
 from .crud_tables import create_restaurant_table # ADDED import for creating tables
+from .crud_sequences import allocate_order_number
+from .crud_rollups import capture_sales_state, apply_sales_transition, analytics_window, get_sales_analytics, restaurant_timezone_of
+from .crud_open_tables import get_open_table_order, open_table_order, sync_open_table_order
+from .pagination import decode_order_cursor, clamp_order_page_size
+from .crud_archive import OrderTables, HOT_ORDER_TABLES, ARCHIVED_ORDER_TABLES, paginate_orders, reaches_archive
+from .crud_kds import bump_kds_version
+from .crud_menu import publish_menu_snapshot, expand_combo_quantities, menu_item_out_options
 
 logger = logging.getLogger(__name__)
 
@@ -272,6 +283,7 @@ def create_menu_category(db: Session, restaurant_id: str, category: schemas.Menu
     data = category.dict(exclude={"restaurant_id"})
     db_category = models.MenuCategory(**data, restaurant_id=restaurant_id)
     db.add(db_category)
+    publish_menu_snapshot(db, restaurant_id)
     db.commit()
     db.refresh(db_category)
     return db_category
@@ -285,6 +297,7 @@ def update_menu_category(db: Session, category_id: int, restaurant_id: str, cate
         return None
     for field, value in category.dict(exclude_unset=True).items():
         setattr(db_cat, field, value)
+    publish_menu_snapshot(db, restaurant_id)
     db.commit()
     db.refresh(db_cat)
     return db_cat
@@ -293,16 +306,17 @@ def delete_menu_category(db: Session, category_id: int, restaurant_id: str):
     db_cat = get_menu_category(db, category_id, restaurant_id)
     if db_cat:
         db.delete(db_cat)
+        publish_menu_snapshot(db, restaurant_id)
         db.commit()
         return True
     return False
 
 # --- Menu Item ---
 def get_all_menu_items(db: Session, restaurant_id: str) -> List[models.MenuItem]:
-    return db.query(models.MenuItem).options(
-        selectinload(models.MenuItem.components).selectinload(models.ComboItemComponent.component_item).selectinload(models.MenuItem.category), # Eager load component's category too
-        selectinload(models.MenuItem.category) # Eager load category for the main item
-    ).filter(models.MenuItem.restaurant_id == restaurant_id).order_by(models.MenuItem.name).all()
+    # Categories, components and the components' own components in batches (see menu_item_out_options)
+    return db.query(models.MenuItem).options(*menu_item_out_options()).filter(
+        models.MenuItem.restaurant_id == restaurant_id
+    ).order_by(models.MenuItem.name).all()
 
 def create_menu_item(db: Session, restaurant_id: str, item: schemas.MenuItemCreate) -> models.MenuItem:
     variations_data = [v.dict() for v in item.variations] if item.variations else None
@@ -330,15 +344,15 @@ def create_menu_item(db: Session, restaurant_id: str, item: schemas.MenuItemCrea
 
             component_objects_to_add = []
             for comp_data in item.components:
+                # Components may be combos themselves; the combo expansions flatten them
                 component_menu_item_db = db.query(models.MenuItem).filter(
                     models.MenuItem.id == comp_data.menu_item_id,
-                    models.MenuItem.restaurant_id == restaurant_id,
-                    models.MenuItem.item_type == schemas.ItemType.REGULAR.value
+                    models.MenuItem.restaurant_id == restaurant_id
                 ).first()
                 
                 if not component_menu_item_db:
                     db.rollback()
-                    raise ValueError(f"Component item with ID {comp_data.menu_item_id} not found for restaurant {restaurant_id}, is not available, or is not a 'regular' item.")
+                    raise ValueError(f"Component item with ID {comp_data.menu_item_id} not found for restaurant {restaurant_id}.")
 
                 if db_item.id == component_menu_item_db.id:
                     db.rollback()
@@ -354,6 +368,7 @@ def create_menu_item(db: Session, restaurant_id: str, item: schemas.MenuItemCrea
             if component_objects_to_add:
                 db.add_all(component_objects_to_add)
             
+            publish_menu_snapshot(db, restaurant_id, combos_changed=True)
             db.commit()
         except Exception as e:
             db.rollback()
@@ -364,6 +379,7 @@ def create_menu_item(db: Session, restaurant_id: str, item: schemas.MenuItemCrea
         if item.components and len(item.components) > 0:
             db.rollback()
             raise ValueError("Components should not be provided for a regular item type.")
+        publish_menu_snapshot(db, restaurant_id)
         db.commit()
 
     db.refresh(db_item)
@@ -395,16 +411,10 @@ def add_menu_item_to_session(db: Session, restaurant_id: str, item: schemas.Menu
     return db_item
 
 def get_menu_item(db: Session, item_id: int, restaurant_id: str) -> Optional[models.MenuItem]:
-    # Eager load components and their actual item details, including the category of component items
-    # Also eager load the category of the main menu item itself.
-    query = db.query(models.MenuItem).options(
-        selectinload(models.MenuItem.category), # Category of the main/combo item
-        selectinload(models.MenuItem.variations), # Variations of the main/combo item
-        selectinload(models.MenuItem.components).selectinload(models.ComboItemComponent.component_item).options(
-            selectinload(models.MenuItem.category), # Category of the component item
-            selectinload(models.MenuItem.variations) # Variations of the component item (if any)
-        )
-    ).filter(
+    # Eager load the category, components and their items (see menu_item_out_options); a combo's
+    # flattened components come with it through MenuItem.expansion
+    # (variations is a JSON column, loaded with the item itself)
+    query = db.query(models.MenuItem).options(*menu_item_out_options()).filter(
         models.MenuItem.id == item_id, 
         models.MenuItem.restaurant_id == restaurant_id
     )
@@ -418,6 +428,7 @@ def update_menu_item(db: Session, item_id: int, restaurant_id: str, item_update:
     # item_update schema (MenuItemCreate) now contains inventory_available and inventory_quantity.
     # These will be part of update_data.
     update_data = item_update.dict(exclude_unset=True, exclude={'components'}) 
+    was_combo = str(db_item.item_type).lower() == schemas.ItemType.COMBO.value
 
     for field, value in update_data.items():
         if field == 'item_type' and value != db_item.item_type:
@@ -444,8 +455,7 @@ def update_menu_item(db: Session, item_id: int, restaurant_id: str, item_update:
             for comp_data in item_update.components:
                 component_menu_item_db = db.query(models.MenuItem).filter(
                     models.MenuItem.id == comp_data.menu_item_id,
-                    models.MenuItem.restaurant_id == restaurant_id,
-                    models.MenuItem.item_type == schemas.ItemType.REGULAR.value
+                    models.MenuItem.restaurant_id == restaurant_id
                 ).first()
                 if not component_menu_item_db:
                     db.rollback()
@@ -465,6 +475,7 @@ def update_menu_item(db: Session, item_id: int, restaurant_id: str, item_update:
             db.rollback()
             raise ValueError("Combo items must have components. To make it regular, change item_type.")
     try:
+        publish_menu_snapshot(db, restaurant_id, combos_changed=was_combo or str(db_item.item_type).lower() == schemas.ItemType.COMBO.value)
         db.commit()
         db.refresh(db_item)
     except Exception as e:
@@ -478,12 +489,26 @@ def delete_menu_item(db: Session, item_id: int, restaurant_id: str):
     db_item = get_menu_item(db, item_id, restaurant_id)
     if db_item:
         db.delete(db_item)
+        # The item may be a combo or inside one
+        publish_menu_snapshot(db, restaurant_id, combos_changed=True)
         db.commit()
         return True
     return False
 
 # --- Orders ---
-def create_order(db: Session, order: schemas.OrderCreate, user_uid: str, user_role: str, admin_uid: Optional[str] = None):
+def _get_available_menu_items_by_id(db: Session, restaurant_id: str, item_ids) -> Dict[int, models.MenuItem]:
+    """Loads the available menu items of a restaurant for the given ids in one query, keyed by id."""
+    if not item_ids:
+        return {}
+    menu_items = db.query(models.MenuItem).filter(
+        models.MenuItem.id.in_(list(item_ids)),
+        models.MenuItem.restaurant_id == restaurant_id,
+        models.MenuItem.available == True
+    ).all()
+    return {menu_item.id: menu_item for menu_item in menu_items}
+
+def create_order(db: Session, order: schemas.OrderCreate, user_uid: str, user_role: str, admin_uid: Optional[str] = None) -> Tuple[models.Order, int]:
+    """Places an order; returns it with the KDS version its event is published at (see crud_kds)."""
     if not order.items or not isinstance(order.items, list):
         raise Exception("Order must contain at least one item.")
     seen_items = set()
@@ -495,8 +520,6 @@ def create_order(db: Session, order: schemas.OrderCreate, user_uid: str, user_ro
     if restaurant:
         restaurant_name = restaurant.restaurant_name
     
-    db_items = []
-    
     for item in order.items:
         if not hasattr(item, 'item_id') or not hasattr(item, 'quantity'):
             raise Exception("Each order item must have item_id and quantity.")
@@ -505,14 +528,14 @@ def create_order(db: Session, order: schemas.OrderCreate, user_uid: str, user_ro
         seen_items.add(item.item_id)
         if not isinstance(item.quantity, int) or item.quantity <= 0:
             raise Exception(f"Invalid quantity for item {item.item_id}")
-        
-        db_menu_item = db.query(models.MenuItem).filter(
-            models.MenuItem.id == item.item_id,
-            models.MenuItem.available == True
-        ).first()
+
+    # Resolve every line in a single IN (...) query instead of one SELECT per line
+    menu_items_by_id = _get_available_menu_items_by_id(db, restaurant_id, seen_items)
+    db_items = []
+    for item in order.items:
+        db_menu_item = menu_items_by_id.get(item.item_id)
         if not db_menu_item:
             raise Exception(f"Menu item not found or unavailable: {item.item_id}")
-            
         db_items.append((db_menu_item, item.quantity))
 
     total_cost = sum(db_menu_item.price * quantity for db_menu_item, quantity in db_items)
@@ -526,19 +549,14 @@ def create_order(db: Session, order: schemas.OrderCreate, user_uid: str, user_ro
         if promo:
             promo_code_id = promo.id
 
-    latest_order = db.query(models.Order).filter(
-        models.Order.restaurant_id == restaurant_id
-    ).order_by(models.Order.order_number.desc()).first()
-    
-    order_number = 1
-    if latest_order and latest_order.order_number:
-        order_number = latest_order.order_number + 1
+    order_number, bill_number = allocate_order_number(db, restaurant, restaurant_id)
     
     order_id = f"{restaurant_id}_{order_number}"
 
     db_order = models.Order(
         id=order_id,
         order_number=order_number,
+        bill_number=bill_number,
         user_uid=user_uid,
         user_role=user_role,
         table_number=order.table_number,
@@ -555,166 +573,186 @@ def create_order(db: Session, order: schemas.OrderCreate, user_uid: str, user_ro
     try:
         db.add(db_order)
         
-        order_items_models = []
-        for db_menu_item, qty in db_items:
-            order_item = models.OrderItem(
-                order_id=db_order.id, 
-                item_id=db_menu_item.id,
-                quantity=qty,
-                price=db_menu_item.price
-            )
-            order_items_models.append(order_item)
-        
-        db.add_all(order_items_models)
+        db.flush()
+        open_table_order(db, db_order)
+        # Insert all lines as one executemany; the refresh below loads them back onto the order
+        db.bulk_insert_mappings(models.OrderItem, [
+            {
+                "order_id": db_order.id,
+                "item_id": db_menu_item.id,
+                "quantity": qty,
+                "price": db_menu_item.price
+            }
+            for db_menu_item, qty in db_items
+        ])
         
-        for db_menu_item, qty_sold in db_items:
-            deduct_inventory_for_sale(
-                db=db,
-                restaurant_id=db_order.restaurant_id,
-                menu_item_id=db_menu_item.id,
-                quantity_sold=float(qty_sold), 
-                order_id=db_order.id,
-                changed_by_user_id=user_uid 
-            )
+        deduct_inventory_for_sale_bulk(
+            db=db,
+            restaurant_id=db_order.restaurant_id,
+            # Combos also take their components' stock, in the same batched update
+            quantities_sold=expand_combo_quantities(
+                menu_items_by_id.values(), {db_menu_item.id: float(qty_sold) for db_menu_item, qty_sold in db_items}
+            ),
+            order_id=db_order.id,
+            changed_by_user_id=user_uid
+        )
+        apply_sales_transition(db, db_order, (None, None), tz=restaurant_timezone_of(restaurant)) # Counts the order as placed
+        kds_version = bump_kds_version(db, restaurant_id)
 
         db.commit()
         db.refresh(db_order) 
         
-        return db_order
+        return db_order, kds_version
     except IntegrityError as e:
         db.rollback()
+        if order.table_number and get_open_table_order(db, restaurant_id, order.table_number):
+            # Another request opened this table between our lookup and insert
+            raise ValueError(f"Table {order.table_number} already has an open order; retry to add the items to it.")
         raise Exception("Duplicate order item detected. Please try again.")
     except Exception as e:
         db.rollback()
         raise Exception(f"Error creating order: {str(e)}")
 
-def get_orders_by_user(db: Session, user_uid: str, restaurant_id: Optional[str] = None):
+def _order_to_dict(order_orm: models.Order, caller: str) -> Dict:
+    # Attempt to use Pydantic schema for conversion first for cleaner structure
     try:
-        orders_query = db.query(models.Order).filter(models.Order.user_uid == user_uid)
-        if restaurant_id:
-            orders_query = orders_query.filter(models.Order.restaurant_id == restaurant_id) # Filter directly on order
-        
-        orders = orders_query.options( # Eager load relationships
-            selectinload(models.Order.items).selectinload(models.OrderItem.item),
-            selectinload(models.Order.payment),
-            selectinload(models.Order.status_history)
-        ).order_by(models.Order.created_at.desc()).all()
+        return schemas.OrderOut.from_orm(order_orm).dict()
+    except Exception: # Fallback to manual dictionary creation if OrderOut fails or is not suitable
+        logger.warning(f"Falling back to manual dict creation for order {order_orm.id} in {caller}")
+        return {
+            "id": order_orm.id, "user_uid": order_orm.user_uid, "user_role": order_orm.user_role,
+            "table_number": order_orm.table_number, "created_at": order_orm.created_at,
+            "status": order_orm.status, "total_cost": order_orm.total_cost,
+            "payment_status": order_orm.payment_status, "promo_code_id": getattr(order_orm, "promo_code_id", None),
+            "restaurant_id": order_orm.restaurant_id, "restaurant_name": order_orm.restaurant_name,
+            "items": [schemas.OrderItemOut.from_orm(item).dict() for item in order_orm.items] if order_orm.items else [],
+            "payment": schemas.PaymentOut.from_orm(order_orm.payment).dict() if order_orm.payment else None,
+            "status_history": [schemas.OrderStatusHistoryOut.from_orm(hist).dict() for hist in order_orm.status_history] if order_orm.status_history else []
+        }
+
+def get_orders_by_user(db: Session, user_uid: str, restaurant_id: Optional[str] = None, cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Returns one page of the user's orders, newest first, and the cursor for the next page (None on the last page)."""
+    position = decode_order_cursor(cursor) if cursor else None # Raises ValueError for a bad cursor
+    page_size = clamp_order_page_size(limit)
+    try:
+        def orders_query(tables: OrderTables):
+            query = db.query(tables.order).filter(tables.order.user_uid == user_uid)
+            if restaurant_id:
+                query = query.filter(tables.order.restaurant_id == restaurant_id) # Filter directly on order
+            return query.options( # Eager load relationships
+                selectinload(tables.order.items).selectinload(tables.item.item),
+                selectinload(tables.order.payment),
+                selectinload(tables.order.status_history)
+            )
+
+        orders, next_cursor = paginate_orders(db, orders_query, position, page_size)
         
-        result_orders = []
-        for order_orm in orders:
-            # Attempt to use Pydantic schema for conversion first for cleaner structure
-            try:
-                order_dict = schemas.OrderOut.from_orm(order_orm).dict()
-            except Exception: # Fallback to manual dictionary creation if OrderOut fails or is not suitable
-                logger.warning(f"Falling back to manual dict creation for order {order_orm.id} in get_orders_by_user")
-                order_dict = {
-                    "id": order_orm.id, "user_uid": order_orm.user_uid, "user_role": order_orm.user_role,
-                    "table_number": order_orm.table_number, "created_at": order_orm.created_at,
-                    "status": order_orm.status, "total_cost": order_orm.total_cost,
-                    "payment_status": order_orm.payment_status, "promo_code_id": order_orm.promo_code_id,
-                    "restaurant_id": order_orm.restaurant_id, "restaurant_name": order_orm.restaurant_name,
-                    "items": [schemas.OrderItemOut.from_orm(item).dict() for item in order_orm.items] if order_orm.items else [],
-                    "payment": schemas.PaymentOut.from_orm(order_orm.payment).dict() if order_orm.payment else None,
-                    "status_history": [schemas.OrderStatusHistoryOut.from_orm(hist).dict() for hist in order_orm.status_history] if order_orm.status_history else []
-                }
-            result_orders.append(order_dict)
-        return result_orders
+        return [_order_to_dict(order_orm, "get_orders_by_user") for order_orm in orders], next_cursor
     except Exception as e:
         logger.error(f"Error in get_orders_by_user: {e}", exc_info=True)
-        return []
+        return [], None
 
-def get_all_orders(db: Session, restaurant_id: Optional[str] = None):
+def get_all_orders(db: Session, restaurant_id: Optional[str] = None, cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Returns one page of orders, newest first, and the cursor for the next page (None on the last page)."""
+    position = decode_order_cursor(cursor) if cursor else None
+    page_size = clamp_order_page_size(limit)
     try:
-        orders_query = db.query(models.Order).options(
-            selectinload(models.Order.items).selectinload(models.OrderItem.item),
-            selectinload(models.Order.payment),
-            selectinload(models.Order.status_history)
-        ).order_by(models.Order.created_at.desc())
-        
-        if restaurant_id:
-            orders_query = orders_query.filter(models.Order.restaurant_id == restaurant_id)
-        
-        orders_orm = orders_query.all()
+        def orders_query(tables: OrderTables):
+            query = db.query(tables.order).options(
+                selectinload(tables.order.items).selectinload(tables.item.item),
+                selectinload(tables.order.payment),
+                selectinload(tables.order.status_history)
+            )
+            if restaurant_id:
+                query = query.filter(tables.order.restaurant_id == restaurant_id)
+            return query
+
+        orders_orm, next_cursor = paginate_orders(db, orders_query, position, page_size)
         
-        result_orders = []
-        for order_orm in orders_orm:
-            try:
-                order_dict = schemas.OrderOut.from_orm(order_orm).dict()
-            except Exception:
-                logger.warning(f"Falling back to manual dict creation for order {order_orm.id} in get_all_orders")
-                order_dict = {
-                    "id": order_orm.id, "user_uid": order_orm.user_uid, "user_role": order_orm.user_role,
-                    "table_number": order_orm.table_number, "created_at": order_orm.created_at,
-                    "status": order_orm.status, "total_cost": order_orm.total_cost,
-                    "payment_status": order_orm.payment_status, "promo_code_id": order_orm.promo_code_id,
-                    "restaurant_id": order_orm.restaurant_id, "restaurant_name": order_orm.restaurant_name,
-                    "items": [schemas.OrderItemOut.from_orm(item).dict() for item in order_orm.items] if order_orm.items else [],
-                    "payment": schemas.PaymentOut.from_orm(order_orm.payment).dict() if order_orm.payment else None,
-                    "status_history": [schemas.OrderStatusHistoryOut.from_orm(hist).dict() for hist in order_orm.status_history] if order_orm.status_history else []
-                }
-            result_orders.append(order_dict)
-        return result_orders
+        return [_order_to_dict(order_orm, "get_all_orders") for order_orm in orders_orm], next_cursor
     except Exception as e:
         logger.error(f"Error in get_all_orders: {e}", exc_info=True)
-        return []
+        return [], None
 
-def filter_orders(db: Session, status=None, start_date=None, end_date=None, payment_method=None, user_uid: Optional[str]=None, order_id: Optional[str]=None, user_email: Optional[str]=None, user_phone: Optional[str]=None, restaurant_id: Optional[str]=None):
-    try:
-        query = db.query(models.Order).options(
-            selectinload(models.Order.items).selectinload(models.OrderItem.item),
-            selectinload(models.Order.user), 
-            selectinload(models.Order.payment),
-            selectinload(models.Order.status_history)
-        )
-        
-        if status: query = query.filter(models.Order.status == status)
-        if start_date: query = query.filter(models.Order.created_at >= start_date)
-        if end_date: query = query.filter(models.Order.created_at <= end_date)
-        if order_id: query = query.filter(models.Order.id == order_id)
-        if user_uid: query = query.filter(models.Order.user_uid == user_uid)
-        if restaurant_id: query = query.filter(models.Order.restaurant_id == restaurant_id)
-        
-        if payment_method:
-            query = query.join(models.Order.payment).filter(models.Payment.method == payment_method)
-            
-        if user_email:
-            query = query.join(models.Order.user).filter(models.User.email.ilike(f"%{user_email}%"))
+def _filtered_orders_query(db: Session, status=None, start_date=None, end_date=None, payment_method=None, user_uid: Optional[str]=None, order_id: Optional[str]=None, user_email: Optional[str]=None, user_phone: Optional[str]=None, restaurant_id: Optional[str]=None, tables: OrderTables = HOT_ORDER_TABLES):
+    order = tables.order
+    query = db.query(order)
+    
+    if status: query = query.filter(order.status == status)
+    if start_date: query = query.filter(order.created_at >= start_date)
+    if end_date: query = query.filter(order.created_at <= end_date)
+    if order_id: query = query.filter(order.id == order_id)
+    if user_uid: query = query.filter(order.user_uid == user_uid)
+    if restaurant_id: query = query.filter(order.restaurant_id == restaurant_id)
+    
+    if payment_method:
+        query = query.join(order.payment).filter(tables.payment.method == payment_method)
         
-        if user_phone: 
-            query = query.join(models.Order.user).filter(or_(
-                models.User.number.ilike(f"%{user_phone}%"), 
-                # models.User.name.ilike(f"%{user_phone}%") # Original had name check, might be too broad
-            ))
+    if user_email:
+        query = query.join(order.user).filter(models.User.email.ilike(f"%{user_email}%"))
+    
+    if user_phone: 
+        query = query.join(order.user).filter(or_(
+            models.User.number.ilike(f"%{user_phone}%"), 
+            # models.User.name.ilike(f"%{user_phone}%") # Original had name check, might be too broad
+        ))
+    return query
+
+def filter_orders(db: Session, status=None, start_date=None, end_date=None, payment_method=None, user_uid: Optional[str]=None, order_id: Optional[str]=None, user_email: Optional[str]=None, user_phone: Optional[str]=None, restaurant_id: Optional[str]=None, cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[Dict], Optional[str]]:
+    """Returns one page of matching orders, newest first, and the cursor for the next page (None on the last page)."""
+    position = decode_order_cursor(cursor) if cursor else None
+    page_size = clamp_order_page_size(limit)
+    try:
+        def orders_query(tables: OrderTables):
+            return _filtered_orders_query(
+                db, status=status, start_date=start_date, end_date=end_date, payment_method=payment_method,
+                user_uid=user_uid, order_id=order_id, user_email=user_email, user_phone=user_phone, restaurant_id=restaurant_id,
+                tables=tables
+            ).options(
+                selectinload(tables.order.items).selectinload(tables.item.item),
+                selectinload(tables.order.user), 
+                selectinload(tables.order.payment),
+                selectinload(tables.order.status_history)
+            )
 
-        orders_orm = query.order_by(models.Order.created_at.desc()).all()
+        orders_orm, next_cursor = paginate_orders(db, orders_query, position, page_size, start_date=start_date)
         
-        result_orders = []
-        for order_orm in orders_orm:
-            try:
-                order_dict = schemas.OrderOut.from_orm(order_orm).dict()
-            except Exception:
-                logger.warning(f"Falling back to manual dict creation for order {order_orm.id} in filter_orders")
-                order_dict = { # Manual fallback
-                    "id": order_orm.id, "user_uid": order_orm.user_uid, "user_role": order_orm.user_role,
-                    "table_number": order_orm.table_number, "created_at": order_orm.created_at,
-                    "status": order_orm.status, "total_cost": order_orm.total_cost,
-                    "payment_status": order_orm.payment_status, "promo_code_id": order_orm.promo_code_id,
-                    "restaurant_id": order_orm.restaurant_id, "restaurant_name": order_orm.restaurant_name,
-                    "items": [schemas.OrderItemOut.from_orm(item).dict() for item in order_orm.items] if order_orm.items else [],
-                    "payment": schemas.PaymentOut.from_orm(order_orm.payment).dict() if order_orm.payment else None,
-                    "status_history": [schemas.OrderStatusHistoryOut.from_orm(hist).dict() for hist in order_orm.status_history] if order_orm.status_history else []
-                }
-            result_orders.append(order_dict)
-        return result_orders
+        return [_order_to_dict(order_orm, "filter_orders") for order_orm in orders_orm], next_cursor
     except Exception as e:
         logger.error(f"Error in filter_orders: {e}", exc_info=True)
-        return []
+        return [], None
 
-def update_order_status(db: Session, order_id: str, status: str, changed_by: str):
+ORDER_SUMMARY_COLUMNS = [
+    models.Order.id, models.Order.order_number, models.Order.table_number, models.Order.status,
+    models.Order.payment_status, models.Order.total_cost, models.Order.created_at
+]
+
+def get_order_summaries(db: Session, cursor: Optional[str] = None, limit: Optional[int] = None, **filters) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Lightweight variant of filter_orders for table views: selects only the summary columns,
+    loads no relationships and builds plain dicts straight from the row tuples.
+    Accepts the same filter keywords as filter_orders and the same cursor/limit pagination.
+    """
+    position = decode_order_cursor(cursor) if cursor else None
+    page_size = clamp_order_page_size(limit)
+    keys = [column.key for column in ORDER_SUMMARY_COLUMNS]
+    rows, next_cursor = paginate_orders(
+        db, lambda tables: _filtered_orders_query(db, tables=tables, **filters).with_entities(*(getattr(tables.order, key) for key in keys)),
+        position, page_size, start_date=filters.get("start_date")
+    )
+    summaries = []
+    for row in rows:
+        summary = dict(zip(keys, row))
+        summary["created_at"] = row.created_at.isoformat() if row.created_at else None
+        summaries.append(summary)
+    return summaries, next_cursor
+
+def update_order_status(db: Session, order_id: str, status: str, changed_by: str) -> Tuple[models.Order, int]:
     db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
     if not db_order:
         raise Exception(f"Order not found: {order_id}")
     
+    previous_state = capture_sales_state(db_order)
     db_order.status = status
     
     status_history = models.OrderStatusHistory(
@@ -726,12 +764,15 @@ def update_order_status(db: Session, order_id: str, status: str, changed_by: str
     
     if status == "Payment Done":
         db_order.payment_status = "Paid"
+    apply_sales_transition(db, db_order, previous_state)
+    sync_open_table_order(db, db_order, previous_state)
+    kds_version = bump_kds_version(db, db_order.restaurant_id)
     
     db.commit()
     db.refresh(db_order)
-    return db_order
+    return db_order, kds_version
 
-def confirm_order(db: Session, order_id: str, changed_by: str):
+def confirm_order(db: Session, order_id: str, changed_by: str) -> Tuple[models.Order, int]:
     return update_order_status(db, order_id, "Order Confirmed", changed_by)
 
 def mark_order_paid(
@@ -741,9 +782,9 @@ def mark_order_paid(
     payment_method: str, 
     transaction_id: Optional[str] = None,
     customer_uid: Optional[str] = None # NEW: UID of the customer associated with this order
-):
+) -> Tuple[models.Order, int]:
     db_order = db.query(models.Order).options(
-        selectinload(models.Order.items).selectinload(models.OrderItem.item).selectinload(models.MenuItem.category),
+        selectinload(models.Order.items).selectinload(models.OrderItem.item).options(*menu_item_out_options()),
         selectinload(models.Order.user), # This is the staff/system user (Order.user_uid)
         selectinload(models.Order.payment),
         selectinload(models.Order.customer_detail) # Eager load potential customer details
@@ -768,13 +809,15 @@ def mark_order_paid(
             # However, if the goal is to only set it if found, and leave it if not found (and not clear if already set), then no action on db_order.customer_uid here.
             # For now, we will only set it if found.
         else:
-        # You might want to check if db_customer.role is 'customer' or similar if needed
-        db_order.customer_uid = customer_uid
-        logging.info(f"Order {order_id} associated with customer UID {customer_uid}.")
+            # You might want to check if db_customer.role is 'customer' or similar if needed
+            db_order.customer_uid = customer_uid
+            logging.info(f"Order {order_id} associated with customer UID {customer_uid}.")
     elif db_order.customer_uid: # If customer_uid is not provided in this call, but already exists on order, keep it.
         pass # No change to customer_uid
     # else: customer_uid is None and db_order.customer_uid is also None - no action needed
 
+    previous_state = capture_sales_state(db_order)
+
     # Create or Update Payment record
     if db_order.payment:
         db_payment = db_order.payment
@@ -800,6 +843,8 @@ def mark_order_paid(
     db_order.payment_status = "Paid"
     db_order.status = "Payment Done" 
     db_order.updated_at = datetime.utcnow()
+    apply_sales_transition(db, db_order, previous_state)
+    sync_open_table_order(db, db_order, previous_state)
     
     audit_details = {
         "order_id": order_id, 
@@ -817,6 +862,7 @@ def mark_order_paid(
         details=audit_details,
         order_id=order_id 
     ))
+    kds_version = bump_kds_version(db, db_order.restaurant_id)
     
     try:
         db.commit()
@@ -828,49 +874,58 @@ def mark_order_paid(
         logging.error(f"Error committing payment for order {order_id}: {e}", exc_info=True)
         raise 
         
-    return db_order
+    return db_order, kds_version
 
-def cancel_order(db: Session, order_id: str, cancelled_by: str):
+def cancel_order(db: Session, order_id: str, cancelled_by: str) -> Tuple[models.Order, int]:
     db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
     if not db_order:
         raise Exception("Order not found")
     if db_order.status not in ["Pending", "Confirmed"]:
         raise Exception("Order cannot be cancelled at this stage.")
+    previous_state = capture_sales_state(db_order)
     db_order.status = "Cancelled"
+    apply_sales_transition(db, db_order, previous_state)
+    sync_open_table_order(db, db_order, previous_state)
     
     # Create audit log before main commit for atomicity with status change
     db.add(models.AuditLog(order_id=order_id, user_id=cancelled_by, action="cancel", timestamp=datetime.utcnow(), details="Order cancelled"))
+    kds_version = bump_kds_version(db, db_order.restaurant_id)
 
     db.commit()
     db.refresh(db_order)
-    return db_order
+    return db_order, kds_version
 
-def refund_order(db: Session, order_id: str, refunded_by: str):
+def refund_order(db: Session, order_id: str, refunded_by: str) -> Tuple[models.Order, int]:
     db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
     if not db_order:
         raise Exception("Order not found")
     if db_order.payment_status != "Paid":
         raise Exception("Order is not paid, cannot refund.")
     
+    previous_state = capture_sales_state(db_order)
     db_order.payment_status = "Refunded"
     if db_order.payment:
         db_order.payment.status = "Refunded"
         # db_order.payment.paid_at = datetime.utcnow() # paid_at might not be appropriate to update
+    apply_sales_transition(db, db_order, previous_state)
+    sync_open_table_order(db, db_order, previous_state)
     
     db.add(models.AuditLog(order_id=order_id, user_id=refunded_by, action="refund", timestamp=datetime.utcnow(), details="Order refunded"))
+    kds_version = bump_kds_version(db, db_order.restaurant_id)
 
     db.commit()
     db.refresh(db_order)
     if db_order.payment:
         db.refresh(db_order.payment)
-    return db_order
+    return db_order, kds_version
 
 # --- Payments ---
-def update_payment(db: Session, order_id: str, payment: schemas.PaymentCreate):
+def update_payment(db: Session, order_id: str, payment: schemas.PaymentCreate) -> Tuple[models.Payment, int]:
     db_order = db.query(models.Order).filter(models.Order.id == order_id).first()
     if not db_order:
         raise Exception("Order not found")
     
+    previous_state = capture_sales_state(db_order)
     db_payment = db.query(models.Payment).filter(models.Payment.order_id == order_id).first()
     if not db_payment:
         db_payment = models.Payment(
@@ -887,11 +942,14 @@ def update_payment(db: Session, order_id: str, payment: schemas.PaymentCreate):
             setattr(db_payment, field, value)
             
     db_order.payment_status = db_payment.status # Sync order payment status
+    apply_sales_transition(db, db_order, previous_state)
+    sync_open_table_order(db, db_order, previous_state)
+    kds_version = bump_kds_version(db, db_order.restaurant_id)
     
     db.commit()
     db.refresh(db_payment)
     db.refresh(db_order)
-    return db_payment
+    return db_payment, kds_version
 
 # --- Promo Codes ---
 def apply_promo_code(db: Session, code: str, user_id: str): # user_id is not used in current logic
@@ -941,40 +999,32 @@ def delete_promo_code(db: Session, promo_id: int):
     return False
 
 # --- Analytics ---
-def get_order_analytics(db: Session, period: str = "daily"):
-    today = datetime.utcnow().date()
-    if period == "daily":
-        start_date_filter = today
-        end_date_filter = today + timedelta(days=1)
-    elif period == "weekly":
-        start_date_filter = today - timedelta(days=today.weekday())
-        end_date_filter = start_date_filter + timedelta(days=7)
-    elif period == "monthly":
-        start_date_filter = today.replace(day=1)
-        if start_date_filter.month == 12:
-            end_date_filter = start_date_filter.replace(year=start_date_filter.year + 1, month=1)
-        else:
-            end_date_filter = start_date_filter.replace(month=start_date_filter.month + 1)
-    else:
-        raise ValueError("Invalid period for analytics. Choose from 'daily', 'weekly', 'monthly'.")
-
-    order_count = db.query(models.Order).filter(
-        models.Order.created_at >= start_date_filter, models.Order.created_at < end_date_filter
-    ).count()
-    
-    total_sales_query = db.query(func.sum(models.Order.total_cost)).filter(
-        models.Order.created_at >= start_date_filter, models.Order.created_at < end_date_filter
-    )
-    total_sales = total_sales_query.scalar() or 0.0
-    
-    popular_items_query = db.query(
-        models.MenuItem.name, func.sum(models.OrderItem.quantity).label('total_quantity')
-    ).join(models.OrderItem, models.MenuItem.id == models.OrderItem.item_id)\
-     .join(models.Order, models.Order.id == models.OrderItem.order_id)\
-     .filter(models.Order.created_at >= start_date_filter, models.Order.created_at < end_date_filter)\
-     .group_by(models.MenuItem.name)\
-     .order_by(func.sum(models.OrderItem.quantity).desc())\
-     .limit(5).all()
+def get_order_analytics(db: Session, period: str = "daily", restaurant_id: Optional[str] = None, raw: bool = False):
+    """
+    Order analytics for the current day/week/month. With a restaurant_id the figures come from the
+    pre-aggregated sales rollups in the restaurant's timezone (raw=True recomputes them from orders
+    for verification); without one, all restaurants are scanned by UTC day as before.
+    """
+    if restaurant_id:
+        return get_sales_analytics(db, restaurant_id, period=period, raw=raw)
+    start_date_filter, end_date_filter = analytics_window(period, datetime.utcnow().date())
+
+    # The archive only overlaps the current period if ORDER_ARCHIVE_AFTER_DAYS is shorter than it
+    order_count, total_sales, quantities = 0, 0.0, {}
+    for tables in (HOT_ORDER_TABLES, ARCHIVED_ORDER_TABLES) if reaches_archive(db, datetime.combine(start_date_filter, datetime.min.time())) else (HOT_ORDER_TABLES,):
+        order, line = tables.order, tables.item
+        in_period = (order.created_at >= start_date_filter, order.created_at < end_date_filter)
+        order_count += db.query(order).filter(*in_period).count()
+        total_sales += db.query(func.sum(order.total_cost)).filter(*in_period).scalar() or 0.0
+        popular_items_query = db.query(
+            models.MenuItem.name, func.sum(line.quantity).label('total_quantity')
+        ).join(line, models.MenuItem.id == line.item_id)\
+         .join(order, order.id == line.order_id)\
+         .filter(*in_period)\
+         .group_by(models.MenuItem.name).all() # One row per menu item; top 5 taken after merging both tables
+        for name, qty in popular_items_query:
+            quantities[name] = quantities.get(name, 0) + qty
+    popular_items = sorted(quantities.items(), key=lambda entry: entry[1], reverse=True)[:5]
 
     return {
         "period": period,
@@ -982,7 +1032,7 @@ def get_order_analytics(db: Session, period: str = "daily"):
         "end_date": end_date_filter.isoformat(),
         "order_count": order_count,
         "total_sales": total_sales,
-        "popular_items": [{"name": name, "quantity": qty} for name, qty in popular_items_query]
+        "popular_items": [{"name": name, "quantity": qty} for name, qty in popular_items]
     }
 
 def export_orders_csv(db: Session, orders: List[models.Order]):
@@ -1004,94 +1054,159 @@ def export_orders_csv(db: Session, orders: List[models.Order]):
         ])
     return output.getvalue()
 
+ORDER_EXPORT_COLUMNS = [
+    "Order ID", "User UID", "User Role", "Table Number", 
+    "Restaurant ID", "Restaurant Name", "Created At (UTC)", "Status", 
+    "Total Cost", "Payment Status"
+]
+ORDER_EXPORT_ITEM_COLUMNS = ["Item ID", "Item Name", "Quantity", "Unit Price"]
+ORDER_EXPORT_FETCH_SIZE = 1000 # Rows pulled from the cursor and encoded per chunk
+
+def iter_orders_csv(db: Session, include_items: bool = False, compress: bool = False, **filters) -> Iterator[bytes]:
+    """
+    Streams the orders matching `filters` (same keywords as filter_orders) as CSV bytes.
+    Runs a column-only query with yield_per, which uses a server-side cursor where the driver
+    supports it (psycopg2), and encodes each batch as it is fetched, so memory stays flat however
+    many rows are exported. With include_items there is one row per order line. With compress
+    the chunks form a single gzip stream. When the range reaches the archive, the hot and archived
+    streams are merged in created_at order.
+    """
+    def export_rows(tables: OrderTables) -> Iterator:
+        order, line = tables.order, tables.item
+        columns = [
+            order.id, order.user_uid, order.user_role, order.table_number,
+            order.restaurant_id, order.restaurant_name, order.created_at,
+            order.status, order.total_cost, order.payment_status
+        ]
+        query = _filtered_orders_query(db, tables=tables, **filters)
+        if include_items:
+            query = query.outerjoin(line, line.order_id == order.id)\
+                .outerjoin(models.MenuItem, models.MenuItem.id == line.item_id)\
+                .with_entities(*columns, line.item_id, models.MenuItem.name, line.quantity, line.price)\
+                .order_by(order.created_at.desc(), order.id.desc(), line.id)
+        else:
+            query = query.with_entities(*columns).order_by(order.created_at.desc(), order.id.desc())
+        return db.execute(query.statement, execution_options={"yield_per": ORDER_EXPORT_FETCH_SIZE})
+
+    rows = export_rows(HOT_ORDER_TABLES)
+    if reaches_archive(db, filters.get("start_date")):
+        rows = heapq.merge(rows, export_rows(ARCHIVED_ORDER_TABLES), key=lambda row: (row[6] or datetime.min, row[0]), reverse=True)
+
+    encoder = zlib.compressobj(wbits=31) if compress else None # wbits=31 -> gzip container
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def drain() -> bytes:
+        chunk = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+        return encoder.compress(chunk) if encoder else chunk
+
+    writer.writerow(ORDER_EXPORT_COLUMNS + (ORDER_EXPORT_ITEM_COLUMNS if include_items else []))
+    for n, row in enumerate(rows, 1):
+        row = list(row)
+        row[6] = row[6].isoformat() if row[6] else None # created_at
+        writer.writerow(row)
+        if n % ORDER_EXPORT_FETCH_SIZE == 0:
+            chunk = drain()
+            if chunk:
+                yield chunk
+    chunk = drain()
+    if encoder:
+        chunk += encoder.flush()
+    if chunk:
+        yield chunk
+
 # --- Order --- (get_unpaid_order_by_table, add_items_to_order)
 
 def get_unpaid_order_by_table(db: Session, restaurant_id: str, table_number: str) -> Optional[models.Order]:
-    if not table_number: 
-        return None
-    return db.query(models.Order).options(
-        selectinload(models.Order.items).options(selectinload(models.OrderItem.item)) 
-    ).filter(
-        models.Order.restaurant_id == restaurant_id,
-        models.Order.table_number == table_number,
-        models.Order.payment_status == "Pending"
-    ).first()
-
-def add_items_to_order(db: Session, existing_order: models.Order, new_items_create: List[schemas.OrderItemCreate], user_uid: str) -> Tuple[models.Order, List[models.OrderItem]]:
-    if not new_items_create:
-        raise ValueError("Must provide items to add.")
+    # Primary-key lookup through open_table_orders; items load lazily, only if the caller appends
+    return get_open_table_order(db, restaurant_id, table_number)
 
-    affected_item_models: List[models.OrderItem] = []
+def add_items_to_order(db: Session, existing_order: models.Order, new_items_create: List[schemas.OrderItemCreate], user_uid: str) -> Tuple[models.Order, List[models.OrderItem], int]:
+    """
+    Appends lines to an open order with a fixed number of statements, however many lines the order
+    or the request has: menu items are resolved in one query, quantities are merged into the
+    existing lines through a dict keyed by menu item, total_cost is moved by the delta of the new
+    lines only, and the order is re-fetched once, eagerly, for the response.
 
-    for item_to_add in new_items_create: 
-        menu_item_db = db.query(models.MenuItem).filter(
-            models.MenuItem.id == item_to_add.item_id,
-            models.MenuItem.available == True,
-            models.MenuItem.restaurant_id == existing_order.restaurant_id
-        ).first()
+    Returns the re-fetched order, its lines that were created or increased and the KDS version
+    the change is published at.
+    """
+    if not new_items_create:
+        raise ValueError("Must provide items to add.")
 
-        if not menu_item_db:
-            raise ValueError(f"Menu item with ID {item_to_add.item_id} for restaurant {existing_order.restaurant_id} not found or unavailable.")
-        
+    quantities: Dict[int, int] = {} # menu item id -> quantity to add; repeated ids in one request are merged
+    for item_to_add in new_items_create:
         if item_to_add.quantity <= 0:
             raise ValueError(f"Quantity for item ID {item_to_add.item_id} must be positive.")
+        quantities[item_to_add.item_id] = quantities.get(item_to_add.item_id, 0) + item_to_add.quantity
+
+    order_id, restaurant_id = existing_order.id, existing_order.restaurant_id
+    menu_items_by_id = _get_available_menu_items_by_id(db, restaurant_id, quantities)
+    for item_id in quantities:
+        if item_id not in menu_items_by_id:
+            raise ValueError(f"Menu item with ID {item_id} for restaurant {restaurant_id} not found or unavailable.")
+
+    # Existing lines for these menu items only; a line keeps the price it was first ordered at
+    existing_lines: Dict[int, Tuple[int, float]] = {}
+    for line_id, item_id, price in db.query(models.OrderItem.id, models.OrderItem.item_id, models.OrderItem.price).filter(
+        models.OrderItem.order_id == order_id,
+        models.OrderItem.item_id.in_(list(quantities))
+    ).order_by(models.OrderItem.id):
+        existing_lines.setdefault(item_id, (line_id, price))
+
+    increments, new_lines = [], []
+    total_delta = 0.0
+    for item_id, quantity in quantities.items():
+        if item_id in existing_lines:
+            line_id, price = existing_lines[item_id]
+            increments.append({"line_id": line_id, "added": quantity})
+        else:
+            price = menu_items_by_id[item_id].price
+            new_lines.append({"order_id": order_id, "item_id": item_id, "quantity": quantity, "price": price})
+        total_delta += price * quantity
 
-        deduct_inventory_for_sale(
+    order_items = models.OrderItem.__table__
+    try:
+        deduct_inventory_for_sale_bulk(
             db=db,
-            restaurant_id=existing_order.restaurant_id,
-            menu_item_id=menu_item_db.id, 
-            quantity_sold=float(item_to_add.quantity), 
-            order_id=existing_order.id,
-            changed_by_user_id=user_uid 
+            restaurant_id=restaurant_id,
+            quantities_sold=expand_combo_quantities(
+                menu_items_by_id.values(), {item_id: float(quantity) for item_id, quantity in quantities.items()}
+            ),
+            order_id=order_id,
+            changed_by_user_id=user_uid
         )
-
-        item_model_in_order = None
-        for current_item_in_order in existing_order.items: 
-            if current_item_in_order.item_id == item_to_add.item_id:
-                item_model_in_order = current_item_in_order
-                break
-        
-        if item_model_in_order:
-            item_model_in_order.quantity += item_to_add.quantity
-            affected_item_models.append(item_model_in_order)
-        else:
-            new_order_item_model = models.OrderItem(
-                order_id=existing_order.id, 
-                item_id=menu_item_db.id,
-                quantity=item_to_add.quantity,
-                price=menu_item_db.price 
-            )
-            db.add(new_order_item_model) 
-            # existing_order.items.append(new_order_item_model) # SQLAlchemy handles relationship append upon commit if configured
-            affected_item_models.append(new_order_item_model)
-            
-    recalculated_total_cost = sum(item.price * item.quantity for item in existing_order.items)
-        
-    existing_order.total_cost = recalculated_total_cost
-    existing_order.updated_at = datetime.utcnow()
-    
-    try:
+        if increments:
+            db.execute(order_items.update().where(order_items.c.id == bindparam("line_id")).values(
+                quantity=order_items.c.quantity + bindparam("added")
+            ), increments)
+        if new_lines:
+            db.bulk_insert_mappings(models.OrderItem, new_lines)
+        db.execute(update(models.Order).where(models.Order.id == order_id).values(
+            total_cost=models.Order.total_cost + total_delta,
+            updated_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False))
+        kds_version = bump_kds_version(db, restaurant_id)
         db.commit()
-        db.refresh(existing_order)
-
-        refreshed_affected_items_for_return: List[models.OrderItem] = []
-        for affected_model_item in affected_item_models:
-            db.refresh(affected_model_item)
-            # Eagerly load .item and item.category as per original code's intention for the return
-            if not hasattr(affected_model_item, 'item') or not affected_model_item.item :
-                 db.refresh(affected_model_item, attribute_names=['item'])
-            if hasattr(affected_model_item, 'item') and affected_model_item.item and \
-               (not hasattr(affected_model_item.item, 'category') or not affected_model_item.item.category):
-                 db.refresh(affected_model_item.item, attribute_names=['category'])
-            refreshed_affected_items_for_return.append(affected_model_item)
-
     except IntegrityError as e:
         db.rollback()
-        logger.error(f"IntegrityError adding items to order {existing_order.id}: {e}")
+        logger.error(f"IntegrityError adding items to order {order_id}: {e}")
         raise ValueError(f"Could not add items due to a database conflict: {e}")
     except Exception as e:
         db.rollback()
-        logger.error(f"Error adding items to order {existing_order.id}: {e}", exc_info=True)
+        logger.error(f"Error adding items to order {order_id}: {e}", exc_info=True)
         raise Exception(f"An unexpected error occurred while adding items: {str(e)}")
-        
-    return existing_order, refreshed_affected_items_for_return 
\ No newline at end of file
+
+    updated_order = db.query(models.Order).options(
+        selectinload(models.Order.items).selectinload(models.OrderItem.item).options(*menu_item_out_options()),
+        selectinload(models.Order.payment),
+        selectinload(models.Order.status_history)
+    ).populate_existing().filter(models.Order.id == order_id).one()
+    affected_line_ids = {line_id for line_id, _ in existing_lines.values()}
+    affected_items = [
+        line for line in updated_order.items
+        if line.id in affected_line_ids or (line.item_id in quantities and line.item_id not in existing_lines)
+    ]
+    return updated_order, affected_items, kds_version
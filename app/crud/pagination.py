@@ -0,0 +1,66 @@
+from sqlalchemy.orm import Query
+from sqlalchemy import and_, or_
+from typing import List, Optional, Tuple
+from datetime import datetime
+import base64
+import json
+
+from .. import models
+
+DEFAULT_ORDER_PAGE_SIZE = 100
+MAX_ORDER_PAGE_SIZE = 500
+
+def encode_order_cursor(created_at: Optional[datetime], order_id: str) -> str:
+    """Encodes the (created_at, id) position of an order as an opaque URL-safe cursor."""
+    payload = json.dumps({"c": created_at.isoformat() if created_at is not None else None, "i": order_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_order_cursor(cursor: str) -> Tuple[Optional[datetime], str]:
+    """Inverse of encode_order_cursor. Raises ValueError for malformed cursors."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(payload["c"]) if payload["c"] is not None else None), str(payload["i"])
+    except Exception:
+        raise ValueError("Invalid pagination cursor.")
+
+def clamp_order_page_size(limit: Optional[int]) -> int:
+    if not limit or limit < 1:
+        return DEFAULT_ORDER_PAGE_SIZE
+    return min(limit, MAX_ORDER_PAGE_SIZE)
+
+def apply_order_keyset(query: Query, cursor: Optional[Tuple[Optional[datetime], str]], limit: int, model=models.Order) -> Query:
+    """
+    Orders newest first with id as the tie-breaker, resumes strictly after `cursor`, and fetches
+    one extra row so the caller can tell whether another page exists. `model` is the order table
+    queried (models.ArchivedOrder for the archive).
+
+    Orders without a created_at (legacy rows) are left out here, so the ordering stays the one
+    the (restaurant_id, created_at, id) index gives on every dialect; they come after all dated
+    orders, through apply_undated_order_keyset. A cursor positioned among them pages through them.
+    """
+    if cursor and cursor[0] is None:
+        return apply_undated_order_keyset(query, cursor, limit, model)
+    query = query.filter(model.created_at.isnot(None))
+    if cursor:
+        created_at, order_id = cursor
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < order_id)
+        ))
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+
+def apply_undated_order_keyset(query: Query, cursor: Optional[Tuple[Optional[datetime], str]], limit: int, model=models.Order) -> Query:
+    """The orders without a created_at, by id descending, after `cursor` if it is one of them; one extra row as above."""
+    query = query.filter(model.created_at.is_(None))
+    if cursor and cursor[0] is None:
+        query = query.filter(model.id < cursor[1])
+    return query.order_by(model.id.desc()).limit(limit + 1)
+
+def split_order_page(orders: List[models.Order], limit: int) -> Tuple[List[models.Order], Optional[str]]:
+    """Trims the look-ahead row fetched by apply_order_keyset and returns the cursor for the next page."""
+    if len(orders) <= limit:
+        return orders, None
+    page = orders[:limit]
+    last = page[-1]
+    return page, encode_order_cursor(last.created_at, last.id)
@@ -1,5 +1,7 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 import logging
 from pathlib import Path
@@ -111,3 +113,46 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Async mode: the order lifecycle endpoints use an AsyncSession on an async driver (aiosqlite or
+# asyncpg) so their SQL no longer blocks the event loop. Off by default.
+USE_ASYNC_DB = os.getenv("USE_ASYNC_DB", "false").lower() in ("1", "true", "yes")
+
+def async_database_url(url: str) -> str:
+    """Maps a sync database URL to the matching async driver."""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql+pg8000://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+def async_engine_options(url: str) -> dict:
+    if url.startswith("sqlite+aiosqlite:") and ":memory:" not in url and url != "sqlite+aiosqlite://":
+        # SQLite has a single writer: queue requests for one pooled connection instead of opening a
+        # connection per checkout (aiosqlite's default) that then waits out "database is locked".
+        return {"poolclass": AsyncAdaptedQueuePool, "pool_size": 1, "max_overflow": 0}
+    return {}
+
+# Created on first use, so the async drivers are only needed when async mode is used
+async_engine: AsyncEngine = None
+AsyncSessionLocal: async_sessionmaker = None
+
+def get_async_sessionmaker() -> async_sessionmaker:
+    global async_engine, AsyncSessionLocal
+    if AsyncSessionLocal is None:
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, **async_engine_options(ASYNC_DATABASE_URL))
+        # Keep attributes loaded after commit: an AsyncSession cannot refresh them on access
+        AsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine)
+        logger.info(f"Async database sessions enabled ({async_engine.dialect.name}+{async_engine.dialect.driver})")
+    return AsyncSessionLocal
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+async def dispose_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
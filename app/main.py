@@ -1,12 +1,20 @@
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.endpoints import auth, otp, restaurants, loyalty, rewards, referrals, spin, analytics, dashboard, admin, ordering, employees, coupons
-from app.api.endpoints import inventory
+from app.api.endpoints import inventory, diagnostics
 from app.utils.bhashsms_instance import bhashsms
+from app.utils.receipts import receipt_renderer
+from app.utils.event_bus import event_bus
+from app.utils.idempotency import idempotency
+from app.utils.loop_monitor import loop_monitor, LoopMonitorMiddleware
+from app.utils.order_archiver import order_archiver
+from app.utils.menu_cache import menu_cache
+from app.utils.menu_search import menu_search
+from app.utils.menu_import_jobs import menu_import_runner
 import logging
 import os
 from sqlalchemy import text
-from app.database import get_db, engine, Base
+from app.database import get_db, engine, Base, dispose_async_engine
 
 # Configure logging
 logging.basicConfig(
@@ -36,6 +44,10 @@ app.add_middleware(
     max_age=3600,  # Cache preflight requests for 1 hour
 )
 
+# Attribute event loop stalls to the route being served (LOOP_MONITOR_ENABLED)
+if loop_monitor.enabled:
+    app.add_middleware(LoopMonitorMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(otp.router, prefix="/api/otp", tags=["otp"])
@@ -51,6 +63,7 @@ app.include_router(ordering.router, tags=["ordering"])
 app.include_router(employees.router, prefix="/api", tags=["employees"])
 app.include_router(coupons.router, prefix="/api/coupons", tags=["coupons"])
 app.include_router(inventory.router, prefix="/api", tags=["inventory"])
+app.include_router(diagnostics.router, prefix="/api/diagnostics", tags=["diagnostics"])
 
 @app.get("/")
 async def read_root():
@@ -100,10 +113,32 @@ async def startup_event():
     
     logger.info(f"Database connection established (models imported, create_all skipped)")
 
+    try:
+        await event_bus.start()
+        logger.info(f"KDS event bus started ({type(event_bus).__name__})")
+    except Exception as e:
+        logger.error(f"KDS event bus failed to start; events will only reach this worker's screens: {e}")
+
+    idempotency.start_purger()
+    order_archiver.start()
+    loop_monitor.start()
+    menu_cache.start()
+    menu_search.start()
+    menu_import_runner.start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup resources on shutdown"""
     logger.info("Shutting down Loyalty Backend API")
+    receipt_renderer.shutdown()
+    await event_bus.stop()
+    await idempotency.stop_purger()
+    await order_archiver.stop()
+    await loop_monitor.stop()
+    await menu_cache.stop()
+    await menu_search.stop()
+    await menu_import_runner.stop()
+    await dispose_async_engine()
     try:
         if hasattr(bhashsms, 'driver') and bhashsms.driver:
             bhashsms.driver.quit()
@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, JSON, UniqueConstraint, Enum as SQLAlchemyEnum
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, JSON, LargeBinary, UniqueConstraint, Index, Enum as SQLAlchemyEnum, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
 import datetime
+import uuid
 
 # Table to store OTP-verified phone numbers in normalized 10-digit format
 class VerifiedPhoneNumber(Base):
@@ -132,6 +133,9 @@ class ClaimedReward(Base):
     coupon_code = Column(String, unique=True, nullable=True)  # New field
     user = relationship("User", back_populates="claimed_rewards")
 
+    # Daily redemption count in redeem_coupon
+    __table_args__ = (Index('ix_claimed_rewards_uid_restaurant_redeemed_at', 'uid', 'restaurant_id', 'redeemed_at'),)
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
     id = Column(Integer, primary_key=True, index=True)
@@ -139,7 +143,7 @@ class AuditLog(Base):
     action = Column(String)
     details = Column(JSON)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
-    order_id = Column(String, ForeignKey("orders.id"), nullable=True)
+    order_id = Column(String, nullable=True, index=True)  # No FK, so closed orders can be archived (see crud_archive)
     user = relationship("User", back_populates="audit_logs")
 
 # --- Online Ordering System Models ---
@@ -179,6 +183,15 @@ class MenuItem(Base):
                               back_populates="combo_item", 
                               cascade="all, delete-orphan",
                               lazy="selectin") # Eager load components when a combo item is fetched
+    # If this MenuItem is a combo, the regular items it is made of through nested combos (see ComboExpansion)
+    expansion = relationship("ComboExpansion",
+                             foreign_keys="[ComboExpansion.combo_menu_item_id]",
+                             order_by="ComboExpansion.component_menu_item_id",
+                             viewonly=True,
+                             lazy="selectin")
+
+# Orders a table is still running: new items for that table are appended to it
+OPEN_ORDER_PREDICATE = "payment_status = 'Pending' AND status <> 'Cancelled' AND table_number <> ''"
 
 class Order(Base):
     __tablename__ = "orders"
@@ -195,6 +208,8 @@ class Order(Base):
     restaurant_id = Column(String, nullable=True)
     restaurant_name = Column(String, nullable=True)
     order_number = Column(Integer, nullable=True)  # Store the numeric part separately
+    bill_number = Column(String, nullable=True)  # bill_number_prefix + order_number, for invoices
+    client_order_id = Column(String, nullable=True)  # UUID a POS gave an order taken offline (see crud_ingest)
     
     items = relationship("OrderItem", back_populates="order")
     user = relationship("User", foreign_keys=[user_uid]) # Staff/system user creating/handling order
@@ -202,10 +217,78 @@ class Order(Base):
     payment = relationship("Payment", uselist=False, back_populates="order")
     status_history = relationship("OrderStatusHistory", back_populates="order", order_by="desc(OrderStatusHistory.changed_at)")
 
+
+    __table_args__ = (
+        Index('ix_orders_restaurant_table_payment_status', 'restaurant_id', 'table_number', 'payment_status'), # Orders by table
+        Index('ix_orders_restaurant_created_at_id', 'restaurant_id', 'created_at', 'id'), # Listings, keyset pagination
+        Index('ix_orders_updated_at', 'updated_at'), # Closed orders due for archiving
+        Index('uq_orders_restaurant_client_order_id', 'restaurant_id', 'client_order_id', unique=True), # Offline uploads are idempotent
+        # At most one open order per table; must match crud_open_tables.is_open_order
+        Index('uq_orders_open_table', 'restaurant_id', 'table_number', unique=True,
+              postgresql_where=text(OPEN_ORDER_PREDICATE), sqlite_where=text(OPEN_ORDER_PREDICATE)),
+    )
+
+class OpenTableOrder(Base):
+    __tablename__ = "open_table_orders"
+    # The open (unpaid, not cancelled) order of each table, kept in sync by crud_open_tables
+    restaurant_id = Column(String, primary_key=True)
+    table_number = Column(String, primary_key=True)
+    order_id = Column(String, ForeignKey("orders.id"), nullable=False, unique=True)
+    opened_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class OrderNumberSequence(Base):
+    __tablename__ = "order_number_sequences"
+    # One counter row per restaurant; incremented atomically to hand out order numbers
+    restaurant_id = Column(String, primary_key=True)  # Matches Order.restaurant_id (no FK)
+    last_value = Column(Integer, nullable=False, default=0)  # Highest order number handed out so far
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class KDSVersion(Base):
+    __tablename__ = "kds_versions"
+    # One counter row per restaurant, bumped by every order lifecycle change (see crud_kds)
+    restaurant_id = Column(String, primary_key=True)  # Matches Order.restaurant_id (no FK)
+    version = Column(Integer, nullable=False, default=0)  # Version of the latest change to the restaurant's orders
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class MenuVersion(Base):
+    __tablename__ = "menu_versions"
+    # One counter row per restaurant, bumped by every write to its menu (see crud_menu)
+    restaurant_id = Column(String, primary_key=True)  # Matches MenuItem.restaurant_id (no FK)
+    version = Column(Integer, nullable=False, default=0)  # Version of the latest change to the restaurant's menu
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class MenuSnapshot(Base):
+    __tablename__ = "menu_snapshots"
+    # A restaurant's public menu responses, compiled by every menu write (see crud_menu)
+    restaurant_id = Column(String, primary_key=True)  # Matches MenuItem.restaurant_id (no FK)
+    version = Column(Integer, nullable=False)  # menu_versions.version the bodies were compiled at
+    items = Column(LargeBinary, nullable=False)  # GET /menu body, UTF-8 JSON
+    categories = Column(LargeBinary, nullable=False)  # GET /menu/categories body, UTF-8 JSON
+    built_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class MenuImportJob(Base):
+    __tablename__ = "menu_import_jobs"
+    # A menu sheet imported in the background, chunk by chunk (see crud_menu_import and utils/menu_import_jobs)
+    id = Column(String, primary_key=True, default=lambda: uuid.uuid4().hex)
+    restaurant_id = Column(String, ForeignKey("restaurants.restaurant_id"), nullable=False, index=True)
+    created_by = Column(String, nullable=False)  # UID of the admin who uploaded the file
+    filename = Column(String, nullable=True)
+    status = Column(String(20), nullable=False, default="queued")  # "queued", "running", "completed" or "failed"
+    total_rows = Column(Integer, nullable=True)  # Data rows in the file, once counted
+    processed_rows = Column(Integer, nullable=False, default=0)
+    created_items = Column(Integer, nullable=False, default=0)
+    error_count = Column(Integer, nullable=False, default=0)
+    errors = Column(JSON, default=list)  # [{"row": n, "error": "..."}], the first MENU_IMPORT_MAX_STORED_ERRORS of them
+    message = Column(String, nullable=True)  # Final summary, or why the job failed
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
 class OrderStatusHistory(Base):
     __tablename__ = "order_status_history"
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(String, ForeignKey("orders.id"), nullable=False)
+    order_id = Column(String, ForeignKey("orders.id"), nullable=False, index=True)
     status = Column(String, nullable=False)
     changed_at = Column(DateTime, default=datetime.datetime.utcnow)
     changed_by = Column(String, nullable=False)  # UID of the user who changed the status
@@ -215,7 +298,7 @@ class OrderStatusHistory(Base):
 class OrderItem(Base):
     __tablename__ = "order_items"
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(String, ForeignKey("orders.id"))
+    order_id = Column(String, ForeignKey("orders.id"), index=True)
     item_id = Column(Integer, ForeignKey("menu_items.id"))
     quantity = Column(Integer, default=1)
     price = Column(Float, nullable=False)  # Store price at time of order
@@ -224,10 +307,48 @@ class OrderItem(Base):
     order = relationship("Order", back_populates="items")
     item = relationship("MenuItem")
 
+class SalesRollup(Base):
+    __tablename__ = "sales_rollups"
+    # Pre-aggregated sales per restaurant and local hour/day, kept current by crud_rollups
+    restaurant_id = Column(String, primary_key=True)  # Matches Order.restaurant_id (no FK)
+    granularity = Column(String, primary_key=True)  # "hour" or "day"
+    bucket_start = Column(DateTime, primary_key=True)  # Naive, in the restaurant's local timezone
+    placed_count = Column(Integer, nullable=False, default=0)  # Every order created, whatever its status
+    order_count = Column(Integer, nullable=False, default=0)  # Paid orders (refunded ones included)
+    gross_sales = Column(Float, nullable=False, default=0.0)
+    refunded_count = Column(Integer, nullable=False, default=0)
+    refunded_sales = Column(Float, nullable=False, default=0.0)
+    cancelled_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class ItemSalesRollup(Base):
+    __tablename__ = "item_sales_rollups"
+    # Quantities sold per menu item in the same buckets as SalesRollup (refunded orders excluded)
+    restaurant_id = Column(String, primary_key=True)
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    menu_item_id = Column(Integer, primary_key=True)  # No FK, so deleted menu items keep their history
+    quantity = Column(Integer, nullable=False, default=0)
+    sales = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    # Client-supplied Idempotency-Key per user, with the response it produced (see crud_idempotency)
+    user_uid = Column(String, primary_key=True)  # No FK, so keys can be purged independently of users
+    key = Column(String(255), primary_key=True)
+    request_fingerprint = Column(String(64), nullable=False)  # sha256 of method, path and body
+    status = Column(String(20), nullable=False, default="in_progress")  # "in_progress" or "completed"
+    response_status = Column(Integer, nullable=True)
+    response_body = Column(String, nullable=True)  # JSON body replayed to retries
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    locked_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)  # When the current owner claimed it
+    expires_at = Column(DateTime, nullable=False, index=True)
+
 class Payment(Base):
     __tablename__ = "payments"
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(String, ForeignKey("orders.id"), nullable=False)
+    order_id = Column(String, ForeignKey("orders.id"), nullable=False, index=True)
     amount = Column(Float, nullable=False)
     method = Column(String, nullable=False)  # "Cash", "Card", "UPI", etc.
     status = Column(String, default="Pending")
@@ -237,6 +358,77 @@ class Payment(Base):
     
     order = relationship("Order", back_populates="payment")
 
+# --- Order archive ---
+# Orders closed (paid, cancelled or refunded) for ORDER_ARCHIVE_AFTER_DAYS are moved here in
+# batches by crud_archive.archive_closed_orders. Same columns and relationship names as the hot
+# tables, so OrderOut serializes both; list, filter and export queries only read these tables when
+# they reach back past the newest archived order. Archived orders are read-only.
+
+class ArchivedOrder(Base):
+    __tablename__ = "archived_orders"
+    id = Column(String, primary_key=True)
+    user_uid = Column(String, ForeignKey("users.uid"), nullable=False)
+    customer_uid = Column(String, ForeignKey("users.uid"), nullable=True, index=True)
+    user_role = Column(String, nullable=True)
+    table_number = Column(String, nullable=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    status = Column(String)
+    total_cost = Column(Float, nullable=False)
+    payment_status = Column(String)
+    restaurant_id = Column(String, nullable=True)
+    restaurant_name = Column(String, nullable=True)
+    order_number = Column(Integer, nullable=True)
+    bill_number = Column(String, nullable=True)
+    client_order_id = Column(String, nullable=True)
+
+    items = relationship("ArchivedOrderItem", back_populates="order")
+    user = relationship("User", foreign_keys=[user_uid])
+    customer_detail = relationship("User", foreign_keys=[customer_uid])
+    payment = relationship("ArchivedPayment", uselist=False, back_populates="order")
+    status_history = relationship("ArchivedOrderStatusHistory", back_populates="order", order_by="desc(ArchivedOrderStatusHistory.changed_at)")
+
+    __table_args__ = (
+        Index('ix_archived_orders_restaurant_created_at_id', 'restaurant_id', 'created_at', 'id'), # Listings, keyset pagination
+        Index('ix_archived_orders_created_at_id', 'created_at', 'id'), # Archive watermark, unscoped listings
+        Index('ix_archived_orders_restaurant_client_order_id', 'restaurant_id', 'client_order_id'), # Re-uploads of archived offline orders
+    )
+
+class ArchivedOrderStatusHistory(Base):
+    __tablename__ = "archived_order_status_history"
+    id = Column(Integer, primary_key=True)
+    order_id = Column(String, ForeignKey("archived_orders.id"), nullable=False, index=True)
+    status = Column(String, nullable=False)
+    changed_at = Column(DateTime)
+    changed_by = Column(String, nullable=False)
+
+    order = relationship("ArchivedOrder", back_populates="status_history")
+
+class ArchivedOrderItem(Base):
+    __tablename__ = "archived_order_items"
+    id = Column(Integer, primary_key=True)
+    order_id = Column(String, ForeignKey("archived_orders.id"), index=True)
+    item_id = Column(Integer, ForeignKey("menu_items.id"))
+    quantity = Column(Integer)
+    price = Column(Float, nullable=False)
+    options = Column(JSON, nullable=True)
+
+    order = relationship("ArchivedOrder", back_populates="items")
+    item = relationship("MenuItem")
+
+class ArchivedPayment(Base):
+    __tablename__ = "archived_payments"
+    id = Column(Integer, primary_key=True)
+    order_id = Column(String, ForeignKey("archived_orders.id"), nullable=False, index=True)
+    amount = Column(Float, nullable=False)
+    method = Column(String, nullable=False)
+    status = Column(String)
+    processed_at = Column(DateTime)
+    paid_at = Column(DateTime, nullable=True)
+    transaction_id = Column(String, nullable=True)
+
+    order = relationship("ArchivedOrder", back_populates="payment")
+
 class PromoCode(Base):
     __tablename__ = "promo_codes"
     id = Column(Integer, primary_key=True, index=True)
@@ -387,5 +579,14 @@ class ComboItemComponent(Base):
 
     __table_args__ = (UniqueConstraint('combo_menu_item_id', 'component_menu_item_id', name='_combo_component_uc'),)
 
+class ComboExpansion(Base):
+    __tablename__ = "combo_expansions"
+    # Each combo's components flattened through nested combos with their total quantities, rebuilt
+    # per restaurant by the menu writes that change combos (see crud_menu.rebuild_combo_expansions)
+    combo_menu_item_id = Column(Integer, ForeignKey("menu_items.id", ondelete="CASCADE"), primary_key=True)
+    component_menu_item_id = Column(Integer, ForeignKey("menu_items.id", ondelete="CASCADE"), primary_key=True)  # Never a combo
+    restaurant_id = Column(String, nullable=False, index=True)  # The combo's restaurant
+    quantity = Column(Integer, nullable=False)  # Units of the component in one combo
+
 # Make sure all models are defined before any potential Base.metadata.create_all calls
 # (though we rely on Alembic, so this is mostly for linters/type checkers)
@@ -2,6 +2,7 @@ from pydantic import BaseModel, EmailStr, validator
 from typing import List, Optional, Dict, Any, ForwardRef
 from datetime import datetime
 import enum
+import uuid
 
 class UserBase(BaseModel):
     email: EmailStr
@@ -221,6 +222,13 @@ class ComboComponentItemOutSchema(BaseModel):
     class Config:
         from_attributes = True
 
+class ComboExpansionOut(BaseModel):
+    component_menu_item_id: int # A regular item the combo is made of, through nested combos
+    quantity: int # Units of it in one combo
+
+    class Config:
+        from_attributes = True
+
 class MenuItemBase(BaseModel):
     restaurant_id: str
     name: str
@@ -274,6 +282,8 @@ class MenuItemOut(MenuItemBase):
     category: Optional[MenuCategoryOut] # This was already here
     # If item_type is COMBO, components should be populated from the DB relation
     components: Optional[List[ComboComponentItemOutSchema]] = None 
+    # The regular items a combo is made of, flattened through nested combos; empty for regular items
+    expansion: Optional[List[ComboExpansionOut]] = None
     
     class Config:
         from_attributes = True
@@ -307,6 +317,7 @@ class OrderBase(BaseModel):
     payment_status: Optional[str] = "Pending"
     promo_code_id: Optional[int] = None
     order_number: Optional[int] = None
+    bill_number: Optional[str] = None
 
 class OrderCreate(BaseModel):
     restaurant_id: str
@@ -325,6 +336,7 @@ class OrderStatusHistoryOut(BaseModel):
 class OrderOut(BaseModel):
     id: str
     order_number: int
+    bill_number: Optional[str] = None
     user_uid: str
     customer_uid: Optional[str] = None
     user_role: Optional[str] = None
@@ -343,6 +355,16 @@ class OrderOut(BaseModel):
     class Config:
         from_attributes = True
 
+class OrderSummaryOut(BaseModel):
+    # Column-only projection served by the order list endpoints with view=summary
+    id: str
+    order_number: Optional[int] = None
+    table_number: Optional[str] = None
+    status: Optional[str] = None
+    payment_status: Optional[str] = None
+    total_cost: float
+    created_at: Optional[datetime] = None
+
 # Ensure PaymentOut is defined before OrderOut uses it or use ForwardRef if defined later
 _PaymentOut = ForwardRef('PaymentOut')
 
@@ -351,6 +373,69 @@ class OrderMarkPaidRequest(BaseModel):
     transaction_id: Optional[str] = None # For Card/UPI payments
     customer_uid: Optional[str] = None
 
+class OrderBulkStatusUpdate(BaseModel):
+    order_ids: List[str]
+    status: str  # Target status, e.g. "Order Confirmed"
+
+class OrderStatusChangeResult(BaseModel):
+    order_id: str
+    result: str  # "updated", "unchanged", "invalid_transition", "not_found" or "conflict"
+    previous_status: Optional[str] = None
+    status: Optional[str] = None
+    detail: Optional[str] = None
+
+class OrderBulkStatusResult(BaseModel):
+    updated: int
+    results: List[OrderStatusChangeResult]
+
+class MenuImportRowError(BaseModel):
+    row: int  # Row of the sheet, counting the header as row 1
+    error: str
+
+class MenuImportJobOut(BaseModel):
+    id: str
+    restaurant_id: str
+    filename: Optional[str] = None
+    status: str  # "queued", "running", "completed" or "failed"
+    total_rows: Optional[int] = None
+    processed_rows: int
+    created_items: int
+    error_count: int  # All row errors; `errors` lists the first MENU_IMPORT_MAX_STORED_ERRORS
+    errors: List[MenuImportRowError] = []
+    message: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
+class OfflineOrderPayment(BaseModel):
+    method: str
+    transaction_id: Optional[str] = None
+    paid_at: Optional[datetime] = None  # Defaults to the order's created_at
+
+class OfflineOrderCreate(BaseModel):
+    client_order_id: uuid.UUID  # Assigned by the POS; uploading the same order again is a no-op
+    table_number: Optional[str] = None
+    created_at: Optional[datetime] = None  # When the POS took the order; defaults to the upload time
+    status: str = "Pending"  # "Pending", "Order Confirmed", "Payment Done" (with payment) or "Cancelled"
+    items: List[OrderItemCreate]
+    payment: Optional[OfflineOrderPayment] = None
+
+class OfflineOrderBatch(BaseModel):
+    orders: List[OfflineOrderCreate]
+
+class OfflineOrderResult(BaseModel):
+    client_order_id: str
+    result: str  # "created", "already_ingested", "duplicate" (repeated in this batch) or "rejected"
+    order_id: Optional[str] = None
+    order_number: Optional[int] = None
+    detail: Optional[str] = None
+
+class OfflineOrderBatchResult(BaseModel):
+    ingested: int
+    results: List[OfflineOrderResult]
+
 class PaymentBase(BaseModel):
     amount: float
     status: Optional[str] = "Pending"
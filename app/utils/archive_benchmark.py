@@ -0,0 +1,193 @@
+"""
+Benchmark for the hot/cold order split: hot-path latency as order history grows.
+
+Two databases are grown side by side. Both hold the same recent activity (--hot-orders orders
+from the last 30 days, with lines and payments) and the same history of paid orders closed long
+ago. The "single" layout keeps the history in the orders table, as before archiving; the
+"archived" layout holds it in archived_orders, as archive_closed_orders leaves it. History is
+added in steps (--sizes) and the hot-path calls are timed at each step:
+
+    list       first page of get_all_orders for a restaurant
+    filter 7d  filter_orders for a restaurant, start_date a week ago
+    summaries  first page of get_order_summaries for a restaurant
+    place+pay  create_order followed by mark_order_paid
+    analytics  raw get_order_analytics (weekly, all restaurants)
+    deep page  a get_all_orders page a year back, which has to read the archive
+
+History rows are orders only (no lines), bulk inserted. Finally the archiver itself is timed on
+the single layout: a few bounded batches of archive_closed_orders.
+
+Usage:
+    python -m app.utils.archive_benchmark --sizes 0 100000 1000000
+    python -m app.utils.archive_benchmark --sizes 0 1000000 10000000 --dir /var/tmp
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import crud, models, schemas
+from app.database import Base
+from app.crud.pagination import encode_order_cursor
+
+RESTAURANTS = 20 # History and hot orders are spread over these; the timed calls use the first
+RESTAURANT_ID = "archive-bench-0"
+USER_UID = "archive-bench-user"
+MENU_ITEMS = 10
+INSERT_CHUNK = 50000
+HISTORY_STEP = timedelta(seconds=10) # Gap between consecutive history orders, going back in time
+HISTORY_START_DAYS = 120 # Newest history order; older than ORDER_ARCHIVE_AFTER_DAYS
+LAYOUTS = ("single", "archived")
+
+def seed(engine: Engine, hot_orders: int, now: datetime) -> int:
+    """Schema, restaurants, menu (with stock) and the recent orders; returns the first menu item id."""
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"uid": USER_UID, "email": "archive-bench@example.com", "number": "8000000002", "name": "Bench", "role": "admin"}])
+        conn.execute(models.Restaurant.__table__.insert(), [{
+            "restaurant_id": f"archive-bench-{n}", "restaurant_name": f"Archive Bench {n}", "admin_uid": USER_UID, "owner_uid": USER_UID,
+            "currency": "INR", "timezone": "Asia/Kolkata", "is_open": True, "allow_manual_discount": False,
+            "bill_series_start": 1, "show_tax_breakdown_on_invoice": False, "enable_tips_collection": False
+        } for n in range(RESTAURANTS)])
+        category_id = conn.execute(models.MenuCategory.__table__.insert().values(restaurant_id=RESTAURANT_ID, name="Bench")).inserted_primary_key[0]
+        item_ids = [conn.execute(models.MenuItem.__table__.insert().values(
+            restaurant_id=RESTAURANT_ID, name=f"Bench item {n}", price=10.0 + n, category_id=category_id, available=True, item_type="regular"
+        )).inserted_primary_key[0] for n in range(MENU_ITEMS)]
+        conn.execute(models.InventoryItem.__table__.insert(), [
+            {"restaurant_id": RESTAURANT_ID, "menu_item_id": item_id, "quantity": 1e9, "unit": "pcs"} for item_id in item_ids
+        ])
+        step = timedelta(days=30) / max(1, hot_orders)
+        orders, lines, payments = [], [], []
+        for n in range(hot_orders):
+            created_at = now - n * step
+            order_id = f"hot{n}"
+            orders.append({
+                "id": order_id, "user_uid": USER_UID, "user_role": "admin", "table_number": f"T{n % 30}",
+                "created_at": created_at, "updated_at": created_at, "status": "Payment Done", "total_cost": 20.0,
+                "payment_status": "Paid", "restaurant_id": f"archive-bench-{n % RESTAURANTS}", "order_number": n
+            })
+            lines.append({"order_id": order_id, "item_id": item_ids[n % MENU_ITEMS], "quantity": 2, "price": 10.0})
+            payments.append({"order_id": order_id, "amount": 20.0, "method": "cash", "status": "Completed", "processed_at": created_at, "paid_at": created_at})
+        for table, rows in ((models.Order, orders), (models.OrderItem, lines), (models.Payment, payments)):
+            for offset in range(0, len(rows), INSERT_CHUNK):
+                conn.execute(table.__table__.insert(), rows[offset:offset + INSERT_CHUNK])
+    return item_ids[0]
+
+def add_history(engine: Engine, order_model, start: int, stop: int, now: datetime) -> None:
+    """History orders start..stop-1, newest first, into the orders or archived_orders table."""
+    newest = now - timedelta(days=HISTORY_START_DAYS)
+    with engine.begin() as conn:
+        for offset in range(start, stop, INSERT_CHUNK):
+            rows = []
+            for n in range(offset, min(stop, offset + INSERT_CHUNK)):
+                created_at = newest - n * HISTORY_STEP
+                rows.append({
+                    "id": f"hist{n}", "user_uid": USER_UID, "user_role": "admin", "table_number": f"T{n % 30}",
+                    "created_at": created_at, "updated_at": created_at, "status": "Payment Done", "total_cost": 20.0,
+                    "payment_status": "Paid", "restaurant_id": f"archive-bench-{n % RESTAURANTS}", "order_number": n
+                })
+            conn.execute(order_model.__table__.insert(), rows)
+
+def hot_path_calls(first_item_id: int, now: datetime) -> Dict[str, Callable[[Session, int], object]]:
+    deep_cursor = encode_order_cursor(now - timedelta(days=365), "~")
+    def place_and_pay(db: Session, attempt: int):
+        order, _ = crud.create_order(db, schemas.OrderCreate(
+            restaurant_id=RESTAURANT_ID, table_number=f"bench-{time.monotonic_ns()}-{attempt}",
+            items=[schemas.OrderItemCreate(item_id=first_item_id + attempt % MENU_ITEMS, quantity=1)]
+        ), USER_UID, "admin")
+        return crud.mark_order_paid(db, order.id, USER_UID, "cash")
+    return {
+        "list": lambda db, attempt: crud.get_all_orders(db, RESTAURANT_ID, limit=50),
+        "filter 7d": lambda db, attempt: crud.filter_orders(db, restaurant_id=RESTAURANT_ID, start_date=now - timedelta(days=7), limit=50),
+        "summaries": lambda db, attempt: crud.get_order_summaries(db, restaurant_id=RESTAURANT_ID, limit=100),
+        "place+pay": place_and_pay,
+        "analytics": lambda db, attempt: crud.get_order_analytics(db, "weekly"),
+        "deep page": lambda db, attempt: crud.get_all_orders(db, RESTAURANT_ID, cursor=deep_cursor, limit=50),
+    }
+
+def time_calls(sessions: Dict[str, sessionmaker], calls: Dict[str, Dict[str, Callable]], repeat: int) -> Dict[str, Dict[str, float]]:
+    """
+    Median milliseconds per call and layout, each call in a fresh session, after one warm-up call.
+    The layouts take turns call by call, so drift in machine load affects both alike.
+    """
+    timings = {layout: {name: [] for name in calls[layout]} for layout in sessions}
+    for name in calls[LAYOUTS[0]]:
+        for attempt in range(repeat + 1):
+            for layout, Session_ in sessions.items():
+                with Session_() as db:
+                    started = time.perf_counter()
+                    result = calls[layout][name](db, attempt)
+                    elapsed = time.perf_counter() - started
+                if name == "list" and not result[0]:
+                    raise AssertionError(f"{name} returned no orders")
+                if attempt:
+                    timings[layout][name].append(elapsed)
+    return {layout: {name: sorted(values)[len(values) // 2] * 1000 for name, values in by_name.items()}
+            for layout, by_name in timings.items()}
+
+def run(directory: str, sizes: List[int], hot_orders: int, repeat: int, archive_batches: int) -> None:
+    now = datetime.utcnow()
+    engines, sessions, first_item_ids = {}, {}, {}
+    for layout in LAYOUTS:
+        engines[layout] = create_engine(f"sqlite:///{os.path.join(directory, f'archive_bench_{layout}.db')}")
+        first_item_ids[layout] = seed(engines[layout], hot_orders, now)
+        with engines[layout].connect() as conn:
+            conn.exec_driver_sql("ANALYZE")
+        sessions[layout] = sessionmaker(bind=engines[layout])
+
+    names = list(hot_path_calls(0, now))
+    print(f"hot set: {hot_orders} orders in the last 30 days over {RESTAURANTS} restaurants; median ms over {repeat} calls")
+    print(f"{'history':>10}  {'layout':>8}  {'load s':>7}  " + "  ".join(f"{name:>10}" for name in names))
+    calls = {layout: hot_path_calls(first_item_ids[layout], now) for layout in LAYOUTS}
+    loaded = 0
+    for size in sizes:
+        load_seconds = {}
+        for layout in LAYOUTS:
+            started = time.perf_counter()
+            if size > loaded:
+                add_history(engines[layout], models.Order if layout == "single" else models.ArchivedOrder, loaded, size, now)
+                with engines[layout].connect() as conn:
+                    conn.exec_driver_sql("ANALYZE")
+            load_seconds[layout] = time.perf_counter() - started
+        medians = time_calls(sessions, calls, repeat)
+        for layout in LAYOUTS:
+            print(f"{size:>10}  {layout:>8}  {load_seconds[layout]:>7.1f}  " + "  ".join(f"{medians[layout][name]:>10.2f}" for name in names), flush=True)
+        loaded = max(loaded, size)
+
+    if archive_batches and loaded:
+        with sessions["single"]() as db:
+            started = time.perf_counter()
+            archived = crud.archive_closed_orders(db, max_batches=archive_batches)
+            elapsed = time.perf_counter() - started
+        print(f"archiver on the single layout: {archived} orders in {archive_batches} batches, {elapsed:.2f}s "
+              f"({archived / elapsed:.0f} orders/s, {elapsed / archive_batches * 1000:.0f}ms per batch)")
+    for engine in engines.values():
+        engine.dispose()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time hot-path order queries as history grows, with and without archiving.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[0, 100000, 1000000], help="History orders (cumulative steps)")
+    parser.add_argument("--hot-orders", type=int, default=20000, help="Orders from the last 30 days")
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument("--archive-batches", type=int, default=10, help="Batches of archive_closed_orders timed at the end (0 to skip)")
+    parser.add_argument("--dir", help="Directory for the two SQLite files (default: a throwaway temp dir)")
+    args = parser.parse_args(argv)
+    logging.disable(logging.INFO)
+
+    if args.dir:
+        run(args.dir, sorted(args.sizes), args.hot_orders, args.repeat, args.archive_batches)
+        return 0
+    with tempfile.TemporaryDirectory() as tmp:
+        run(tmp, sorted(args.sizes), args.hot_orders, args.repeat, args.archive_batches)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
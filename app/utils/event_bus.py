@@ -0,0 +1,258 @@
+"""
+Cross-worker pub/sub for KDS order events.
+
+Every worker process has its own kds_hub with the screens connected to it. notify_admins_*
+publishes through the configured bus, which delivers to the local hub immediately and forwards
+the event to the other workers, which deliver it to theirs. Backends (KDS_EVENT_BUS):
+
+- "memory" (default): single process, local hub only.
+- "redis": PUBLISH/SUBSCRIBE over the Redis protocol (KDS_EVENT_BUS_URL, redis://host:port).
+  Works against Redis or the stand-in server in app.utils.event_bus_server.
+- "postgres": LISTEN/NOTIFY on the application database (psycopg2; KDS_EVENT_BUS_URL defaults
+  to DATABASE_URL). Payloads are limited to ~8000 bytes; larger events are replaced by a resync.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Dict, Hashable, Optional
+from urllib.parse import urlparse
+
+from .kds_hub import KDSHub, kds_hub
+
+logger = logging.getLogger(__name__)
+
+KDS_EVENT_CHANNEL = os.getenv("KDS_EVENT_CHANNEL", "kds_events")
+POSTGRES_NOTIFY_LIMIT = 7900 # NOTIFY payloads must stay under 8000 bytes
+RECONNECT_DELAY = 1.0 # Seconds between subscriber reconnect attempts
+
+class InProcessEventBus:
+    """Delivers to this process's hub only."""
+    def __init__(self, hub: KDSHub = kds_hub):
+        self.hub = hub
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, restaurant_id: str, event: Dict, coalesce_key: Optional[Hashable] = None):
+        self.hub.publish(restaurant_id, event, coalesce_key)
+
+class _BrokerEventBus(InProcessEventBus):
+    """Shared logic for backends that forward events through an external broker."""
+    def __init__(self, url: str, hub: KDSHub = kds_hub, channel: str = KDS_EVENT_CHANNEL):
+        super().__init__(hub)
+        self.url = url
+        self.channel = channel
+        self.origin = uuid.uuid4().hex # Lets a worker skip its own messages, already delivered locally
+
+    def _encode(self, restaurant_id: str, event: Dict, coalesce_key: Optional[Hashable]) -> str:
+        return json.dumps({
+            "origin": self.origin,
+            "restaurant_id": restaurant_id,
+            "event": event,
+            "coalesce_key": list(coalesce_key) if isinstance(coalesce_key, tuple) else coalesce_key,
+        }, default=str)
+
+    def _deliver(self, payload) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning(f"Ignoring malformed KDS bus message: {payload!r:.200}")
+            return
+        if message.get("origin") == self.origin:
+            return
+        coalesce_key = message.get("coalesce_key")
+        if isinstance(coalesce_key, list):
+            coalesce_key = tuple(coalesce_key)
+        self.hub.publish(message["restaurant_id"], message["event"], coalesce_key)
+
+    async def publish(self, restaurant_id: str, event: Dict, coalesce_key: Optional[Hashable] = None):
+        self.hub.publish(restaurant_id, event, coalesce_key)
+        try:
+            await self._send(self._encode(restaurant_id, event, coalesce_key))
+        except Exception as e:
+            # Local screens already have the event; other workers' screens resync on reconnect
+            logger.error(f"Failed to forward KDS event for {restaurant_id} to other workers: {e}")
+
+    async def _send(self, payload: str):
+        raise NotImplementedError
+
+def _resp_command(*args) -> bytes:
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+async def _resp_read(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        raise ConnectionError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        return [await _resp_read(reader) for _ in range(int(body))]
+    raise ConnectionError(f"Unexpected reply {line!r}")
+
+class RedisEventBus(_BrokerEventBus):
+    """Redis PUBLISH/SUBSCRIBE using a minimal RESP client on asyncio streams."""
+    def __init__(self, url: str, hub: KDSHub = kds_hub, channel: str = KDS_EVENT_CHANNEL):
+        super().__init__(url, hub, channel)
+        parsed = urlparse(url)
+        self.host, self.port = parsed.hostname or "localhost", parsed.port or 6379
+        self.password = parsed.password
+        self._publisher = None
+        self._publish_lock = asyncio.Lock()
+        self._subscriber_task: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(_resp_command("AUTH", self.password))
+            await _resp_read(reader)
+        return reader, writer
+
+    async def start(self):
+        self._subscriber_task = asyncio.create_task(self._listen())
+        await asyncio.wait_for(self._subscribed.wait(), timeout=5)
+
+    async def stop(self):
+        if self._subscriber_task:
+            self._subscriber_task.cancel()
+            await asyncio.gather(self._subscriber_task, return_exceptions=True)
+        if self._publisher:
+            self._publisher[1].close()
+            self._publisher = None
+
+    async def _listen(self):
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._connect()
+                writer.write(_resp_command("SUBSCRIBE", self.channel))
+                await writer.drain()
+                await _resp_read(reader) # Subscription confirmation
+                self._subscribed.set()
+                while True:
+                    message = await _resp_read(reader)
+                    if isinstance(message, list) and len(message) == 3 and message[0] == b"message":
+                        self._deliver(message[2])
+            except asyncio.CancelledError:
+                raise
+            except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+                logger.warning(f"KDS event bus subscription lost ({e}); reconnecting in {RECONNECT_DELAY}s")
+            finally:
+                if writer:
+                    writer.close()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _send(self, payload: str):
+        async with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = await self._connect()
+                    reader, writer = self._publisher
+                    writer.write(_resp_command("PUBLISH", self.channel, payload))
+                    await writer.drain()
+                    return await _resp_read(reader)
+                except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                    self._publisher = None
+                    if attempt:
+                        raise
+
+class PostgresEventBus(_BrokerEventBus):
+    """
+    LISTEN/NOTIFY over psycopg2. The listening connection is registered with the event loop
+    (add_reader), so notifications are handled without a thread; NOTIFY runs in the default
+    executor on a separate connection.
+    """
+    def __init__(self, url: str, hub: KDSHub = kds_hub, channel: str = KDS_EVENT_CHANNEL):
+        super().__init__(url.replace("postgresql+psycopg2://", "postgresql://"), hub, channel)
+        self._listener = None
+        self._notifier = None
+
+    def _connect(self):
+        import psycopg2
+        connection = psycopg2.connect(self.url)
+        connection.set_session(autocommit=True)
+        return connection
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._listener = await loop.run_in_executor(None, self._connect)
+        with self._listener.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        loop.add_reader(self._listener.fileno(), self._drain_notifications)
+
+    def _drain_notifications(self):
+        try:
+            self._listener.poll()
+        except Exception as e:
+            logger.error(f"KDS event bus lost its LISTEN connection: {e}")
+            asyncio.get_running_loop().remove_reader(self._listener.fileno())
+            asyncio.get_running_loop().create_task(self._restart())
+            return
+        while self._listener.notifies:
+            self._deliver(self._listener.notifies.pop(0).payload)
+
+    async def _restart(self):
+        await asyncio.sleep(RECONNECT_DELAY)
+        try:
+            await self.start()
+        except Exception as e:
+            logger.error(f"KDS event bus reconnect failed: {e}")
+            asyncio.get_running_loop().create_task(self._restart())
+
+    async def stop(self):
+        if self._listener is not None:
+            asyncio.get_running_loop().remove_reader(self._listener.fileno())
+            self._listener.close()
+            self._listener = None
+        if self._notifier is not None:
+            self._notifier.close()
+            self._notifier = None
+
+    def _notify(self, payload: str):
+        if self._notifier is None or self._notifier.closed:
+            self._notifier = self._connect()
+        with self._notifier.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+
+    async def _send(self, payload: str):
+        if len(payload.encode()) > POSTGRES_NOTIFY_LIMIT:
+            message = json.loads(payload)
+            message["event"], message["coalesce_key"] = {"type": "resync"}, None
+            payload = json.dumps(message)
+        await asyncio.get_running_loop().run_in_executor(None, self._notify, payload)
+
+def create_event_bus(backend: Optional[str] = None, url: Optional[str] = None, hub: KDSHub = kds_hub) -> InProcessEventBus:
+    backend = (backend or os.getenv("KDS_EVENT_BUS", "memory")).lower()
+    url = url or os.getenv("KDS_EVENT_BUS_URL")
+    if backend == "redis":
+        return RedisEventBus(url or "redis://localhost:6379", hub)
+    if backend == "postgres":
+        if not url:
+            from ..database import DATABASE_URL
+            url = DATABASE_URL
+        return PostgresEventBus(url, hub)
+    if backend != "memory":
+        logger.warning(f"Unknown KDS_EVENT_BUS {backend!r}; using the in-process bus.")
+    return InProcessEventBus(hub)
+
+event_bus = create_event_bus()
@@ -0,0 +1,89 @@
+"""
+Minimal Redis-compatible pub/sub server for running several workers locally without Redis.
+
+Implements PING, PUBLISH, SUBSCRIBE, UNSUBSCRIBE and QUIT over the Redis protocol, which is all
+the KDS event bus uses. Not for production: no persistence, auth or clustering.
+
+Usage:
+    python -m app.utils.event_bus_server --port 6390
+    KDS_EVENT_BUS=redis KDS_EVENT_BUS_URL=redis://127.0.0.1:6390 gunicorn ... -w 4
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from typing import Dict, Set
+
+from .event_bus import _resp_command, _resp_read
+
+logger = logging.getLogger(__name__)
+
+def _subscription_reply(kind: bytes, channel: bytes, count: int) -> bytes:
+    return b"*3\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n:%d\r\n" % (len(kind), kind, len(channel), channel, count)
+
+class PubSubServer:
+    def __init__(self):
+        self.channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscriptions: Set[bytes] = set()
+        try:
+            while True:
+                command = await _resp_read(reader)
+                if not isinstance(command, list) or not command:
+                    writer.write(b"-ERR expected a command array\r\n")
+                    continue
+                name, args = command[0].upper(), command[1:]
+                if name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                elif name == b"PUBLISH" and len(args) == 2:
+                    receivers = list(self.channels.get(args[0], ()))
+                    frame = _resp_command(b"message", args[0], args[1])
+                    for receiver in receivers:
+                        receiver.write(frame)
+                    writer.write(b":%d\r\n" % len(receivers))
+                elif name == b"SUBSCRIBE":
+                    for channel in args:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        subscriptions.add(channel)
+                        writer.write(_subscription_reply(b"subscribe", channel, len(subscriptions)))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in args or list(subscriptions):
+                        self.channels.get(channel, set()).discard(writer)
+                        subscriptions.discard(channel)
+                        writer.write(_subscription_reply(b"unsubscribe", channel, len(subscriptions)))
+                elif name == b"QUIT":
+                    writer.write(b"+OK\r\n")
+                    break
+                else:
+                    writer.write(b"-ERR unsupported command '%s'\r\n" % name)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscriptions:
+                self.channels.get(channel, set()).discard(writer)
+            writer.close()
+
+async def serve(host: str = "127.0.0.1", port: int = 6390, ready: asyncio.Event = None):
+    server = await asyncio.start_server(PubSubServer().handle, host, port)
+    logger.info(f"KDS pub/sub stand-in listening on {host}:{port}")
+    if ready is not None:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Redis-compatible pub/sub stand-in for the KDS event bus.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
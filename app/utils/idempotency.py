@@ -0,0 +1,119 @@
+"""
+Idempotency-Key handling for retried POS writes (order placement, marking paid).
+
+The first request with a key claims it in the idempotency_keys table, runs, and stores its
+response; retries with the same key get that stored response without touching the order tables.
+A duplicate that arrives while the first request is still running waits for it (woken directly
+when both are in the same worker, by polling the table otherwise) instead of racing it. Failed
+requests release their claim, so the client can retry them. Keys are evicted after
+IDEMPOTENCY_KEY_TTL_HOURS by a periodic purge.
+"""
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Response, status
+from pydantic import BaseModel
+
+from ..crud.crud_async import AnySession, run_in_session
+from ..crud.crud_idempotency import (
+    claim_idempotency_key, complete_idempotency_key, release_idempotency_key, purge_expired_idempotency_keys
+)
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT_SECONDS", "30")) # Before a waiting duplicate gets 409
+IDEMPOTENCY_POLL_INTERVAL = 0.05 # First poll delay for duplicates running in another worker; doubles up to 1s
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", "3600"))
+IDEMPOTENT_REPLAY_HEADER = "Idempotent-Replayed"
+
+class IdempotencyCoordinator:
+    def __init__(self, wait_timeout: float = IDEMPOTENCY_WAIT_TIMEOUT, purge_interval: float = IDEMPOTENCY_PURGE_INTERVAL):
+        self.wait_timeout = wait_timeout
+        self.purge_interval = purge_interval
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._running: Dict[Tuple[str, str], asyncio.Event] = {} # Keys owned by requests in this worker
+        self._purger: Optional[asyncio.Task] = None
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._running = {}
+
+    async def run(self, db: AnySession, user_uid: str, key: str, fingerprint: str, handler: Callable[[], Awaitable[BaseModel]]) -> Response:
+        """
+        Runs `handler` at most once per (user_uid, key) and returns its JSON response; retries get
+        the stored response with the Idempotent-Replayed header set. `fingerprint` (see
+        request_fingerprint) must cover the request's parameters and body.
+        """
+        self._bind_loop()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        delay = IDEMPOTENCY_POLL_INTERVAL
+        while True:
+            try:
+                record = await run_in_session(db, claim_idempotency_key, user_uid, key, fingerprint)
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            if record is None:
+                break
+            if record.status == "completed":
+                return Response(content=record.response_body, status_code=record.response_status,
+                                media_type="application/json", headers={IDEMPOTENT_REPLAY_HEADER: "true"})
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail="A request with this Idempotency-Key is still being processed; retry later.")
+            running = self._running.get((user_uid, key))
+            if running is not None:
+                try:
+                    await asyncio.wait_for(running.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, 1.0)
+
+        done = self._running[(user_uid, key)] = asyncio.Event()
+        try:
+            try:
+                result = await handler()
+            except BaseException:
+                await run_in_session(db, release_idempotency_key, user_uid, key)
+                raise
+            body = result.model_dump_json()
+            await run_in_session(db, complete_idempotency_key, user_uid, key, status.HTTP_200_OK, body)
+            return Response(content=body, media_type="application/json")
+        finally:
+            del self._running[(user_uid, key)]
+            done.set()
+
+    async def _purge_periodically(self) -> None:
+        from ..database import SessionLocal
+
+        def purge() -> int:
+            with SessionLocal() as db:
+                return purge_expired_idempotency_keys(db)
+
+        while True:
+            try:
+                removed = await asyncio.get_running_loop().run_in_executor(None, purge)
+                if removed:
+                    logger.info(f"Purged {removed} expired idempotency keys")
+            except Exception as e:
+                logger.error(f"Failed to purge expired idempotency keys: {e}")
+            await asyncio.sleep(self.purge_interval)
+
+    def start_purger(self) -> None:
+        if self._purger is None or self._purger.done():
+            self._purger = asyncio.get_running_loop().create_task(self._purge_periodically())
+
+    async def stop_purger(self) -> None:
+        if self._purger is not None:
+            self._purger.cancel()
+            await asyncio.gather(self._purger, return_exceptions=True)
+            self._purger = None
+
+idempotency = IdempotencyCoordinator()
@@ -0,0 +1,165 @@
+"""
+Index advisor for the order/payment/audit hot paths.
+
+Runs EXPLAIN on the canonical queries the API issues (SQLite: EXPLAIN QUERY PLAN,
+Postgres: EXPLAIN (FORMAT JSON)) and flags any full-table/sequential scan.
+
+Usage:
+    python -m app.utils.index_advisor                       # throwaway SQLite file, seeded
+    python -m app.utils.index_advisor --url postgresql://... --seed-orders 50000
+
+--seed-orders inserts synthetic rows into the target database (use a scratch database for
+Postgres). Exits with status 1 when a scan is flagged, so it can gate CI or load-test runs.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+
+from app import models
+from app.database import Base
+from app.crud.pagination import apply_order_keyset
+
+logger = logging.getLogger(__name__)
+
+SEED_RESTAURANTS = 20
+SEED_TABLES = 30
+SEED_BATCH = 5000
+
+def seed(engine: Engine, order_count: int):
+    """Inserts `order_count` synthetic orders (with items, payment, history and audit rows) plus claimed rewards."""
+    Base.metadata.create_all(engine)
+    start = datetime.utcnow() - timedelta(days=365)
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [
+            {"uid": f"advisor-user-{u}", "email": f"advisor{u}@example.com", "number": f"90000{u:05d}", "name": "Advisor"}
+            for u in range(200)
+        ])
+        conn.execute(models.Restaurant.__table__.insert(), [
+            {"restaurant_id": f"advisor-r{r}", "restaurant_name": f"Advisor {r}", "currency": "INR", "timezone": "Asia/Kolkata",
+             "is_open": True, "allow_manual_discount": False, "bill_series_start": 1,
+             "show_tax_breakdown_on_invoice": False, "enable_tips_collection": False}
+            for r in range(SEED_RESTAURANTS)
+        ])
+        for offset in range(0, order_count, SEED_BATCH):
+            orders, items, payments, history, audits = [], [], [], [], []
+            for n in range(offset, min(offset + SEED_BATCH, order_count)):
+                order_id = f"advisor-r{n % SEED_RESTAURANTS}_{n}"
+                created_at = start + timedelta(minutes=n)
+                paid = n < order_count - SEED_RESTAURANTS * 2
+                orders.append({
+                    "id": order_id, "order_number": n, "user_uid": f"advisor-user-{n % 200}",
+                    "restaurant_id": f"advisor-r{n % SEED_RESTAURANTS}", "table_number": f"Table {n % SEED_TABLES}",
+                    "created_at": created_at, "updated_at": created_at, "status": "Payment Done" if paid else "Pending",
+                    "payment_status": "Paid" if paid else "Pending", "total_cost": 100.0
+                })
+                items.extend({"order_id": order_id, "item_id": 1 + k, "quantity": 1, "price": 50.0} for k in range(2))
+                if paid:
+                    payments.append({"order_id": order_id, "amount": 100.0, "method": "Cash", "status": "Paid", "paid_at": created_at})
+                history.append({"order_id": order_id, "status": "Pending", "changed_by": "advisor", "changed_at": created_at})
+                audits.append({"order_id": order_id, "user_id": f"advisor-user-{n % 200}", "action": "create", "timestamp": created_at})
+            conn.execute(models.Order.__table__.insert(), orders)
+            conn.execute(models.OrderItem.__table__.insert(), items)
+            if payments:
+                conn.execute(models.Payment.__table__.insert(), payments)
+            conn.execute(models.OrderStatusHistory.__table__.insert(), history)
+            conn.execute(models.AuditLog.__table__.insert(), audits)
+        conn.execute(models.ClaimedReward.__table__.insert(), [
+            {"uid": f"advisor-user-{n % 200}", "restaurant_id": f"advisor-r{n % SEED_RESTAURANTS}", "reward_name": "Advisor",
+             "redeemed": n % 2 == 0, "redeemed_at": start + timedelta(hours=n) if n % 2 == 0 else None,
+             "coupon_code": f"ADVISOR{n}"}
+            for n in range(max(order_count // 10, 100))
+        ])
+        conn.execute(text("ANALYZE"))  # planner statistics, so small seeds don't favour scans
+
+def canonical_queries() -> List[Tuple[str, Select]]:
+    """(name, statement) for each hot-path query, with representative parameters."""
+    sample_orders = [f"advisor-r0_{n}" for n in range(0, 2000, 20)]
+    day_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return [
+        ("get_unpaid_order_by_table", select(models.Order).where(
+            models.Order.restaurant_id == "advisor-r0",
+            models.Order.table_number == "Table 0",
+            models.Order.payment_status == "Pending")),
+        ("order_list_page", apply_order_keyset(
+            select(models.Order).where(models.Order.restaurant_id == "advisor-r0"), None, 100)),
+        ("order_items_selectin", select(models.OrderItem).where(models.OrderItem.order_id.in_(sample_orders))),
+        ("payments_selectin", select(models.Payment).where(models.Payment.order_id.in_(sample_orders))),
+        ("status_history_selectin", select(models.OrderStatusHistory).where(models.OrderStatusHistory.order_id.in_(sample_orders))),
+        ("order_audit_log", select(models.AuditLog).where(models.AuditLog.order_id == "advisor-r0_0")
+            .order_by(models.AuditLog.timestamp.desc())),
+        ("redeem_coupon_daily_count", select(func.count()).select_from(models.ClaimedReward).where(
+            models.ClaimedReward.uid == "advisor-user-0",
+            models.ClaimedReward.restaurant_id == "advisor-r0",
+            models.ClaimedReward.redeemed == True,
+            models.ClaimedReward.redeemed_at >= day_start,
+            models.ClaimedReward.redeemed_at <= day_start + timedelta(days=1))),
+    ]
+
+def _bound_sql(engine: Engine, stmt) -> Tuple[str, object]:
+    compiled = stmt.compile(dialect=engine.dialect, compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    if compiled.positiontup:
+        return str(compiled), tuple(params[name] for name in compiled.positiontup)
+    return str(compiled), params
+
+def _sequential_scans(engine: Engine, stmt) -> Tuple[List[str], List[str]]:
+    """Returns (plan lines, tables read by a full scan)."""
+    sql, params = _bound_sql(engine, stmt)
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql, params).scalar()
+            plan = plan[0]["Plan"] if isinstance(plan, list) else plan
+            lines, scans, stack = [], [], [(plan, 0)]
+            while stack:
+                node, depth = stack.pop()
+                relation = node.get("Relation Name")
+                lines.append("  " * depth + node["Node Type"] + (f" on {relation}" if relation else ""))
+                if node["Node Type"] == "Seq Scan":
+                    scans.append(relation)
+                stack.extend((child, depth + 1) for child in reversed(node.get("Plans", [])))
+            return lines, scans
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        lines = [row[-1] for row in rows]
+        # "SCAN orders" is a full table scan; "SCAN orders USING INDEX ..." walks an index instead
+        scans = [line.split()[1] for line in lines if line.startswith("SCAN ") and " USING " not in line]
+        return lines, scans
+
+def run(engine: Engine) -> int:
+    flagged = 0
+    for name, stmt in canonical_queries():
+        lines, scans = _sequential_scans(engine, stmt)
+        status = f"SEQUENTIAL SCAN on {', '.join(scans)}" if scans else "ok"
+        print(f"[{'FLAG' if scans else ' ok '}] {name}: {status}")
+        for line in lines:
+            print(f"         {line}")
+        flagged += bool(scans)
+    print(f"{flagged} of {len(canonical_queries())} canonical queries use a sequential scan.")
+    return flagged
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EXPLAIN the hot-path order queries and flag sequential scans.")
+    parser.add_argument("--url", help="Database URL (default: a throwaway seeded SQLite file)")
+    parser.add_argument("--seed-orders", type=int, default=None, help="Insert this many synthetic orders before explaining")
+    args = parser.parse_args(argv)
+
+    url, seed_orders = args.url, args.seed_orders
+    if not url:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'index_advisor.db')}"
+        seed_orders = seed_orders or 20000
+    engine = create_engine(url)
+    if seed_orders:
+        logger.info(f"Seeding {seed_orders} orders into {engine.url.render_as_string(hide_password=True)}")
+        seed(engine, seed_orders)
+    return 1 if run(engine) else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+Restaurant-scoped fan-out of order events to kitchen display (KDS) WebSocket connections.
+
+Each connection subscribes to one restaurant's channel and owns a bounded, coalescing outbox:
+- events are serialized once per publish, not once per subscriber;
+- status updates for an order replace an older, still-unsent update for the same order;
+- when a stalled screen's outbox fills up, its backlog is dropped and it is sent a single
+  {"type": "resync"} event telling it to reload its order list, so memory per connection is bounded;
+- a sender drains up to KDS_MAX_BATCH events per WebSocket frame, as
+  {"type": "batch", "events": [...]} when more than one event is ready.
+
+Order events carry their restaurant's KDS version (see crud_kds). For restaurants whose open-order
+board has been loaded (GET /kds/{restaurant_id}/snapshot, or a screen resuming with ?since=),
+the hub keeps that board in memory and current: versioned events are applied and forwarded in
+version order, holding a few that arrive early for up to KDS_BOARD_GAP_TIMEOUT_MS. A version that
+never shows up (or an event without one) drops the board, to be reloaded from the database on the
+next request, and sends subscribers a resync. The last KDS_REPLAY_LOG_SIZE events are kept so a
+reconnecting screen can resume from the version it last saw instead of reloading.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+KDS_QUEUE_SIZE = max(1, int(os.getenv("KDS_QUEUE_SIZE", "256"))) # Pending events per connection before a resync
+KDS_MAX_BATCH = max(1, int(os.getenv("KDS_MAX_BATCH", "50"))) # Events per WebSocket frame
+KDS_BATCH_WINDOW = float(os.getenv("KDS_BATCH_WINDOW_MS", "10")) / 1000 # Wait for more events before sending a frame
+KDS_REPLAY_LOG_SIZE = max(1, int(os.getenv("KDS_REPLAY_LOG_SIZE", "1024"))) # Recent events per restaurant kept for ?since= resumes
+KDS_BOARD_GAP_TIMEOUT = float(os.getenv("KDS_BOARD_GAP_TIMEOUT_MS", "2000")) / 1000 # Wait for a missing version this long
+KDS_BOARD_MAX_GAP = 64 # Early events held while a version is missing, before giving up on it
+
+RESYNC_EVENT = json.dumps({"type": "resync"})
+
+class KDSConnection:
+    """One subscriber's outbox. Only touched from the event loop, so it needs no locking."""
+    __slots__ = ("restaurant_id", "max_queue", "dropped", "_events", "_resync", "_ready")
+
+    def __init__(self, restaurant_id: str, max_queue: int = KDS_QUEUE_SIZE):
+        self.restaurant_id = restaurant_id
+        self.max_queue = max_queue
+        self.dropped = 0 # Events discarded by overflow, for logging/metrics
+        self._events: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._resync = False
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self._events)
+
+    def offer(self, key: Hashable, frame: str) -> None:
+        if key in self._events:
+            # Coalesce: the newer value replaces the older one and moves to the back, so frames
+            # still go out in version order
+            del self._events[key]
+            self._events[key] = frame
+        else:
+            if len(self._events) >= self.max_queue:
+                self.dropped += len(self._events)
+                self._events.clear()
+                self._resync = True
+            self._events[key] = frame
+        self._ready.set()
+
+    def resync(self) -> None:
+        """Drops the backlog and tells the screen to reload its board."""
+        self.dropped += len(self._events)
+        self._events.clear()
+        self._resync = True
+        self._ready.set()
+
+    async def next_frame(self, max_batch: int = KDS_MAX_BATCH, batch_window: float = KDS_BATCH_WINDOW) -> str:
+        """Waits for at least one event and returns the next frame to send."""
+        await self._ready.wait()
+        if batch_window and len(self._events) < max_batch:
+            await asyncio.sleep(batch_window)
+        frames = [RESYNC_EVENT] if self._resync else []
+        self._resync = False
+        while self._events and len(frames) < max_batch:
+            frames.append(self._events.popitem(last=False)[1])
+        if not self._events:
+            self._ready.clear()
+        if len(frames) == 1:
+            return frames[0]
+        return '{"type": "batch", "events": [' + ", ".join(frames) + ']}'
+
+def _order_states(event: Dict) -> Iterable[Tuple[str, Optional[Dict]]]:
+    """(order id, board entry or None) pairs carried by an order event, single or batched."""
+    if "orders" in event:
+        return ((change["order_id"], change.get("order")) for change in event["orders"])
+    return ((event["order_id"], event.get("order")),)
+
+class KDSBoard:
+    """One restaurant's open orders as of `version`. Only touched from the event loop."""
+    __slots__ = ("version", "orders", "log", "held", "loads", "gap_timer")
+
+    def __init__(self, log_size: int = KDS_REPLAY_LOG_SIZE):
+        self.version: Optional[int] = None # None while the first load is in flight
+        self.orders: Dict[str, Dict] = {}
+        self.log: Deque[Tuple[int, Hashable, str]] = deque(maxlen=log_size) # (version, coalesce key, frame) up to `version`
+        self.held: Dict[int, Tuple[Dict, Hashable, str]] = {} # Events newer than version + 1, waiting for the gap to fill
+        self.loads = 0
+        self.gap_timer: Optional[asyncio.TimerHandle] = None
+
+    def load(self, version: int, orders: List[Dict]) -> None:
+        self.version = version
+        self.orders = {order["id"]: order for order in orders}
+        for held_version in [v for v in self.held if v <= version]:
+            del self.held[held_version] # Already part of what was loaded
+
+    def apply(self, version: int, event: Dict, key: Hashable, frame: str) -> None:
+        for order_id, entry in _order_states(event):
+            if entry is None:
+                self.orders.pop(order_id, None)
+            else:
+                self.orders[order_id] = entry
+        self.version = version
+        self.log.append((version, key, frame))
+
+    def snapshot(self) -> Dict:
+        return {"version": self.version, "orders": sorted(self.orders.values(), key=lambda order: (order["created_at"] or "", order["id"]))}
+
+class KDSHub:
+    def __init__(self, max_queue: int = KDS_QUEUE_SIZE, max_batch: int = KDS_MAX_BATCH, batch_window: float = KDS_BATCH_WINDOW,
+                 log_size: int = KDS_REPLAY_LOG_SIZE, gap_timeout: float = KDS_BOARD_GAP_TIMEOUT):
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.log_size = log_size
+        self.gap_timeout = gap_timeout
+        self._channels: Dict[str, Set[KDSConnection]] = {}
+        self._boards: Dict[str, KDSBoard] = {}
+        self._sequence = itertools.count() # Keys for events that never coalesce
+
+    def subscribe(self, restaurant_id: str) -> KDSConnection:
+        connection = KDSConnection(restaurant_id, self.max_queue)
+        self._channels.setdefault(restaurant_id, set()).add(connection)
+        return connection
+
+    def unsubscribe(self, connection: KDSConnection) -> None:
+        subscribers = self._channels.get(connection.restaurant_id)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self._channels[connection.restaurant_id]
+        if connection.dropped:
+            logger.info(f"KDS connection for {connection.restaurant_id} dropped {connection.dropped} events to overflow.")
+
+    def subscriber_count(self, restaurant_id: Optional[str] = None) -> int:
+        if restaurant_id is not None:
+            return len(self._channels.get(restaurant_id, ()))
+        return sum(len(subscribers) for subscribers in self._channels.values())
+
+    def publish(self, restaurant_id: str, event: Dict, coalesce_key: Optional[Hashable] = None) -> int:
+        """
+        Queues `event` for every subscriber of `restaurant_id` without awaiting any of them.
+        Events sharing a `coalesce_key` replace each other while unsent. Returns the subscriber count.
+        If the restaurant's board is loaded, a versioned event is applied to it first and may be
+        held back until the versions before it have arrived.
+        """
+        subscribers = self._channels.get(restaurant_id)
+        board = self._boards.get(restaurant_id)
+        if not subscribers and board is None:
+            return 0
+        frame = json.dumps(event, default=str)
+        key = coalesce_key if coalesce_key is not None else next(self._sequence)
+        if board is not None:
+            version = event.get("version")
+            if not isinstance(version, int):
+                # A resync, or an event from a worker without versions: the board cannot tell what changed
+                self._drop_board(restaurant_id, board, resync=False)
+            elif board.version is None or version > board.version:
+                board.held[version] = (event, key, frame)
+                if board.version is not None:
+                    self._release(restaurant_id, board)
+                return len(self._channels.get(restaurant_id, ()))
+            # Versions up to board.version are already on the board; screens skip them by version
+        self._offer(restaurant_id, key, frame)
+        return len(subscribers or ())
+
+    def _offer(self, restaurant_id: str, key: Hashable, frame: str) -> None:
+        for connection in self._channels.get(restaurant_id, ()):
+            connection.offer(key, frame)
+
+    def _release(self, restaurant_id: str, board: KDSBoard) -> None:
+        """Applies and forwards held events while they continue the board's version."""
+        while board.version + 1 in board.held:
+            event, key, frame = board.held.pop(board.version + 1)
+            board.apply(board.version + 1, event, key, frame)
+            self._offer(restaurant_id, key, frame)
+        if not board.held:
+            if board.gap_timer is not None:
+                board.gap_timer.cancel()
+                board.gap_timer = None
+        elif len(board.held) > KDS_BOARD_MAX_GAP:
+            self._drop_board(restaurant_id, board)
+        elif board.gap_timer is None:
+            try:
+                board.gap_timer = asyncio.get_running_loop().call_later(self.gap_timeout, self._drop_board, restaurant_id, board)
+            except RuntimeError: # Published outside the event loop; give up at KDS_BOARD_MAX_GAP instead
+                pass
+
+    def _drop_board(self, restaurant_id: str, board: KDSBoard, resync: bool = True) -> None:
+        """Forgets a board that can no longer be kept exact, forwarding whatever it still held."""
+        if self._boards.get(restaurant_id) is board:
+            del self._boards[restaurant_id]
+        if board.gap_timer is not None:
+            board.gap_timer.cancel()
+            board.gap_timer = None
+        if board.held:
+            logger.warning(f"KDS board for {restaurant_id} missed version {(board.version or 0) + 1}; dropping it.")
+        for version in sorted(board.held):
+            _, key, frame = board.held[version]
+            self._offer(restaurant_id, key, frame)
+        board.held.clear()
+        if resync:
+            for connection in self._channels.get(restaurant_id, ()):
+                connection.resync()
+
+    async def board(self, restaurant_id: str, loader: Callable[[], Awaitable[Tuple[int, List[Dict]]]]) -> KDSBoard:
+        """
+        The restaurant's board, loaded through `loader()` -> (version, open orders) if it is not in
+        memory yet. Events published while the load runs are held and applied on top of it.
+        """
+        board = self._boards.get(restaurant_id)
+        if board is not None and board.version is not None:
+            return board
+        if board is None:
+            board = self._boards[restaurant_id] = KDSBoard(self.log_size)
+        board.loads += 1
+        try:
+            version, orders = await loader()
+        except BaseException:
+            board.loads -= 1
+            if board.version is None and not board.loads:
+                self._drop_board(restaurant_id, board, resync=False)
+            raise
+        board.loads -= 1
+        if self._boards.get(restaurant_id) is not board:
+            # Dropped while loading; serve this load without keeping it
+            board = KDSBoard(self.log_size)
+            board.load(version, orders)
+        elif board.version is None: # Otherwise a concurrent load finished first
+            board.load(version, orders)
+            self._release(restaurant_id, board)
+        return board
+
+    async def snapshot(self, restaurant_id: str, loader: Callable[[], Awaitable[Tuple[int, List[Dict]]]]) -> Dict:
+        """{"version", "orders"}: the open orders of a restaurant, served from memory once loaded."""
+        return (await self.board(restaurant_id, loader)).snapshot()
+
+    async def resume(self, restaurant_id: str, since: int, loader: Callable[[], Awaitable[Tuple[int, List[Dict]]]]) -> KDSConnection:
+        """
+        Subscribes a screen that has seen events up to version `since`: the events after it are
+        queued first if they are still in the replay log, otherwise the screen is told to resync.
+        """
+        board = await self.board(restaurant_id, loader)
+        connection = self.subscribe(restaurant_id)
+        if board.version is not None and since < board.version:
+            missed = [(key, frame) for version, key, frame in board.log if version > since]
+            if len(missed) == board.version - since:
+                for key, frame in missed:
+                    connection.offer(key, frame)
+            else:
+                connection.resync()
+        return connection
+
+    async def serve(self, connection: KDSConnection, websocket) -> None:
+        """Sends the connection's frames until the socket fails or the task is cancelled."""
+        while True:
+            frame = await connection.next_frame(self.max_batch, self.batch_window)
+            await websocket.send_text(frame)
+
+kds_hub = KDSHub()
@@ -0,0 +1,101 @@
+"""
+Load test for the KDS fan-out: simulated kitchen screens subscribed through kds_hub.
+
+Each simulated client is a stand-in WebSocket whose send_text parses the frame and records the
+publish-to-delivery latency of every event in it. A fraction of clients stall (never finish a
+send), to show that their outboxes stay bounded instead of growing.
+
+Usage:
+    python -m app.utils.kds_loadtest --clients 1000 --restaurants 50 --events 200 --stalled 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from app.utils.kds_hub import KDSHub
+
+class SimulatedScreen:
+    def __init__(self, stalled: bool):
+        self.stalled = stalled
+        self.latencies = []
+        self.frames = 0
+        self.resyncs = 0
+
+    async def send_text(self, frame: str):
+        if self.stalled:
+            await asyncio.Event().wait() # A tablet that stopped reading
+        now = time.perf_counter()
+        self.frames += 1
+        message = json.loads(frame)
+        for event in message["events"] if message.get("type") == "batch" else [message]:
+            if event.get("type") == "resync":
+                self.resyncs += 1
+            elif "published_at" in event:
+                self.latencies.append(now - event["published_at"])
+
+async def run(clients: int, restaurants: int, events: int, stalled_fraction: float, rate: float, queue_size: int):
+    hub = KDSHub(max_queue=queue_size)
+    screens, tasks, connections = [], [], []
+    tracemalloc.start()
+    for n in range(clients):
+        screen = SimulatedScreen(stalled=random.random() < stalled_fraction)
+        connection = hub.subscribe(f"restaurant-{n % restaurants}")
+        screens.append(screen)
+        connections.append(connection)
+        tasks.append(asyncio.create_task(hub.serve(connection, screen)))
+    baseline, _ = tracemalloc.get_traced_memory()
+
+    publish_times = []
+    interval = 1.0 / rate if rate else 0
+    for n in range(events):
+        restaurant_id = f"restaurant-{n % restaurants}"
+        order_id = f"{restaurant_id}_{n // restaurants % 20}"
+        started = time.perf_counter()
+        if n % 3:
+            hub.publish(restaurant_id, {"type": "order_status", "order_id": order_id, "status": f"step-{n}", "published_at": started},
+                        coalesce_key=("order_status", order_id))
+        else:
+            hub.publish(restaurant_id, {"event": "new_order", "order_id": order_id, "published_at": started})
+        publish_times.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    await asyncio.sleep(0.5) # Let healthy screens drain
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies = sorted(latency for screen in screens if not screen.stalled for latency in screen.latencies)
+    stalled = [connection for screen, connection in zip(screens, connections) if screen.stalled]
+    print(f"clients={clients} restaurants={restaurants} events={events} stalled={len(stalled)} queue_size={queue_size}")
+    print(f"publish cost: mean {statistics.mean(publish_times) * 1e6:.0f}us, max {max(publish_times) * 1e6:.0f}us per event")
+    if latencies:
+        print(f"fan-out latency over {len(latencies)} deliveries: p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms")
+    print(f"frames sent: {sum(screen.frames for screen in screens)}, resyncs: {sum(screen.resyncs for screen in screens)}")
+    if stalled:
+        print(f"stalled outbox length: max {max(len(connection) for connection in stalled)} (bound {queue_size}), "
+              f"events dropped to overflow: {sum(connection.dropped for connection in stalled)}")
+    print(f"memory: {(current - baseline) / 1024:.0f} KiB held after the run, peak {(peak - baseline) / 1024:.0f} KiB above baseline")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate KDS screens and measure fan-out latency and memory.")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--restaurants", type=int, default=50)
+    parser.add_argument("--events", type=int, default=2000, help="Events published in total, round-robin over restaurants")
+    parser.add_argument("--stalled", type=float, default=0.05, help="Fraction of clients that never read")
+    parser.add_argument("--rate", type=float, default=500.0, help="Events published per second (0 = as fast as possible)")
+    parser.add_argument("--queue-size", type=int, default=64)
+    args = parser.parse_args(argv)
+    random.seed(7)
+    asyncio.run(run(args.clients, args.restaurants, args.events, args.stalled, args.rate, args.queue_size))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Diagnostics for code that blocks the event loop (sync I/O or CPU work inside `async def`).
+
+A heartbeat task sleeps LOOP_MONITOR_INTERVAL_MS at a time and measures how late it wakes up.
+A watchdog thread notices when the heartbeat is overdue by more than LOOP_BLOCK_THRESHOLD_MS and,
+while the loop is still stuck, captures the loop thread's stack and the route of the request whose
+task is running. When the heartbeat resumes, the stall is recorded against that route.
+
+Per-route blocking time is reported by GET /api/diagnostics/event-loop and, when prometheus-client
+is installed, as event_loop_stall_seconds{route} and event_loop_lag_seconds at
+/api/diagnostics/metrics. Off unless LOOP_MONITOR_ENABLED is set.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "false").lower() in ("1", "true", "yes")
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100")) / 1000 # Stalls shorter than this are ignored
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "50")) / 1000 # Heartbeat period
+LOOP_MONITOR_MAX_STALLS = 100 # Recent stalls kept (with stacks) for the report
+LOOP_MONITOR_STACK_DEPTH = 40 # Innermost frames kept per stall
+UNATTRIBUTED = "(no request)" # Stalls in background tasks, startup code, or too short for the watchdog to see
+
+_metrics = None
+
+def _prometheus_metrics():
+    """Creates the Prometheus metrics once per process; None if prometheus-client is not installed."""
+    global _metrics
+    if _metrics is None:
+        try:
+            from prometheus_client import Gauge, Histogram
+        except ImportError:
+            logger.warning("prometheus-client is not installed; event loop stalls are only reported at /api/diagnostics/event-loop")
+            _metrics = False
+            return None
+        _metrics = (
+            Histogram("event_loop_stall_seconds", "Time the event loop was blocked, per route holding it",
+                      ["route"], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)),
+            Gauge("event_loop_lag_seconds", "How late the last event loop heartbeat woke up")
+        )
+    return _metrics or None
+
+class RouteBlocking:
+    __slots__ = ("stalls", "blocked", "longest")
+
+    def __init__(self):
+        self.stalls = 0
+        self.blocked = 0.0
+        self.longest = 0.0
+
+class LoopBlockMonitor:
+    def __init__(self, threshold: float = LOOP_BLOCK_THRESHOLD, interval: float = LOOP_MONITOR_INTERVAL,
+                 enabled: bool = LOOP_MONITOR_ENABLED, max_stalls: int = LOOP_MONITOR_MAX_STALLS):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.interval = interval
+        self.lag = 0.0 # Lateness of the last heartbeat
+        self.routes: Dict[str, RouteBlocking] = {}
+        self.stalls: Deque[dict] = deque(maxlen=max_stalls)
+        self._requests: Dict[asyncio.Task, dict] = {} # Request task -> ASGI scope, see LoopMonitorMiddleware
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._beat = 0.0 # time.monotonic() of the last heartbeat, written by the loop, read by the watchdog
+        self._captured = None # (beat, route, stack) taken by the watchdog during the current stall
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def track(self, scope: dict) -> Optional[asyncio.Task]:
+        task = asyncio.current_task()
+        if task is not None:
+            self._requests[task] = scope
+        return task
+
+    def untrack(self, task: Optional[asyncio.Task]) -> None:
+        self._requests.pop(task, None)
+
+    def _route_of(self, task: Optional[asyncio.Task]) -> str:
+        scope = self._requests.get(task) if task is not None else None
+        if scope is None:
+            return UNATTRIBUTED
+        route = scope.get("route") # Set by the router once the request is matched
+        path = getattr(route, "path", None) or scope.get("path", "")
+        return f"{scope.get('method', 'WEBSOCKET')} {path}"
+
+    async def _beat_forever(self) -> None:
+        loop = asyncio.get_running_loop()
+        metrics = _prometheus_metrics()
+        while True:
+            self._beat = beat = time.monotonic()
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - expected)
+            if metrics:
+                metrics[1].set(self.lag)
+            if self.lag >= self.threshold:
+                self._record(beat, self.lag, metrics)
+
+    def _watch(self) -> None:
+        period = min(self.interval, self.threshold) / 4
+        while not self._stopping.wait(period):
+            beat = self._beat
+            if not beat or time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            if self._captured is not None and self._captured[0] == beat:
+                continue # Already captured this stall
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = traceback.extract_stack(frame)[-LOOP_MONITOR_STACK_DEPTH:] if frame is not None else []
+            try:
+                task = asyncio.current_task(self._loop)
+            except RuntimeError:
+                task = None
+            if task is self._heartbeat:
+                continue # The loop already moved on
+            self._captured = (beat, self._route_of(task), stack)
+
+    def _record(self, beat: float, lag: float, metrics) -> None:
+        captured, self._captured = self._captured, None
+        route, stack = (captured[1], captured[2]) if captured is not None and captured[0] == beat else (UNATTRIBUTED, [])
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = RouteBlocking()
+        stats.stalls += 1
+        stats.blocked += lag
+        stats.longest = max(stats.longest, lag)
+        self.stalls.append({
+            "at": datetime.utcnow().isoformat(),
+            "route": route,
+            "blocked_ms": round(lag * 1000, 1),
+            "stack": traceback.format_list(stack)
+        })
+        if metrics:
+            metrics[0].labels(route=route).observe(lag)
+        app_frame = next((frame for frame in reversed(stack)
+                          if f"{os.sep}app{os.sep}" in frame.filename and frame.filename != __file__), None)
+        where = f" at {app_frame.filename}:{app_frame.lineno} ({app_frame.name})" if app_frame else ""
+        logger.warning(f"Event loop blocked for {lag * 1000:.0f}ms by {route}{where}")
+
+    def report(self) -> dict:
+        routes = sorted(self.routes.items(), key=lambda item: item[1].blocked, reverse=True)
+        return {
+            "enabled": self.enabled,
+            "running": self._heartbeat is not None and not self._heartbeat.done(),
+            "threshold_ms": self.threshold * 1000,
+            "interval_ms": self.interval * 1000,
+            "lag_ms": round(self.lag * 1000, 1),
+            "routes": [
+                {"route": route, "stalls": stats.stalls, "blocked_ms": round(stats.blocked * 1000, 1),
+                 "longest_ms": round(stats.longest * 1000, 1)}
+                for route, stats in routes
+            ],
+            "recent_stalls": list(reversed(self.stalls))
+        }
+
+    def reset(self) -> None:
+        self.routes = {}
+        self.stalls.clear()
+
+    def start(self) -> None:
+        if not self.enabled or (self._heartbeat is not None and not self._heartbeat.done()):
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = 0.0
+        self._stopping.clear()
+        self._heartbeat = self._loop.create_task(self._beat_forever())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-block-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop block monitor started (threshold {self.threshold * 1000:.0f}ms, heartbeat {self.interval * 1000:.0f}ms)")
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+class LoopMonitorMiddleware:
+    """Records which route each request task is serving, so stalls can be attributed to it."""
+    def __init__(self, app, monitor: Optional[LoopBlockMonitor] = None):
+        self.app = app
+        self.monitor = monitor or loop_monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        task = self.monitor.track(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.untrack(task)
+
+loop_monitor = LoopBlockMonitor()
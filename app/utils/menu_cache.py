@@ -0,0 +1,182 @@
+"""
+Per-worker cache of the public menu responses (GET /menu and /menu/categories).
+
+Each restaurant's entry holds both bodies as ready JSON bytes with their ETags, tagged with the
+menu version they were compiled at (see crud_menu). A request costs one primary-key read of the
+version; after a menu write bumped it, one request per restaurant fetches the new snapshot blobs
+while concurrent ones wait for it. Clients that send If-None-Match with the current ETag get a
+304. Entries are evicted least recently used first once they exceed MENU_CACHE_MAX_BYTES, and the
+menus of up to MENU_CACHE_WARM_RESTAURANTS open restaurants are loaded at startup.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from fastapi import Response, status
+from sqlalchemy.orm import Session
+
+from ..crud.crud_menu import get_menu_version, get_menu_snapshot, get_active_menu_restaurant_ids
+
+logger = logging.getLogger(__name__)
+
+MENU_CACHE_MAX_BYTES = int(os.getenv("MENU_CACHE_MAX_BYTES", str(64 * 1024 * 1024))) # Serialized menus kept per worker
+MENU_CACHE_WARM_RESTAURANTS = int(os.getenv("MENU_CACHE_WARM_RESTAURANTS", "200")) # Menus loaded at startup (0: none)
+
+class CachedMenu(NamedTuple):
+    version: int
+    items: bytes
+    items_etag: str
+    categories: bytes
+    categories_etag: str
+
+    @property
+    def size(self) -> int:
+        return len(self.items) + len(self.categories)
+
+def _etag(version: int, body: bytes) -> str:
+    # The digest keeps tags unique even if a restaurant's version row is ever reset
+    return f'"{version}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 asks for GET), including "*"."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def menu_response(body: bytes, etag: str, if_none_match: Optional[str]) -> Response:
+    # no-cache: browsers and CDNs may keep the body but must revalidate it, which costs a 304
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+class MenuCache:
+    def __init__(self, max_bytes: int = MENU_CACHE_MAX_BYTES, warm_restaurants: int = MENU_CACHE_WARM_RESTAURANTS):
+        self.max_bytes = max_bytes
+        self.warm_restaurants = warm_restaurants
+        self._entries: "OrderedDict[str, CachedMenu]" = OrderedDict() # Least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock() # Menu endpoints run in the threadpool
+        self._loading: Dict[str, threading.Lock] = {}
+        self._warmer: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, restaurant_id: str, min_version: int, exact: bool) -> Optional[CachedMenu]:
+        """The entry if it is usable for `min_version`, marked as recently used. Caller holds _lock."""
+        entry = self._entries.get(restaurant_id)
+        if entry is None or entry.version < min_version or (exact and entry.version != min_version):
+            return None
+        self._entries.move_to_end(restaurant_id)
+        return entry
+
+    def _store(self, restaurant_id: str, entry: CachedMenu) -> None:
+        """Caller holds _lock."""
+        previous = self._entries.pop(restaurant_id, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        if entry.size > self.max_bytes:
+            logger.warning(f"Menu of restaurant {restaurant_id} ({entry.size} bytes) exceeds MENU_CACHE_MAX_BYTES; not cached")
+            return
+        self._entries[restaurant_id] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+
+    def load(self, db: Session, restaurant_id: str) -> CachedMenu:
+        version, items, categories = get_menu_snapshot(db, restaurant_id)
+        return CachedMenu(version, items, _etag(version, items), categories, _etag(version, categories))
+
+    def get(self, db: Session, restaurant_id: str) -> CachedMenu:
+        """A restaurant's menu at its current version, loaded on a miss."""
+        version = get_menu_version(db, restaurant_id)
+        with self._lock:
+            entry = self._lookup(restaurant_id, version, exact=True)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            loading = self._loading.setdefault(restaurant_id, threading.Lock())
+        with loading:
+            with self._lock:
+                # Loaded by the request this one waited for
+                entry = self._lookup(restaurant_id, version, exact=False)
+            if entry is None:
+                entry = self.load(db, restaurant_id)
+                with self._lock:
+                    current = self._entries.get(restaurant_id)
+                    if current is None or current.version <= entry.version:
+                        self._store(restaurant_id, entry)
+        with self._lock:
+            if self._loading.get(restaurant_id) is loading and not loading.locked():
+                del self._loading[restaurant_id]
+        return entry
+
+    def invalidate(self, restaurant_id: Optional[str] = None) -> None:
+        """Drops one restaurant's entry, or all of them."""
+        with self._lock:
+            if restaurant_id is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif restaurant_id in self._entries:
+                self._bytes -= self._entries.pop(restaurant_id).size
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "restaurants": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def warm(self) -> int:
+        """Loads the menus of the most active open restaurants; returns how many were cached."""
+        from ..database import SessionLocal
+
+        warmed = 0
+        with SessionLocal() as db:
+            for restaurant_id in get_active_menu_restaurant_ids(db, self.warm_restaurants):
+                try:
+                    self.get(db, restaurant_id)
+                    warmed += 1
+                except Exception as e:
+                    logger.error(f"Failed to warm the menu cache for restaurant {restaurant_id}: {e}")
+                db.rollback() # Each restaurant reads its own version
+                with self._lock:
+                    if self._bytes >= self.max_bytes:
+                        break
+        return warmed
+
+    async def _warm_in_background(self) -> None:
+        try:
+            warmed = await asyncio.get_running_loop().run_in_executor(None, self.warm)
+            logger.info(f"Menu cache warmed for {warmed} restaurants")
+        except Exception as e:
+            logger.error(f"Failed to warm the menu cache: {e}")
+
+    def start(self) -> None:
+        """Warms the cache without holding up startup; menus requested meanwhile load on demand."""
+        if self.warm_restaurants <= 0 or (self._warmer is not None and not self._warmer.done()):
+            return
+        self._warmer = asyncio.get_running_loop().create_task(self._warm_in_background())
+
+    async def stop(self) -> None:
+        if self._warmer is not None:
+            self._warmer.cancel()
+            await asyncio.gather(self._warmer, return_exceptions=True)
+
+menu_cache = MenuCache()
@@ -0,0 +1,117 @@
+"""
+Benchmark for the bulk menu upload (POST /menu/items/bulk_upload) over large files.
+
+For each size it writes a menu sheet of that many rows: items over --categories categories,
+every third item followed by three variation rows, rows shuffled unless --sorted (grouping does
+not depend on the order). Then, on a fresh database, it times the stages the endpoint runs:
+
+    read     pd.read_csv / pd.read_excel of the file
+    parse    normalize_menu_columns + parse_menu_frame (column-wise validation and grouping)
+    insert   insert_menu_items + commit (categories, multi-row INSERT, menu snapshot)
+
+and counts the SQL statements of the insert stage, which should not grow with the file.
+
+Usage:
+    python -m app.utils.menu_import_benchmark --rows 2000 10000
+    python -m app.utils.menu_import_benchmark --rows 10000 --format xlsx
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List
+
+import pandas as pd
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+from app.database import Base
+
+RESTAURANT_ID = "import-bench"
+USER_UID = "import-bench-user"
+VARIATIONS = ("Small", "Regular", "Large")
+
+def menu_sheet(rows: int, categories: int, shuffle: bool) -> pd.DataFrame:
+    """About `rows` rows: item rows, each third item followed by one row per variation."""
+    records = []
+    n = 0
+    while len(records) < rows:
+        category = f"Import category {n % categories}"
+        name = f"Import item {n:06d}"
+        records.append({
+            "Category Name": category, "Item Name": name, "Item Price": 50 + n % 400, "Item Cost Price": 20 + n % 100,
+            "Item Description": f"A fine dish, number {n}", "Item Available": "True" if n % 17 else "False",
+            "Item Image URL": f"https://img.example.com/menu/{n}.jpg",
+            "Inventory Available": "True" if n % 2 == 0 else "False", "Inventory Quantity": n % 50 if n % 2 == 0 else None,
+            "Variation Name": None, "Variation Price": None, "Variation Cost Price": None, "Variation Available": None
+        })
+        if n % 3 == 0:
+            for extra, size in enumerate(VARIATIONS):
+                records.append({
+                    "Category Name": category, "Item Name": name, "Item Price": None, "Item Cost Price": None,
+                    "Item Description": None, "Item Available": None, "Item Image URL": None,
+                    "Inventory Available": None, "Inventory Quantity": None,
+                    "Variation Name": size, "Variation Price": 40 + n % 400 + 10 * extra, "Variation Cost Price": 15,
+                    "Variation Available": "True"
+                })
+        n += 1
+    records = records[:rows]
+    if shuffle:
+        random.Random(rows).shuffle(records)
+    return pd.DataFrame(records)
+
+def run(directory: str, sizes: List[int], categories: int, file_format: str, shuffle: bool) -> None:
+    print(f"{file_format} files, {categories} categories, rows {'shuffled' if shuffle else 'grouped by item'}; seconds per stage")
+    print(f"{'rows':>7}  {'items':>6}  {'read':>6}  {'parse':>6}  {'insert':>6}  {'total':>6}  {'rows/s':>8}  {'statements':>10}")
+    for size in sizes:
+        path = os.path.join(directory, f"menu_{size}.{file_format}")
+        sheet = menu_sheet(size, categories, shuffle)
+        if file_format == "csv":
+            sheet.to_csv(path, index=False)
+        else:
+            sheet.to_excel(path, index=False)
+
+        engine = create_engine(f"sqlite:///{os.path.join(directory, f'import_bench_{size}.db')}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(models.User.__table__.insert(), [{"uid": USER_UID, "email": "import-bench@example.com", "number": "8000000004", "name": "Bench", "role": "admin"}])
+            conn.execute(models.Restaurant.__table__.insert(), [{"restaurant_id": RESTAURANT_ID, "restaurant_name": "Import Bench", "admin_uid": USER_UID, "owner_uid": USER_UID}])
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(1))
+
+        started = time.perf_counter()
+        df = pd.read_csv(path) if file_format == "csv" else pd.read_excel(path)
+        read = time.perf_counter() - started
+        started = time.perf_counter()
+        items, errors = crud.parse_menu_frame(crud.normalize_menu_columns(df))
+        parse = time.perf_counter() - started
+        if errors:
+            raise AssertionError(f"Generated sheet has errors: {errors[:3]}")
+        with sessionmaker(bind=engine)() as db:
+            started = time.perf_counter()
+            created, errors = crud.insert_menu_items(db, RESTAURANT_ID, items)
+            db.commit()
+            insert = time.perf_counter() - started
+        total = read + parse + insert
+        print(f"{size:>7}  {created:>6}  {read:>6.2f}  {parse:>6.2f}  {insert:>6.2f}  {total:>6.2f}  {size / total:>8.0f}  {len(statements):>10}", flush=True)
+        engine.dispose()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the bulk menu upload stages over large files.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[2000, 10000])
+    parser.add_argument("--categories", type=int, default=40)
+    parser.add_argument("--format", choices=("csv", "xlsx"), default="csv")
+    parser.add_argument("--sorted", action="store_true", help="Keep each item's rows together instead of shuffling them")
+    args = parser.parse_args(argv)
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run(tmp, args.rows, args.categories, args.format, not args.sorted)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
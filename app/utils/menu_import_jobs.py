@@ -0,0 +1,220 @@
+"""
+Background menu imports (POST /menu/import_jobs).
+
+The upload is spooled to MENU_IMPORT_SPOOL_DIR as it arrives, a MenuImportJob is queued and the
+request returns. A pool of MENU_IMPORT_WORKERS threads then reads the file MENU_IMPORT_CHUNK_ROWS
+rows at a time (pandas chunks for CSV, openpyxl's read-only streaming for xlsx) and imports each
+chunk with crud_menu_import.import_menu_chunk in its own transaction, together with the job's
+progress and row errors, which clients poll. The menu snapshot is published once at the end.
+
+Jobs live in the worker process that received the upload; ones left unfinished by a stopped
+worker are failed at the next startup once MENU_IMPORT_STALE_SECONDS have passed.
+"""
+import asyncio
+import csv
+import logging
+import os
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import pandas as pd
+from fastapi import UploadFile
+
+from ..crud.crud_menu import publish_menu_snapshot
+from ..crud.crud_menu_import import (
+    MENU_IMPORT_REQUIRED_COLUMNS, normalize_menu_columns, import_menu_chunk, start_menu_import_job,
+    record_menu_import_progress, finish_menu_import_job, fail_stale_menu_import_jobs
+)
+
+logger = logging.getLogger(__name__)
+
+MENU_IMPORT_WORKERS = max(1, int(os.getenv("MENU_IMPORT_WORKERS", "2")))
+MENU_IMPORT_CHUNK_ROWS = max(1, int(os.getenv("MENU_IMPORT_CHUNK_ROWS", "2000"))) # Rows per transaction
+MENU_IMPORT_MAX_BYTES = int(os.getenv("MENU_IMPORT_MAX_BYTES", str(50 * 1024 * 1024))) # Larger uploads get a 413
+MENU_IMPORT_SPOOL_DIR = os.getenv("MENU_IMPORT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "menu_imports"))
+MENU_IMPORT_EXTENSIONS = (".csv", ".xlsx", ".xls")
+SPOOL_READ_BYTES = 1024 * 1024
+
+class MenuImportTooLarge(Exception):
+    pass
+
+def menu_import_extension(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """The sheet format of an upload, from its file name or else its content type; None if unsupported."""
+    name = (filename or "").lower()
+    for extension in MENU_IMPORT_EXTENSIONS:
+        if name.endswith(extension):
+            return extension
+    content_type = content_type or ""
+    if "csv" in content_type:
+        return ".csv"
+    if "spreadsheetml" in content_type:
+        return ".xlsx"
+    if "excel" in content_type:
+        return ".xls"
+    return None
+
+def read_sheet_chunks(path: str, chunk_rows: int) -> Tuple[List[str], Optional[int], Iterator[pd.DataFrame]]:
+    """
+    (normalized header, data rows or None if unknown, chunks) of a spooled sheet. Chunks carry a
+    continuing index from 0, so a row's sheet row is its index + 2, and every cell as text or None.
+    """
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            total = sum(1 for row in reader if row) # pandas skips only empty lines too
+        chunks = pd.read_csv(path, chunksize=chunk_rows, dtype=str, encoding="utf-8-sig", skip_blank_lines=True) if header else iter(())
+        return list(normalize_menu_columns(pd.DataFrame(columns=header)).columns), total, chunks
+    if path.endswith(".xlsx"):
+        return _read_xlsx_chunks(path, chunk_rows)
+    # Legacy .xls cannot be streamed; read it whole and hand it out in chunks
+    df = pd.read_excel(path, dtype=str)
+    return list(normalize_menu_columns(pd.DataFrame(columns=df.columns)).columns), len(df), (
+        df.iloc[start:start + chunk_rows] for start in range(0, len(df), chunk_rows)
+    )
+
+def _read_xlsx_chunks(path: str, chunk_rows: int) -> Tuple[List[str], Optional[int], Iterator[pd.DataFrame]]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    sheet = workbook.worksheets[0] if workbook.worksheets else None
+    rows = sheet.iter_rows(values_only=True) if sheet is not None else iter(())
+    header = ["" if cell is None else str(cell) for cell in next(rows, ())]
+    # max_row comes from the sheet's dimension record, which some writers leave out
+    total = sheet.max_row - 1 if sheet is not None and sheet.max_row else None
+
+    def chunks() -> Iterator[pd.DataFrame]:
+        # Blank rows are dropped but still counted, so the index keeps matching the sheet's rows
+        batch, index = [], []
+        try:
+            for position, row in enumerate(rows):
+                if all(cell is None for cell in row):
+                    continue
+                batch.append(tuple(None if cell is None else str(cell) for cell in row[:len(header)]))
+                index.append(position)
+                if len(batch) == chunk_rows:
+                    yield pd.DataFrame(batch, columns=header, index=index, dtype=object)
+                    batch, index = [], []
+            if batch:
+                yield pd.DataFrame(batch, columns=header, index=index, dtype=object)
+        finally:
+            workbook.close()
+
+    return list(normalize_menu_columns(pd.DataFrame(columns=header)).columns), total, chunks()
+
+class MenuImportRunner:
+    def __init__(self, workers: int = MENU_IMPORT_WORKERS, chunk_rows: int = MENU_IMPORT_CHUNK_ROWS,
+                 spool_dir: str = MENU_IMPORT_SPOOL_DIR, max_bytes: int = MENU_IMPORT_MAX_BYTES):
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.spool_dir = spool_dir
+        self.max_bytes = max_bytes
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._cleanup: Optional[asyncio.Task] = None
+
+    async def spool(self, file: UploadFile, extension: str) -> str:
+        """Writes the upload to the spool directory a block at a time; returns its path."""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, f"{uuid.uuid4().hex}{extension}")
+        size = 0
+        try:
+            with open(path, "wb") as f:
+                while True:
+                    block = await file.read(SPOOL_READ_BYTES)
+                    if not block:
+                        break
+                    size += len(block)
+                    if size > self.max_bytes:
+                        raise MenuImportTooLarge(f"The file exceeds the {self.max_bytes // (1024 * 1024)} MB import limit")
+                    f.write(block)
+        except BaseException:
+            self._remove(path)
+            raise
+        return path
+
+    def submit(self, job_id: str, restaurant_id: str, path: str) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="menu-import")
+        self._executor.submit(self.run, job_id, restaurant_id, path)
+
+    def run(self, job_id: str, restaurant_id: str, path: str) -> None:
+        """Imports a spooled sheet chunk by chunk, recording progress on the job."""
+        from ..database import SessionLocal
+
+        with SessionLocal() as db:
+            try:
+                header, total, chunks = read_sheet_chunks(path, self.chunk_rows)
+                missing = [column for column in MENU_IMPORT_REQUIRED_COLUMNS if column not in header]
+                if missing:
+                    finish_menu_import_job(db, job_id, "failed", f"Missing required column: {missing[0]}")
+                    return
+                start_menu_import_job(db, job_id, total)
+
+                seen, pending, created, errors = {}, None, 0, 0
+                chunk = next(chunks, None)
+                while chunk is not None:
+                    following = next(chunks, None)
+                    normalize_menu_columns(chunk)
+                    chunk_created, row_errors, pending = import_menu_chunk(
+                        db, restaurant_id, chunk, seen, pending, final=following is None
+                    )
+                    record_menu_import_progress(db, job_id, len(chunk), chunk_created, row_errors)
+                    db.commit()
+                    created, errors = created + chunk_created, errors + len(row_errors)
+                    chunk = following
+
+                if created:
+                    publish_menu_snapshot(db, restaurant_id)
+                    db.commit()
+                if not created and not errors:
+                    message = "No valid data rows found in the file to create menu items."
+                else:
+                    message = f"Created {created} menu items" + (f"; {errors} rows had errors." if errors else ".")
+                finish_menu_import_job(db, job_id, "completed", message)
+                logger.info(f"Menu import {job_id} for restaurant {restaurant_id}: {message}")
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Menu import {job_id} for restaurant {restaurant_id} failed: {e}", exc_info=True)
+                try:
+                    finish_menu_import_job(db, job_id, "failed", f"Import stopped: {e}. Items from chunks already processed were kept.")
+                except Exception as finish_error:
+                    logger.error(f"Failed to mark menu import {job_id} as failed: {finish_error}")
+            finally:
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def fail_stale_jobs(self) -> int:
+        from ..database import SessionLocal
+
+        with SessionLocal() as db:
+            return fail_stale_menu_import_jobs(db)
+
+    def start(self) -> None:
+        """Fails jobs abandoned by stopped workers, off the event loop."""
+        async def fail_stale() -> None:
+            try:
+                failed = await asyncio.get_running_loop().run_in_executor(None, self.fail_stale_jobs)
+                if failed:
+                    logger.warning(f"Failed {failed} menu import jobs left unfinished by a stopped worker")
+            except Exception as e:
+                logger.error(f"Failed to clean up stale menu import jobs: {e}")
+
+        self._cleanup = asyncio.get_running_loop().create_task(fail_stale())
+
+    async def stop(self) -> None:
+        """Waits for running imports; queued ones are dropped, and failed as stale by a later startup."""
+        if self._cleanup is not None:
+            await asyncio.gather(self._cleanup, return_exceptions=True)
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, lambda: executor.shutdown(wait=True, cancel_futures=True))
+
+menu_import_runner = MenuImportRunner()
@@ -0,0 +1,414 @@
+"""
+Per-worker search over menu item names, descriptions and categories (GET /menu/search).
+
+Each restaurant gets an in-memory index built from the items of its cached menu (see menu_cache):
+a prefix trie over the words of item names and one over descriptions and category names, whose
+nodes know the items below them, and a trigram index over the vocabulary for typo tolerance. A
+search costs the menu version read; after a menu write bumped it, the index is brought up to the
+new snapshot by re-indexing only the items whose entries changed.
+
+Every word of the query must match, as a whole word, a prefix or, for words of
+MENU_SEARCH_TYPO_MIN_LENGTH letters or more, within one typo (two from eight letters). Name matches
+outrank description and category ones, exact words outrank prefixes, and typos count for less.
+Items sold most over the last MENU_SEARCH_POPULARITY_DAYS days (from the item sales rollups) get up
+to MENU_SEARCH_POPULARITY_WEIGHT on top, and available items come first. Restaurants without an
+index yet are answered from the database (crud_menu.search_menu_items) while theirs is built in
+the background; the least recently searched ones are dropped past MENU_SEARCH_MAX_RESTAURANTS.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..crud.crud_menu import get_active_menu_restaurant_ids
+from ..crud.crud_rollups import get_item_quantities_sold
+from .menu_cache import menu_cache
+from .text_utils import search_words
+
+logger = logging.getLogger(__name__)
+
+MENU_SEARCH_MAX_RESTAURANTS = int(os.getenv("MENU_SEARCH_MAX_RESTAURANTS", "500")) # Indexes kept per worker
+MENU_SEARCH_WARM_RESTAURANTS = int(os.getenv("MENU_SEARCH_WARM_RESTAURANTS", "100")) # Indexes built at startup (0: none)
+MENU_SEARCH_POPULARITY_DAYS = int(os.getenv("MENU_SEARCH_POPULARITY_DAYS", "30"))
+MENU_SEARCH_POPULARITY_TTL = int(os.getenv("MENU_SEARCH_POPULARITY_TTL", "600")) # Seconds between reloads of sales counts
+MENU_SEARCH_POPULARITY_WEIGHT = 1.0 # Bonus of the best seller; a prefix and a whole word are 1 apart
+MENU_SEARCH_TYPO_MIN_LENGTH = 4
+MENU_SEARCH_DEFAULT_LIMIT = 20
+MENU_SEARCH_MAX_LIMIT = 50
+
+NAME_WORD, NAME_PREFIX = 3.0, 2.0
+TEXT_WORD, TEXT_PREFIX = 1.5, 1.0
+TYPO_FACTOR = 0.6
+
+def _trigrams(word: str) -> List[str]:
+    # Padded at the start only, so a prefix of a word shares the word's leading trigrams
+    padded = "  " + word
+    return [padded[i:i + 3] for i in range(len(word))]
+
+def _prefix_distance(term: str, word: str, limit: int) -> int:
+    """
+    Edit distance (adjacent transpositions included) between `term` and the closest prefix of
+    `word`; anything above `limit` is reported as limit + 1.
+    """
+    word = word[:len(term) + limit]
+    before, previous = None, list(range(len(word) + 1))
+    for i in range(1, len(term) + 1):
+        current = [i] + [0] * len(word)
+        for j in range(1, len(word) + 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (term[i - 1] != word[j - 1]))
+            if i > 1 and j > 1 and term[i - 1] == word[j - 2] and term[i - 2] == word[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous)
+
+class _Node:
+    __slots__ = ("children", "below", "ends")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.below: Dict[int, int] = {} # Item -> occurrences of words through this node
+        self.ends: Dict[int, int] = {} # Item -> occurrences of the word ending here
+
+class _Trie:
+    def __init__(self):
+        self.root = _Node()
+
+    def add(self, word: str, item_id: int) -> None:
+        node = self.root
+        for char in word:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _Node()
+            node = child
+            node.below[item_id] = node.below.get(item_id, 0) + 1
+        node.ends[item_id] = node.ends.get(item_id, 0) + 1
+
+    def remove(self, word: str, item_id: int) -> None:
+        path, node = [], self.root
+        for char in word:
+            path.append((node, char))
+            node = node.children[char]
+            _decrement(node.below, item_id)
+        _decrement(node.ends, item_id)
+        for parent, char in reversed(path):
+            if parent.children[char].below:
+                break
+            del parent.children[char]
+
+    def find(self, prefix: str) -> Optional[_Node]:
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+def _decrement(counts: Dict[int, int], item_id: int) -> None:
+    if counts[item_id] == 1:
+        del counts[item_id]
+    else:
+        counts[item_id] -= 1
+
+class _Doc(NamedTuple):
+    entry: Dict # As in the GET /menu body
+    body: bytes
+    name_words: Tuple[str, ...]
+    text_words: Tuple[str, ...]
+
+class MenuSearchIndex:
+    """One restaurant's index. Callers hold `lock` around update, set_popularity and search."""
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.popularity_loaded_at: Optional[float] = None
+        self.lock = threading.Lock()
+        self._docs: Dict[int, _Doc] = {}
+        self._positions: Dict[int, int] = {} # Menu order (by name), which breaks ties
+        self._popularity: Dict[int, float] = {}
+        self._names = _Trie()
+        self._texts = _Trie()
+        self._vocabulary: Dict[str, int] = {} # Word -> occurrences in both tries
+        self._grams: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def update(self, version: int, entries: List[Dict]) -> int:
+        """Brings the index to a menu's items, re-indexing only those that changed; returns how many did."""
+        current = {entry["id"]: entry for entry in entries}
+        changed = 0
+        for item_id in [item_id for item_id in self._docs if item_id not in current]:
+            self._remove(item_id)
+            changed += 1
+        for item_id, entry in current.items():
+            doc = self._docs.get(item_id)
+            if doc is not None and doc.entry == entry:
+                continue
+            if doc is not None:
+                self._remove(item_id)
+            self._add(entry)
+            changed += 1
+        self._positions = {entry["id"]: position for position, entry in enumerate(entries)}
+        self.version = version
+        return changed
+
+    def set_popularity(self, quantities: Dict[int, int]) -> None:
+        top = max(quantities.values(), default=0)
+        self._popularity = {item_id: MENU_SEARCH_POPULARITY_WEIGHT * math.log1p(quantity) / math.log1p(top)
+                            for item_id, quantity in quantities.items() if quantity > 0}
+        self.popularity_loaded_at = time.monotonic()
+
+    def _add(self, entry: Dict) -> None:
+        item_id = entry["id"]
+        category = entry.get("category") or {}
+        doc = _Doc(
+            entry,
+            json.dumps(entry, separators=(",", ":"), ensure_ascii=False).encode("utf-8"),
+            tuple(search_words(entry.get("name"))),
+            tuple(search_words(entry.get("description")) + search_words(category.get("name")))
+        )
+        self._docs[item_id] = doc
+        for trie, words in ((self._names, doc.name_words), (self._texts, doc.text_words)):
+            for word in words:
+                trie.add(word, item_id)
+                self._count(word, 1)
+
+    def _remove(self, item_id: int) -> None:
+        doc = self._docs.pop(item_id)
+        for trie, words in ((self._names, doc.name_words), (self._texts, doc.text_words)):
+            for word in words:
+                trie.remove(word, item_id)
+                self._count(word, -1)
+
+    def _count(self, word: str, delta: int) -> None:
+        previous = self._vocabulary.get(word, 0)
+        if previous + delta:
+            self._vocabulary[word] = previous + delta
+            if not previous:
+                for gram in _trigrams(word):
+                    self._grams.setdefault(gram, set()).add(word)
+        else:
+            del self._vocabulary[word]
+            for gram in set(_trigrams(word)):
+                words = self._grams[gram]
+                words.discard(word)
+                if not words:
+                    del self._grams[gram]
+
+    def _typo_words(self, term: str) -> List[str]:
+        """Indexed words that `term` is a prefix of, or a word itself, give or take a typo or two."""
+        if len(term) < MENU_SEARCH_TYPO_MIN_LENGTH:
+            return []
+        max_edits = 1 if len(term) < 8 else 2
+        grams = set(_trigrams(term))
+        # Each edit changes at most four of the term's trigrams: a substitution three, an adjacent
+        # transposition the four that overlap the swapped pair
+        needed = max(2, len(grams) - 4 * max_edits)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for word in self._grams.get(gram, ()):
+                shared[word] = shared.get(word, 0) + 1
+        return [word for word, count in shared.items() if count >= needed and not word.startswith(term)
+                and _prefix_distance(term, word, max_edits) <= max_edits]
+
+    def _term_scores(self, term: str) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for trie, word_score, prefix_score in ((self._texts, TEXT_WORD, TEXT_PREFIX), (self._names, NAME_WORD, NAME_PREFIX)):
+            node = trie.find(term)
+            if node is None:
+                continue
+            for item_id in node.below:
+                score = word_score if item_id in node.ends else prefix_score
+                if score > scores.get(item_id, 0.0):
+                    scores[item_id] = score
+        for word in self._typo_words(term):
+            for trie, prefix_score in ((self._texts, TEXT_PREFIX), (self._names, NAME_PREFIX)):
+                node = trie.find(word)
+                if node is None:
+                    continue
+                score = prefix_score * TYPO_FACTOR
+                for item_id in node.ends:
+                    if score > scores.get(item_id, 0.0):
+                        scores[item_id] = score
+        return scores
+
+    def search(self, words: List[str], limit: int) -> List[bytes]:
+        """The GET /menu entries of the best `limit` items matching every word, best first."""
+        scores: Optional[Dict[int, float]] = None
+        for term in dict.fromkeys(words):
+            term_scores = self._term_scores(term)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {item_id: score + term_scores[item_id] for item_id, score in scores.items() if item_id in term_scores}
+            if not scores:
+                return []
+        docs, popularity, positions = self._docs, self._popularity, self._positions
+        best = heapq.nsmallest(limit, scores.items(), key=lambda match: (
+            docs[match[0]].entry.get("available") is False, -(match[1] + popularity.get(match[0], 0.0)), positions[match[0]]
+        ))
+        return [docs[item_id].body for item_id, _ in best]
+
+def popular_since(today: Optional[date] = None) -> datetime:
+    """Start of the sales window that ranks search results."""
+    today = today or datetime.utcnow().date()
+    return datetime.combine(today - timedelta(days=MENU_SEARCH_POPULARITY_DAYS), datetime.min.time())
+
+class MenuSearch:
+    def __init__(self, max_restaurants: int = MENU_SEARCH_MAX_RESTAURANTS, warm_restaurants: int = MENU_SEARCH_WARM_RESTAURANTS,
+                 popularity_ttl: int = MENU_SEARCH_POPULARITY_TTL):
+        self.max_restaurants = max_restaurants
+        self.warm_restaurants = warm_restaurants
+        self.popularity_ttl = popularity_ttl
+        self._indexes: "OrderedDict[str, MenuSearchIndex]" = OrderedDict() # Least recently used first
+        self._lock = threading.Lock() # Searches run in the threadpool
+        self._building: Set[str] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._warmer: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.evictions = 0
+
+    def search(self, db: Session, restaurant_id: str, query: str, limit: int = MENU_SEARCH_DEFAULT_LIMIT) -> Optional[List[bytes]]:
+        """
+        GET /menu entries of the best matches for `query`, or None if the restaurant has no index
+        yet; one is then built in the background and the caller asks the database instead.
+        """
+        words = search_words(query)
+        if not words:
+            return []
+        with self._lock:
+            index = self._indexes.get(restaurant_id)
+            if index is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._indexes.move_to_end(restaurant_id)
+        if index is None:
+            self._build_in_background(restaurant_id)
+            return None
+        self.refresh(db, restaurant_id, index)
+        with index.lock:
+            return index.search(words, limit)
+
+    def refresh(self, db: Session, restaurant_id: str, index: MenuSearchIndex) -> None:
+        """Brings an index to the restaurant's current menu version and reloads stale sales counts."""
+        menu = menu_cache.get(db, restaurant_id)
+        loaded_at = index.popularity_loaded_at
+        popularity_stale = loaded_at is None or time.monotonic() - loaded_at > self.popularity_ttl
+        if index.version is not None and index.version >= menu.version and not popularity_stale:
+            return
+        with index.lock:
+            if index.version is None or index.version < menu.version:
+                changed = index.update(menu.version, json.loads(menu.items))
+                logger.debug(f"Menu search index of restaurant {restaurant_id} at version {menu.version}; {changed} items re-indexed")
+            if popularity_stale:
+                index.set_popularity(get_item_quantities_sold(db, restaurant_id, popular_since()))
+
+    def load(self, db: Session, restaurant_id: str) -> MenuSearchIndex:
+        """Builds a restaurant's index and keeps it, evicting the least recently searched ones past the limit."""
+        index = MenuSearchIndex()
+        self.refresh(db, restaurant_id, index)
+        with self._lock:
+            self._indexes[restaurant_id] = index
+            self._indexes.move_to_end(restaurant_id)
+            self.builds += 1
+            while len(self._indexes) > self.max_restaurants:
+                self._indexes.popitem(last=False)
+                self.evictions += 1
+        return index
+
+    def _build_in_background(self, restaurant_id: str) -> None:
+        with self._lock:
+            if restaurant_id in self._building:
+                return
+            self._building.add(restaurant_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="menu-search")
+            executor = self._executor
+        executor.submit(self._build, restaurant_id)
+
+    def _build(self, restaurant_id: str) -> None:
+        from ..database import SessionLocal
+
+        try:
+            with SessionLocal() as db:
+                self.load(db, restaurant_id)
+        except Exception as e:
+            logger.error(f"Failed to build the menu search index of restaurant {restaurant_id}: {e}")
+        finally:
+            with self._lock:
+                self._building.discard(restaurant_id)
+
+    def invalidate(self, restaurant_id: Optional[str] = None) -> None:
+        """Drops one restaurant's index, or all of them."""
+        with self._lock:
+            if restaurant_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(restaurant_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "restaurants": len(self._indexes),
+                "items": sum(len(index) for index in self._indexes.values()),
+                "max_restaurants": self.max_restaurants,
+                "hits": self.hits,
+                "misses": self.misses,
+                "builds": self.builds,
+                "evictions": self.evictions
+            }
+
+    def warm(self) -> int:
+        """Builds the indexes of the most active open restaurants; returns how many were built."""
+        from ..database import SessionLocal
+
+        warmed = 0
+        with SessionLocal() as db:
+            for restaurant_id in get_active_menu_restaurant_ids(db, min(self.warm_restaurants, self.max_restaurants)):
+                try:
+                    self.load(db, restaurant_id)
+                    warmed += 1
+                except Exception as e:
+                    logger.error(f"Failed to warm the menu search index of restaurant {restaurant_id}: {e}")
+                db.rollback() # Each restaurant reads its own version
+        return warmed
+
+    async def _warm_in_background(self) -> None:
+        try:
+            warmed = await asyncio.get_running_loop().run_in_executor(None, self.warm)
+            logger.info(f"Menu search indexes built for {warmed} restaurants")
+        except Exception as e:
+            logger.error(f"Failed to warm the menu search indexes: {e}")
+
+    def start(self) -> None:
+        """Builds indexes without holding up startup; searches meanwhile are answered from the database."""
+        if self.warm_restaurants <= 0 or (self._warmer is not None and not self._warmer.done()):
+            return
+        self._warmer = asyncio.get_running_loop().create_task(self._warm_in_background())
+
+    async def stop(self) -> None:
+        if self._warmer is not None:
+            self._warmer.cancel()
+            await asyncio.gather(self._warmer, return_exceptions=True)
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            await asyncio.get_running_loop().run_in_executor(None, lambda: executor.shutdown(wait=True, cancel_futures=True))
+
+menu_search = MenuSearch()
@@ -0,0 +1,83 @@
+"""
+Moves orders closed for more than ORDER_ARCHIVE_AFTER_DAYS into the archive tables (see
+crud_archive), in batches of one transaction each.
+
+Run it from cron:
+    python -m app.utils.order_archiver                      # DATABASE_URL, ORDER_ARCHIVE_AFTER_DAYS
+    python -m app.utils.order_archiver --days 30 --batch-size 1000
+
+or let each API worker run it every ORDER_ARCHIVE_INTERVAL_SECONDS (off unless set). Concurrent
+runs are safe: on PostgreSQL each batch skips the rows another run has locked.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from typing import Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import DATABASE_URL
+from app.crud.crud_archive import ORDER_ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, archive_closed_orders
+
+logger = logging.getLogger(__name__)
+
+ORDER_ARCHIVE_INTERVAL = float(os.getenv("ORDER_ARCHIVE_INTERVAL_SECONDS", "0")) # 0: only archive from the command
+
+class OrderArchiver:
+    def __init__(self, interval: float = ORDER_ARCHIVE_INTERVAL, older_than_days: int = ORDER_ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE):
+        self.interval = interval
+        self.older_than_days = older_than_days
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def _archive_periodically(self) -> None:
+        from ..database import SessionLocal
+
+        def archive() -> int:
+            with SessionLocal() as db:
+                return archive_closed_orders(db, self.older_than_days, self.batch_size)
+
+        while True:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, archive)
+            except Exception as e:
+                logger.error(f"Failed to archive closed orders: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.get_running_loop().create_task(self._archive_periodically())
+        logger.info(f"Archiving orders closed over {self.older_than_days} days ago every {self.interval:.0f}s")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+order_archiver = OrderArchiver()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move closed orders into the archive tables.")
+    parser.add_argument("--url", default=DATABASE_URL, help="Database URL (default: DATABASE_URL)")
+    parser.add_argument("--days", type=int, default=ORDER_ARCHIVE_AFTER_DAYS, help="Archive orders closed more than this many days ago")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="Orders moved per transaction")
+    parser.add_argument("--max-batches", type=int, help="Stop after this many batches (default: until none are left)")
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.url)
+    started = time.perf_counter()
+    with sessionmaker(bind=engine)() as db:
+        archived = archive_closed_orders(db, max(0, args.days), max(1, args.batch_size), args.max_batches)
+    engine.dispose()
+    logger.info(f"Archived {archived} orders in {time.perf_counter() - started:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,287 @@
+"""
+Receipt PDF rendering off the event loop.
+
+PDFs are drawn with reportlab in a small process pool and cached on disk by
+(order_id, updated_at), so reprints are served from the cache and any change to the order
+(status, payment, items) produces a fresh receipt. The cache is bounded in bytes and evicts the
+least recently read files first.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO, RawIOBase
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..crud.crud_archive import HOT_ORDER_TABLES, ARCHIVED_ORDER_TABLES
+from .timezone import utc_to_ist
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_RENDER_WORKERS = max(1, int(os.getenv("RECEIPT_RENDER_WORKERS", "2")))
+RECEIPT_RENDER_MAX_PENDING = max(1, int(os.getenv("RECEIPT_RENDER_MAX_PENDING", "16"))) # Renders in flight before callers queue
+RECEIPT_CACHE_DIR = os.getenv("RECEIPT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "receipt_cache"))
+RECEIPT_CACHE_MAX_BYTES = int(os.getenv("RECEIPT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RECEIPT_BATCH_CHUNK_SIZE = 50 # Orders loaded and rendered per step of a zip export
+
+def receipt_cache_key(order: models.Order) -> str:
+    version = order.updated_at or order.created_at
+    return f"{order.id}|{version.isoformat() if version else ''}"
+
+def receipt_filename(order_id: str) -> str:
+    return f"receipt_order_{order_id}.pdf"
+
+def load_receipt_lines(db: Session, order_ids: List[str], item_model=models.OrderItem) -> Dict[str, List[tuple]]:
+    """(quantity, item name, unit price) per order line, for all `order_ids` in one query (models.ArchivedOrderItem for archived orders)."""
+    lines: Dict[str, List[tuple]] = {order_id: [] for order_id in order_ids}
+    rows = db.query(item_model.order_id, item_model.quantity, models.MenuItem.name, item_model.price)\
+        .outerjoin(models.MenuItem, models.MenuItem.id == item_model.item_id)\
+        .filter(item_model.order_id.in_(order_ids))\
+        .order_by(item_model.order_id, item_model.id)
+    for order_id, quantity, name, price in rows:
+        lines[order_id].append((quantity, name, price))
+    return lines
+
+def receipt_payload(order: models.Order, lines: List[tuple]) -> Dict:
+    """Plain, picklable snapshot of everything the receipt shows."""
+    return {
+        "order_id": order.id,
+        "user_uid": order.user_uid,
+        "restaurant_id": order.restaurant_id,
+        "table_number": order.table_number,
+        "created_at": utc_to_ist(order.created_at).strftime('%Y-%m-%d %I:%M %p') if order.created_at else 'N/A',
+        "created_at_tuple": utc_to_ist(order.created_at).timetuple()[:6] if order.created_at else (1980, 1, 1, 0, 0, 0),
+        "status": order.status,
+        "payment_status": order.payment_status,
+        "items": lines,
+        "total_cost": order.total_cost,
+    }
+
+def render_receipt_pdf(payload: Dict) -> bytes:
+    """Draws the receipt. Runs in a worker process, so it only touches the payload."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer, pagesize=letter)
+    p.setFont("Helvetica-Bold", 16)
+    p.drawString(200, 750, "Order Receipt")
+    p.setFont("Helvetica", 12)
+    p.drawString(50, 720, f"Order ID: {payload['order_id']}")
+    p.drawString(50, 700, f"User ID: {payload['user_uid']}")
+    p.drawString(50, 680, f"Restaurant ID: {payload['restaurant_id']}")
+    y = 660
+    if payload["table_number"]:
+        p.drawString(50, y, f"Table Number: {payload['table_number']}")
+        y -= 20
+    p.drawString(50, y, f"Created At: {payload['created_at']}")
+    p.drawString(50, y - 20, f"Status: {payload['status']}")
+    p.drawString(50, y - 40, f"Payment Status: {payload['payment_status']}")
+
+    y -= 70
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(50, y, "Items:")
+    y -= 20
+    p.setFont("Helvetica", 12)
+    for quantity, name, price in payload["items"]:
+        if y < 60: # Continue long orders on a new page
+            p.showPage()
+            p.setFont("Helvetica", 12)
+            y = 750
+        p.drawString(60, y, f"{quantity} x {name} @ {price} each")
+        y -= 18
+    p.drawString(50, y - 10, f"Total: {payload['total_cost']}")
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
+
+class ReceiptCache:
+    """Size-bounded directory of rendered PDFs, evicting the least recently used files first."""
+    def __init__(self, directory: str = RECEIPT_CACHE_DIR, max_bytes: int = RECEIPT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None # Bytes on disk; scanned lazily, then tracked on writes
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".pdf")
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path) # Recency for eviction
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path) # Atomic, so readers never see a partial PDF
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        try:
+            return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".pdf")]
+        except FileNotFoundError:
+            return []
+
+    def _scan_size(self) -> int:
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _evict(self) -> None:
+        # Rescan: other worker processes share the directory, so the tracked size is only a trigger
+        entries = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._entries()))
+        size = sum(entry_size for _, entry_size, _ in entries)
+        target = self.max_bytes * 0.9 # Leave headroom so every write does not trigger a scan
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                size -= entry_size
+            except FileNotFoundError:
+                pass
+        self._size = size
+
+class _ZipStream(RawIOBase):
+    """Write-only sink for zipfile that hands back what was written since the last drain."""
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class ReceiptRenderer:
+    """
+    Renders receipts in a process pool so reportlab never runs on the event loop. At most
+    `max_pending` renders are in flight; further callers wait. Concurrent requests for the same
+    receipt share one render, and finished PDFs go to the disk cache.
+    """
+    def __init__(self, cache: ReceiptCache, workers: int = RECEIPT_RENDER_WORKERS, max_pending: int = RECEIPT_RENDER_MAX_PENDING):
+        self.cache = cache
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._loop = None # Semaphore and in-flight futures belong to one event loop
+        self._pending: Optional[asyncio.Semaphore] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._pending = asyncio.Semaphore(self.max_pending)
+            self._in_flight = {}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def cached(self, key: str) -> Optional[bytes]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.cache.get, key)
+
+    async def render(self, key: str, payload: Dict) -> bytes:
+        pdf = await self.cached(key)
+        if pdf is not None:
+            return pdf
+        self._bind_loop()
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key])
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            pdf = await self._render(payload)
+            await asyncio.get_running_loop().run_in_executor(None, self.cache.put, key, pdf)
+            future.set_result(pdf)
+            return pdf
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # Mark retrieved when nobody else was waiting
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def _render(self, payload: Dict) -> bytes:
+        loop = asyncio.get_running_loop()
+        async with self._pending:
+            try:
+                return await loop.run_in_executor(self._pool(), render_receipt_pdf, payload)
+            except BrokenProcessPool:
+                logger.error("Receipt render pool died; restarting it for the next request.")
+                self._executor = None
+                raise
+
+    async def iter_zip(self, order_ids: List[str], session_factory: Callable[[], Session]) -> AsyncIterator[bytes]:
+        """Streams a zip of the receipts for `order_ids`, loading and rendering them a chunk at a time."""
+        loop = asyncio.get_running_loop()
+        stream = _ZipStream()
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as archive: # PDFs are already compressed
+            for offset in range(0, len(order_ids), RECEIPT_BATCH_CHUNK_SIZE):
+                chunk = order_ids[offset:offset + RECEIPT_BATCH_CHUNK_SIZE]
+                entries = await loop.run_in_executor(None, _load_receipt_chunk, session_factory, chunk)
+                pdfs = await asyncio.gather(*(self.render(key, payload) for key, payload in entries))
+                for (_, payload), pdf in zip(entries, pdfs):
+                    info = zipfile.ZipInfo(receipt_filename(payload["order_id"]), date_time=payload["created_at_tuple"])
+                    archive.writestr(info, pdf)
+                yield stream.drain()
+        yield stream.drain()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+def _load_receipt_chunk(session_factory: Callable[[], Session], order_ids: List[str]) -> List[tuple]:
+    db = session_factory()
+    try:
+        orders, lines = {}, {}
+        for tables in (HOT_ORDER_TABLES, ARCHIVED_ORDER_TABLES):
+            missing = [order_id for order_id in order_ids if order_id not in orders]
+            if not missing:
+                break
+            found = {order.id: order for order in db.query(tables.order).filter(tables.order.id.in_(missing))}
+            orders.update(found)
+            lines.update(load_receipt_lines(db, list(found), tables.item))
+        return [
+            (receipt_cache_key(orders[order_id]), receipt_payload(orders[order_id], lines[order_id]))
+            for order_id in order_ids if order_id in orders
+        ]
+    finally:
+        db.close()
+
+receipt_renderer = ReceiptRenderer(ReceiptCache())
@@ -0,0 +1,77 @@
+"""
+Rebuilds the hourly/daily sales rollups from raw orders.
+
+The created_at span is split into chunks that are aggregated in parallel worker processes
+(each with its own connection); the partial buckets are merged and written in one transaction,
+replacing the existing rollups for the selected restaurants.
+
+Usage:
+    python -m app.utils.rollup_backfill                         # all restaurants, DATABASE_URL
+    python -m app.utils.rollup_backfill --restaurant-id r1 --restaurant-id r2 --workers 8
+
+Live status changes that land while a rebuild is running can be lost when the rollups are
+swapped, so run it when order traffic is quiet (or re-run it for the affected restaurants).
+"""
+import argparse
+import logging
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.database import DATABASE_URL
+from app.crud.crud_rollups import (
+    ROLLUP_CHUNK_DAYS, aggregate_sales_range, merge_sales_aggregates, replace_sales_rollups, sales_rollup_chunks
+)
+
+logger = logging.getLogger(__name__)
+
+def _session_for(url: str):
+    return sessionmaker(bind=create_engine(url, poolclass=NullPool))()
+
+def _aggregate_chunk(url: str, start, end, restaurant_ids: Optional[List[str]]):
+    """Worker: scans one created_at range in its own process and returns the partial buckets."""
+    db = _session_for(url)
+    try:
+        return aggregate_sales_range(db, start, end, restaurant_ids)
+    finally:
+        db.close()
+
+def backfill(url: str, restaurant_ids: Optional[List[str]] = None, workers: int = 4, chunk_days: int = ROLLUP_CHUNK_DAYS):
+    db = _session_for(url)
+    try:
+        chunks = sales_rollup_chunks(db, restaurant_ids, chunk_days)
+        logger.info(f"Aggregating {len(chunks)} chunks of {chunk_days} days with {workers} workers")
+        aggregates = ({}, {})
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_aggregate_chunk, url, start, end, restaurant_ids) for start, end in chunks]
+                for future in futures:
+                    merge_sales_aggregates(aggregates, future.result())
+        else:
+            for start, end in chunks:
+                merge_sales_aggregates(aggregates, aggregate_sales_range(db, start, end, restaurant_ids))
+        return replace_sales_rollups(db, aggregates, restaurant_ids)
+    finally:
+        db.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the sales rollup tables from raw orders.")
+    parser.add_argument("--url", default=DATABASE_URL, help="Database URL (default: DATABASE_URL)")
+    parser.add_argument("--restaurant-id", action="append", dest="restaurant_ids", help="Only rebuild this restaurant (repeatable)")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes aggregating chunks in parallel")
+    parser.add_argument("--chunk-days", type=int, default=ROLLUP_CHUNK_DAYS, help="Days of orders per chunk")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    sales_rows, item_rows = backfill(args.url, args.restaurant_ids, max(1, args.workers), max(1, args.chunk_days))
+    logger.info(f"Wrote {sales_rows} sales and {item_rows} item rollup rows in {time.perf_counter() - started:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -1,7 +1,15 @@
 import re
+import unicodedata
+from typing import List
  
 def slugify(text: str) -> str:
     # A simple slugify function, can be enhanced
     text = text.lower()
     text = re.sub(r'[^a-z0-9]+', '-', text).strip('-')
-    return text 
\ No newline at end of file
+    return text 
+
+def search_words(text: str) -> List[str]:
+    # Case- and accent-insensitive words of a text, as the menu search indexes and matches them
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    return re.findall(r"[^\W_]+", text)